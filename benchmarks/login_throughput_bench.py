@@ -0,0 +1,81 @@
+"""
+Benchmark del rendimiento de bcrypt en el login de user_service.
+
+Verifica contraseñas con el PasswordHasher de user_service (pool de procesos) a
+distintos costes y muestra logins/s totales y por núcleo, y la latencia p50/p95
+de cada verificación. Con --concurrency mayor que PASSWORD_MAX_PENDING se ve la
+parte de peticiones que recibirían 429. No necesita base de datos.
+
+Uso:
+    python benchmarks/login_throughput_bench.py --costs 10 11 12 13 --logins 200 --workers 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "user_service"))
+from passwords import PasswordHasher, _hash  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_login(hasher, hashed):
+    start = time.perf_counter()
+    try:
+        ok = hasher.verify(PASSWORD, hashed)
+    except HTTPException:
+        return time.perf_counter() - start, None
+    return time.perf_counter() - start, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--logins", type=int, default=200, help="verificaciones por coste")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos de bcrypt")
+    parser.add_argument("--concurrency", type=int, default=None, help="logins simultáneos (por defecto, 4 por proceso)")
+    parser.add_argument("--max-pending", type=int, default=None, help="PASSWORD_MAX_PENDING (por defecto, --concurrency)")
+    args = parser.parse_args()
+
+    concurrency = args.concurrency or args.workers * 4
+    max_pending = args.max_pending or concurrency
+
+    print(f"procesos={args.workers} concurrencia={concurrency} max_pending={max_pending}")
+    print(f"{'coste':>5} {'logins/s':>10} {'por núcleo':>11} {'p50 ms':>8} {'p95 ms':>8} {'429':>5}")
+    for cost in args.costs:
+        hashed = _hash(PASSWORD, cost)
+        hasher = PasswordHasher(workers=args.workers, max_pending=max_pending, rounds=cost)
+        hasher.start()
+        # Calentar los procesos antes de medir
+        hasher.verify(PASSWORD, hashed)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: run_login(hasher, hashed), range(args.logins)))
+        elapsed = time.perf_counter() - start
+        hasher.shutdown()
+
+        accepted = [latency for latency, ok in results if ok is not None]
+        if any(ok is False for _, ok in results):
+            raise SystemExit("verificación incorrecta")
+        rate = len(accepted) / elapsed
+        print(
+            f"{cost:>5} {rate:>10.1f} {rate / args.workers:>11.1f} "
+            f"{statistics.median(accepted) * 1000:>8.1f} {percentile(accepted, 95) * 1000:>8.1f} "
+            f"{len(results) - len(accepted):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+-- Extensión para la búsqueda con tolerancia a erratas
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Tabla: Categorías
 CREATE TABLE Categorias (
     id VARCHAR(255) PRIMARY KEY,
@@ -6,6 +9,11 @@ CREATE TABLE Categorias (
     parentCategory VARCHAR(255),
     imageUrl TEXT,
     active BOOLEAN NOT NULL DEFAULT TRUE,
+    updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(description, '')), 'B')
+    ) STORED,
     FOREIGN KEY (parentCategory) REFERENCES Categorias(id)
 );
 
@@ -18,11 +26,15 @@ CREATE TABLE Productos (
     category VARCHAR(255),
     animalType VARCHAR(255),
     brand VARCHAR(255),
-    stock INT NOT NULL,
+    stock INT NOT NULL CHECK (stock >= 0),
     images TEXT,
     averageRating DECIMAL(3, 2),
     createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(description, '')), 'B')
+    ) STORED,
     FOREIGN KEY (category) REFERENCES Categorias(id)
 );
 
@@ -49,18 +61,20 @@ CREATE TABLE Direcciones (
     city VARCHAR(255) NOT NULL,
     state VARCHAR(255),
     country VARCHAR(255) NOT NULL,
-    user_email VARCHAR(255),
     FOREIGN KEY (user_id) REFERENCES Usuarios(id)
 );
 
+CREATE INDEX ix_direcciones_user_id ON Direcciones (user_id);
+
 -- Tabla: Carrito de Compras
 CREATE TABLE Carrito (
     id Integer PRIMARY KEY,
     user_id VARCHAR(255) NOT NULL,
-    items TEXT NOT NULL,
+    items JSONB NOT NULL,
     totalAmount DECIMAL(10, 2) NOT NULL,
     createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ,
+    version INT NOT NULL DEFAULT 1,
     FOREIGN KEY (user_id) REFERENCES Usuarios(id)
 );
 
@@ -68,7 +82,7 @@ CREATE TABLE Carrito (
 CREATE TABLE Pedidos (
     id VARCHAR(255) PRIMARY KEY,
     user_id VARCHAR(255) NOT NULL,
-    items TEXT NOT NULL,
+    items JSONB NOT NULL,
     totalAmount DECIMAL(10, 2) NOT NULL,
     shipping_address VARCHAR(255) NOT NULL,
     paymentMethod VARCHAR(50) NOT NULL,
@@ -93,3 +107,92 @@ CREATE TABLE Resenas (
     FOREIGN KEY (productId) REFERENCES Productos(id),
     FOREIGN KEY (user_id) REFERENCES Usuarios(id)
 );
+
+-- Tabla: Cierre del árbol de categorías (un camino ancestro -> descendiente por fila)
+CREATE TABLE Categoria_Closure (
+    ancestor VARCHAR(255) NOT NULL,
+    descendant VARCHAR(255) NOT NULL,
+    depth INT NOT NULL,
+    PRIMARY KEY (ancestor, descendant),
+    FOREIGN KEY (ancestor) REFERENCES Categorias(id) ON DELETE CASCADE,
+    FOREIGN KEY (descendant) REFERENCES Categorias(id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_categoria_closure_descendant_depth ON Categoria_Closure (descendant, depth);
+
+-- Tabla: Agregado de valoraciones por producto (número de reseñas, suma de notas e histograma)
+CREATE TABLE Producto_Ratings (
+    productId VARCHAR(255) PRIMARY KEY,
+    review_count INT NOT NULL DEFAULT 0 CHECK (review_count >= 0),
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_1 INT NOT NULL DEFAULT 0,
+    rating_2 INT NOT NULL DEFAULT 0,
+    rating_3 INT NOT NULL DEFAULT 0,
+    rating_4 INT NOT NULL DEFAULT 0,
+    rating_5 INT NOT NULL DEFAULT 0,
+    updatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (productId) REFERENCES Productos(id) ON DELETE CASCADE
+);
+
+-- Tabla: Retenciones de stock de los carritos (caducan en expiresAt)
+CREATE TABLE Stock_Holds (
+    cart_id INT NOT NULL,
+    product_id VARCHAR(255) NOT NULL,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expiresAt TIMESTAMP NOT NULL,
+    PRIMARY KEY (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES Carrito(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES Productos(id) ON DELETE CASCADE
+);
+
+-- Stock retenido por producto (index-only scan) y barrido de retenciones caducadas
+CREATE INDEX idx_stock_holds_product_expiresat ON Stock_Holds (product_id, expiresAt) INCLUDE (quantity);
+CREATE INDEX idx_stock_holds_expiresat ON Stock_Holds (expiresAt);
+
+-- Tabla: Claves de idempotencia de la creación de pedidos
+CREATE TABLE Idempotency_Keys (
+    key VARCHAR(255) PRIMARY KEY,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INT,
+    response_body TEXT,
+    createdAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expiresAt TIMESTAMP NOT NULL
+);
+
+CREATE INDEX idx_idempotency_keys_expiresat ON Idempotency_Keys (expiresAt);
+
+-- Índices para la paginación por cursor de pedidos sobre (createdAt, id)
+CREATE INDEX idx_pedidos_createdat_id ON Pedidos (createdAt, id);
+CREATE INDEX idx_pedidos_user_createdat_id ON Pedidos (user_id, createdAt, id);
+CREATE INDEX idx_pedidos_status_createdat_id ON Pedidos (orderStatus, createdAt, id);
+
+-- Índices GIN para buscar carritos y pedidos que contienen un producto (items @> '[{"product_id": ...}]')
+CREATE INDEX idx_carrito_items_gin ON Carrito USING GIN (items jsonb_path_ops);
+CREATE INDEX idx_pedidos_items_gin ON Pedidos USING GIN (items jsonb_path_ops);
+
+-- Índices de búsqueda: texto completo, trigramas y prefijo del nombre
+CREATE INDEX idx_productos_search_vector ON Productos USING GIN (search_vector);
+CREATE INDEX idx_productos_name_trgm ON Productos USING GIN (lower(name) gin_trgm_ops);
+CREATE INDEX idx_productos_name_prefix ON Productos (lower(name) text_pattern_ops);
+CREATE INDEX idx_categorias_search_vector ON Categorias USING GIN (search_vector);
+CREATE INDEX idx_categorias_name_trgm ON Categorias USING GIN (lower(name) gin_trgm_ops);
+CREATE INDEX idx_categorias_name_prefix ON Categorias (lower(name) text_pattern_ops);
+
+-- Versiones de colección para ETag/Last-Modified (max(updatedAt) sin recorrer las tablas)
+CREATE INDEX idx_productos_updatedat ON Productos (updatedAt);
+CREATE INDEX ix_categorias_updatedat ON Categorias (updatedAt);
+CREATE INDEX idx_resenas_productid_updatedat ON Resenas (productId, updatedAt);
+
+-- Paginación por cursor de las reseñas de un producto (newest, rating y helpful)
+CREATE INDEX idx_resenas_productid_createdat_id ON Resenas (productId, createdAt, id);
+CREATE INDEX idx_resenas_productid_rating_createdat_id ON Resenas (productId, rating, createdAt, id);
+CREATE INDEX idx_resenas_productid_helpful_createdat_id ON Resenas (productId, (coalesce(helpful, 0)), createdAt, id);
+
+-- Índices del listado de productos: filtro + ordenación + id para la paginación por cursor
+CREATE INDEX idx_productos_createdat_id ON Productos (createdAt, id);
+CREATE INDEX idx_productos_price_id ON Productos (price, id);
+CREATE INDEX idx_productos_category_createdat_id ON Productos (category, createdAt, id);
+CREATE INDEX idx_productos_category_price_id ON Productos (category, price, id);
+CREATE INDEX idx_productos_animaltype_price_id ON Productos (animalType, price, id);
+CREATE INDEX idx_productos_brand_price_id ON Productos (brand, price, id);
+CREATE INDEX idx_productos_rating_id ON Productos ((coalesce(averageRating, 0)), id);
@@ -4,6 +4,20 @@ VALUES
 ('cat2', 'Juguetes para Gatos', 'Juguetes divertidos para gatos', NULL, 'https://example.com/cat-toys.jpg', TRUE),
 ('cat3', 'Camas para Mascotas', 'Camas confortables para diferentes tipos de mascotas', NULL, 'https://example.com/pet-beds.jpg', TRUE);
 
+-- Árbol de categorías (category_service lo mantiene a partir de aquí)
+WITH RECURSIVE paths AS (
+    SELECT id AS ancestor, id AS descendant, 0 AS depth
+    FROM categorias
+    UNION ALL
+    SELECT paths.ancestor, c.id, paths.depth + 1
+    FROM paths
+    JOIN categorias c ON c.parentcategory = paths.descendant
+    WHERE paths.depth < 64
+)
+INSERT INTO categoria_closure (ancestor, descendant, depth)
+SELECT ancestor, descendant, depth FROM paths
+ON CONFLICT (ancestor, descendant) DO NOTHING;
+
 
 -- Insertar registros en Productos
 INSERT INTO Productos (id, name, description, price, category, animalType, brand, stock, images, averageRating)
@@ -47,4 +61,17 @@ INSERT INTO Resenas (id, productId, user_id, rating, title, comment, helpful)
 VALUES 
 ('review1', 'prod1', 'user1', 5, 'Excelente comida para perros', 'A mi perro le encanta este alimento', 10),
 ('review2', 'prod2', 'user2', 4, 'Ratón divertido', 'A mi gato le gusta mucho jugar con este ratón', 5),
-('review3', 'prod3', 'user3', 5, 'Cama increíble', 'Cama muy cómoda para mi perro', 8);
\ No newline at end of file
+('review3', 'prod3', 'user3', 5, 'Cama increíble', 'Cama muy cómoda para mi perro', 8);
+
+-- Agregado de valoraciones de las reseñas anteriores (review_service lo mantiene a partir de aquí)
+INSERT INTO Producto_Ratings (productId, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT productId, COUNT(*), SUM(rating),
+       COUNT(*) FILTER (WHERE rating = 1), COUNT(*) FILTER (WHERE rating = 2), COUNT(*) FILTER (WHERE rating = 3),
+       COUNT(*) FILTER (WHERE rating = 4), COUNT(*) FILTER (WHERE rating = 5)
+FROM Resenas
+GROUP BY productId;
+
+UPDATE Productos p
+SET averageRating = round(pr.rating_sum::numeric / pr.review_count, 2)
+FROM Producto_Ratings pr
+WHERE pr.productId = p.id;
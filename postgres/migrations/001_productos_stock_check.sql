@@ -0,0 +1,12 @@
+-- Migración 001: el stock de un producto nunca puede quedar en negativo.
+-- Red de seguridad para la reserva de stock de order_service.
+-- NOT VALID evita bloquear la tabla mientras se comprueban las filas existentes.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'productos_stock_check') THEN
+        ALTER TABLE productos
+            ADD CONSTRAINT productos_stock_check CHECK (stock >= 0) NOT VALID;
+    END IF;
+END $$;
+
+ALTER TABLE productos VALIDATE CONSTRAINT productos_stock_check;
@@ -0,0 +1,13 @@
+-- Migración 002: claves de idempotencia para POST /api/orders.
+-- Guarda la respuesta de cada pedido creado con cabecera Idempotency-Key para
+-- que los reintentos la reciban sin volver a descontar stock ni crear pedidos.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INT,
+    response_body TEXT,
+    createdat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expiresat TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expiresat ON idempotency_keys (expiresat);
@@ -0,0 +1,5 @@
+-- Migración 003: índices para la paginación por cursor de GET /api/orders.
+-- CONCURRENTLY no bloquea las escrituras en pedidos; ejecutar fuera de una transacción.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_createdat_id ON pedidos (createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_user_createdat_id ON pedidos (user_id, createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_status_createdat_id ON pedidos (orderstatus, createdat, id);
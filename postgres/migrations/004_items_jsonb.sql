@@ -0,0 +1,97 @@
+-- Migración 004: carrito.items y pedidos.items pasan de TEXT a JSONB.
+--
+-- Migración en línea: los servicios antiguos siguen escribiendo TEXT mientras se
+-- rellena la nueva columna por lotes. Ejecutar con psql fuera de una transacción
+-- (cada lote hace COMMIT) y desplegar cart_service y order_service justo después
+-- del paso 4.
+
+-- 1. Conversión tolerante: algunos carritos antiguos se guardaron con la
+--    representación de Python (comillas simples, True/False/None).
+CREATE OR REPLACE FUNCTION petstore_items_to_jsonb(raw TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN raw::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN replace(replace(replace(replace(raw, '''', '"'), 'True', 'true'), 'False', 'false'), 'None', 'null')::jsonb;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 2. Columna nueva y trigger que la mantiene al día durante el relleno
+ALTER TABLE carrito ADD COLUMN IF NOT EXISTS items_jsonb JSONB;
+ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS items_jsonb JSONB;
+
+CREATE OR REPLACE FUNCTION petstore_sync_items_jsonb() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.items_jsonb := petstore_items_to_jsonb(NEW.items);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS carrito_sync_items_jsonb ON carrito;
+CREATE TRIGGER carrito_sync_items_jsonb BEFORE INSERT OR UPDATE OF items ON carrito
+    FOR EACH ROW EXECUTE FUNCTION petstore_sync_items_jsonb();
+
+DROP TRIGGER IF EXISTS pedidos_sync_items_jsonb ON pedidos;
+CREATE TRIGGER pedidos_sync_items_jsonb BEFORE INSERT OR UPDATE OF items ON pedidos
+    FOR EACH ROW EXECUTE FUNCTION petstore_sync_items_jsonb();
+
+-- 3. Relleno por lotes de las filas existentes, con COMMIT tras cada lote
+CREATE OR REPLACE PROCEDURE petstore_backfill_items_jsonb(batch_size INT DEFAULT 5000) AS $$
+DECLARE
+    updated INT;
+BEGIN
+    LOOP
+        UPDATE carrito SET items_jsonb = petstore_items_to_jsonb(items)
+        WHERE id IN (SELECT id FROM carrito WHERE items_jsonb IS NULL LIMIT batch_size);
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        COMMIT;
+        EXIT WHEN updated = 0;
+    END LOOP;
+
+    LOOP
+        UPDATE pedidos SET items_jsonb = petstore_items_to_jsonb(items)
+        WHERE id IN (SELECT id FROM pedidos WHERE items_jsonb IS NULL LIMIT batch_size);
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        COMMIT;
+        EXIT WHEN updated = 0;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CALL petstore_backfill_items_jsonb();
+
+-- 4. Intercambio de columnas en una transacción corta. El CHECK validado permite
+--    que SET NOT NULL no tenga que recorrer la tabla con el bloqueo tomado.
+ALTER TABLE carrito ADD CONSTRAINT carrito_items_jsonb_not_null CHECK (items_jsonb IS NOT NULL) NOT VALID;
+ALTER TABLE carrito VALIDATE CONSTRAINT carrito_items_jsonb_not_null;
+ALTER TABLE pedidos ADD CONSTRAINT pedidos_items_jsonb_not_null CHECK (items_jsonb IS NOT NULL) NOT VALID;
+ALTER TABLE pedidos VALIDATE CONSTRAINT pedidos_items_jsonb_not_null;
+
+BEGIN;
+LOCK TABLE carrito, pedidos IN ACCESS EXCLUSIVE MODE;
+-- Filas escritas entre el relleno y el bloqueo
+UPDATE carrito SET items_jsonb = petstore_items_to_jsonb(items) WHERE items_jsonb IS NULL;
+UPDATE pedidos SET items_jsonb = petstore_items_to_jsonb(items) WHERE items_jsonb IS NULL;
+DROP TRIGGER carrito_sync_items_jsonb ON carrito;
+DROP TRIGGER pedidos_sync_items_jsonb ON pedidos;
+ALTER TABLE carrito RENAME COLUMN items TO items_text;
+ALTER TABLE carrito RENAME COLUMN items_jsonb TO items;
+ALTER TABLE carrito ALTER COLUMN items SET NOT NULL;
+ALTER TABLE carrito ALTER COLUMN items_text DROP NOT NULL;
+ALTER TABLE carrito DROP CONSTRAINT carrito_items_jsonb_not_null;
+ALTER TABLE pedidos RENAME COLUMN items TO items_text;
+ALTER TABLE pedidos RENAME COLUMN items_jsonb TO items;
+ALTER TABLE pedidos ALTER COLUMN items SET NOT NULL;
+ALTER TABLE pedidos ALTER COLUMN items_text DROP NOT NULL;
+ALTER TABLE pedidos DROP CONSTRAINT pedidos_items_jsonb_not_null;
+COMMIT;
+
+-- 5. Índices GIN para las búsquedas por producto
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carrito_items_gin ON carrito USING GIN (items jsonb_path_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_items_gin ON pedidos USING GIN (items jsonb_path_ops);
+
+-- 6. Limpieza (cuando los servicios nuevos estén desplegados y verificados):
+-- ALTER TABLE carrito DROP COLUMN items_text;
+-- ALTER TABLE pedidos DROP COLUMN items_text;
+DROP PROCEDURE petstore_backfill_items_jsonb(INT);
+DROP FUNCTION petstore_sync_items_jsonb();
+DROP FUNCTION petstore_items_to_jsonb(TEXT);
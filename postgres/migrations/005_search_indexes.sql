@@ -0,0 +1,25 @@
+-- Migración 005: índices de búsqueda para search_service.
+--  * search_vector: tsvector generado a partir de nombre (peso A) y descripción (peso B), con índice GIN.
+--  * pg_trgm sobre lower(name) para tolerar erratas.
+--  * btree text_pattern_ops sobre lower(name) para el autocompletado por prefijo.
+-- Añadir una columna generada reescribe la tabla: ejecutar el primer bloque en una ventana de mantenimiento.
+-- Los índices se crean con CONCURRENTLY, fuera de una transacción.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('spanish', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(description, '')), 'B')
+) STORED;
+
+ALTER TABLE categorias ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('spanish', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_search_vector ON productos USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_name_trgm ON productos USING GIN (lower(name) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_name_prefix ON productos (lower(name) text_pattern_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_categorias_search_vector ON categorias USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_categorias_name_trgm ON categorias USING GIN (lower(name) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_categorias_name_prefix ON categorias (lower(name) text_pattern_ops);
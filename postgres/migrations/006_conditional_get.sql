@@ -0,0 +1,8 @@
+-- Migración 006: versiones de colección para ETag/Last-Modified.
+-- categorias no tenía marca de modificación; con DEFAULT constante (PG11+) no se reescribe la tabla.
+ALTER TABLE categorias ADD COLUMN IF NOT EXISTS updatedat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- max(updatedat) por colección y por producto sin recorrer las tablas
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_updatedat ON productos (updatedat);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_categorias_updatedat ON categorias (updatedat);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_productid_updatedat ON resenas (productid, updatedat);
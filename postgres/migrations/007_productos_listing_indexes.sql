@@ -0,0 +1,9 @@
+-- Migración 007: índices para el listado paginado, filtrado y ordenado de GET /api/products.
+-- CONCURRENTLY no bloquea las escrituras en productos; ejecutar fuera de una transacción.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_createdat_id ON productos (createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_price_id ON productos (price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_category_createdat_id ON productos (category, createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_category_price_id ON productos (category, price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_animaltype_price_id ON productos (animaltype, price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_brand_price_id ON productos (brand, price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_rating_id ON productos ((coalesce(averagerating, 0)), id);
@@ -0,0 +1,35 @@
+-- Migración 008: agregado de valoraciones por producto, mantenido por review_service en la
+-- misma transacción que cada reseña. Tras crear la tabla se rellena desde resenas.
+-- En catálogos grandes, el relleno se puede hacer por lotes con review_service/recompute_ratings.py.
+CREATE TABLE IF NOT EXISTS producto_ratings (
+    productid VARCHAR(255) PRIMARY KEY REFERENCES productos(id) ON DELETE CASCADE,
+    review_count INT NOT NULL DEFAULT 0 CHECK (review_count >= 0),
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_1 INT NOT NULL DEFAULT 0,
+    rating_2 INT NOT NULL DEFAULT 0,
+    rating_3 INT NOT NULL DEFAULT 0,
+    rating_4 INT NOT NULL DEFAULT 0,
+    rating_5 INT NOT NULL DEFAULT 0,
+    updatedat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO producto_ratings (productid, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT productid,
+       COUNT(*),
+       SUM(rating),
+       COUNT(*) FILTER (WHERE rating = 1),
+       COUNT(*) FILTER (WHERE rating = 2),
+       COUNT(*) FILTER (WHERE rating = 3),
+       COUNT(*) FILTER (WHERE rating = 4),
+       COUNT(*) FILTER (WHERE rating = 5)
+FROM resenas
+GROUP BY productid
+ON CONFLICT (productid) DO NOTHING;
+
+UPDATE productos p
+SET averagerating = round(pr.rating_sum::numeric / pr.review_count, 2),
+    updatedat = timezone('utc', now())
+FROM producto_ratings pr
+WHERE pr.productid = p.id
+  AND pr.review_count > 0
+  AND p.averagerating IS DISTINCT FROM round(pr.rating_sum::numeric / pr.review_count, 2);
@@ -0,0 +1,6 @@
+-- Migración 009: índices para la paginación por cursor de GET /api/reviews/{productId}
+-- y para POST /api/reviews:batchGet. resenas.productid no tenía ningún índice propio.
+-- CONCURRENTLY no bloquea las escrituras en resenas; ejecutar fuera de una transacción.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_productid_createdat_id ON resenas (productid, createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_productid_rating_createdat_id ON resenas (productid, rating, createdat, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_productid_helpful_createdat_id ON resenas (productid, (coalesce(helpful, 0)), createdat, id);
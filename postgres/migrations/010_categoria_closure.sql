@@ -0,0 +1,24 @@
+-- Migración 010: tabla de cierre del árbol de categorías, mantenida por category_service
+-- en la misma transacción que cada alta, cambio de padre o borrado de categorías.
+CREATE TABLE IF NOT EXISTS categoria_closure (
+    ancestor VARCHAR(255) NOT NULL REFERENCES categorias(id) ON DELETE CASCADE,
+    descendant VARCHAR(255) NOT NULL REFERENCES categorias(id) ON DELETE CASCADE,
+    depth INT NOT NULL,
+    PRIMARY KEY (ancestor, descendant)
+);
+
+CREATE INDEX IF NOT EXISTS idx_categoria_closure_descendant_depth ON categoria_closure (descendant, depth);
+
+-- Relleno desde categorias.parentcategory (la profundidad máxima evita bucles si hubiera ciclos)
+WITH RECURSIVE paths AS (
+    SELECT id AS ancestor, id AS descendant, 0 AS depth
+    FROM categorias
+    UNION ALL
+    SELECT paths.ancestor, c.id, paths.depth + 1
+    FROM paths
+    JOIN categorias c ON c.parentcategory = paths.descendant
+    WHERE paths.depth < 64
+)
+INSERT INTO categoria_closure (ancestor, descendant, depth)
+SELECT ancestor, descendant, depth FROM paths
+ON CONFLICT (ancestor, descendant) DO NOTHING;
@@ -0,0 +1,3 @@
+-- Migración 011: versión del carrito para la concurrencia optimista (ETag / If-Match)
+-- de las operaciones por línea. Con DEFAULT constante (PG11+) no se reescribe la tabla.
+ALTER TABLE carrito ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
@@ -0,0 +1,13 @@
+-- Migración 012: retenciones de stock de los carritos. cart_service las crea al añadir
+-- líneas y las renueva al cambiarlas; order_service descuenta del stock disponible las
+-- retenciones vigentes de otros carritos y libera las del carrito del pedido.
+CREATE TABLE IF NOT EXISTS stock_holds (
+    cart_id INT NOT NULL REFERENCES carrito(id) ON DELETE CASCADE,
+    product_id VARCHAR(255) NOT NULL REFERENCES productos(id) ON DELETE CASCADE,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expiresat TIMESTAMP NOT NULL,
+    PRIMARY KEY (cart_id, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_holds_product_expiresat ON stock_holds (product_id, expiresat) INCLUDE (quantity);
+CREATE INDEX IF NOT EXISTS idx_stock_holds_expiresat ON stock_holds (expiresat);
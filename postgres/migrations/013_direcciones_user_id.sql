@@ -0,0 +1,14 @@
+-- Migración 013: las direcciones se buscan por user_id (el id del token) en lugar de por
+-- el email copiado en cada dirección. Se indexa user_id.
+-- user_email se deja de escribir pero se conserva mientras queden pods antiguos que la leen;
+-- se elimina en 014_drop_direcciones_user_email.sql, una vez desplegado user_service.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_direcciones_user_id ON direcciones (user_id);
+
+-- Los pods nuevos insertan direcciones sin user_email
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'direcciones' AND column_name = 'user_email') THEN
+        ALTER TABLE direcciones ALTER COLUMN user_email DROP NOT NULL;
+    END IF;
+END $$;
@@ -0,0 +1,4 @@
+-- Migración 014: elimina direcciones.user_email. Ejecutar sólo cuando todos los pods de
+-- user_service y order_service usen ya user_id (después del despliegue de la 013).
+DROP INDEX CONCURRENTLY IF EXISTS ix_direcciones_user_email;
+ALTER TABLE direcciones DROP COLUMN IF EXISTS user_email;
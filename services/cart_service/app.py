@@ -1,31 +1,40 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, validator
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Text, DECIMAL, ForeignKey, TIMESTAMP, Integer
+from sqlalchemy import text, Column, String, Text, DECIMAL, ForeignKey, TIMESTAMP, Integer, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
+from decimal import Decimal
 from pydantic import Field
 import uuid
 import requests
 import os
+import json
+import logging
+import threading
+import time
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
-# Configuración de FastAPI
-app = FastAPI()
+from hot_store import hot_store_from_env
+from holds import hold_stock, reduce_hold, REAP_EXPIRED_HOLDS_SQL
+from petstore_common.db import create_db_engine, pool_stats, session_dependency
+from petstore_common.metrics import instrument_app, track_stage
+from petstore_common.tracing import setup_tracing
 
-# Configuración de la base de datos
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
+logger = logging.getLogger(__name__)
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Configuración de FastAPI
+app = FastAPI()
 
-# Configuración de SQLAlchemy
-engine = create_engine(DATABASE_URL, echo=True)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("cart-service")
+instrument_app(app, engine)
+setup_tracing(app, "cart-service", engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
@@ -34,10 +43,14 @@ class CarritoModel(Base):
     __tablename__ = "carrito"
     id = Column(Integer, primary_key=True, autoincrement=True)  # Cambiado a Integer y configurado como autoincremental
     user_id = Column(String(255), ForeignKey("usuarios.id") ,nullable=False)
-    items = Column(Text, nullable=False)
+    items = Column(JSONB, nullable=False)  # Lista de ítems [{"product_id", "quantity", "unit_price"}]
     totalamount = Column(DECIMAL(10, 2), nullable=False)
     createdat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)  # Concurrencia optimista (ETag / If-Match)
+
+    # Las actualizaciones del ORM incluyen "WHERE version = <leída>" y la incrementan
+    __mapper_args__ = {"version_id_col": version}
 
 # Modelos de base de datos
 class UsuarioModel(Base):
@@ -67,47 +80,331 @@ class ProductoModel(Base):
     createdat = Column(TIMESTAMP, name="createdat", nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, name="updatedat", nullable=False, default=datetime.utcnow)
 
+# Retenciones de stock de las líneas de los carritos; caducan a los STOCK_HOLD_TTL_SECONDS
+class StockHoldModel(Base):
+    __tablename__ = "stock_holds"
+    cart_id = Column(Integer, ForeignKey("carrito.id", ondelete="CASCADE"), primary_key=True)
+    product_id = Column(String, ForeignKey("productos.id", ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    expiresat = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (
+        # Stock retenido por producto con un index-only scan (disponible = stock - retenido)
+        Index("idx_stock_holds_product_expiresat", "product_id", "expiresat", postgresql_include=["quantity"]),
+        # Barrido de retenciones caducadas
+        Index("idx_stock_holds_expiresat", "expiresat"),
+    )
 
 
 # Crear las tablas en la base de datos
 Base.metadata.create_all(bind=engine)
 
 # Modelo de Pydantic
+class CartItem(BaseModel):
+    product_id: str
+    quantity: int
+    unit_price: Optional[float] = None  # Precio unitario al añadir la línea
+
+class CartItemQuantity(BaseModel):
+    quantity: int = Field(..., ge=0)
+
+def parse_items(value):
+    # Compatibilidad con clientes que todavía envían los ítems como cadena JSON
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
 class Carrito(BaseModel):
     id: int 
     user_id: str
-    items: str
+    items: List[CartItem]
     totalamount: float
     createdat: Optional[datetime] = None
     updatedat: Optional[datetime] = None
+    version: Optional[int] = None
+
+    _parse_items = validator("items", pre=True, allow_reuse=True)(parse_items)
 
     class Config:
         from_attributes = True
         
 class CarritoUpdate(BaseModel):
     user_id: Optional[str] = None
-    items: Optional[str] = None
+    items: Optional[List[CartItem]] = None
     totalamount: Optional[float] = None
     createdat: Optional[datetime] = None
     updatedat: Optional[datetime] = None
 
+    _parse_items = validator("items", pre=True, allow_reuse=True)(parse_items)
+
     class Config:
         from_attributes = True  # Para Pydantic V2
 
 # Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = session_dependency(SessionLocal)
 
 
 PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://product-service/api/products")
 
+# Reintentos de un cambio de línea sin If-Match cuando otra petición modifica el carrito a la vez
+CART_UPDATE_RETRIES = 3
+
+# Barrido de retenciones caducadas (ya no cuentan como retenidas; sólo se borran)
+STOCK_HOLD_REAP_INTERVAL_SECONDS = float(os.getenv("STOCK_HOLD_REAP_INTERVAL_SECONDS", "60"))
+STOCK_HOLD_REAP_BATCH_SIZE = int(os.getenv("STOCK_HOLD_REAP_BATCH_SIZE", "1000"))
+
+def price_cart_items(db: Session, cart_id: int, cart_items: List[CartItem]):
+    """
+    Valida las líneas, retiene el stock para el carrito y fija el precio unitario de
+    cada una con los productos bloqueados por hold_stock. Devuelve las líneas y el total.
+    """
+    total_amount = 0
+
+    # Validar los datos de los items y sumar las cantidades por producto
+    quantities = {}
+    for item in cart_items:
+        if not item.product_id or not isinstance(item.quantity, int) or item.quantity <= 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Each item must have a valid product_id and a positive quantity"
+            )
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    # Validar el stock disponible y retenerlo; libera lo retenido por líneas que ya no están
+    products = hold_stock(db, cart_id, quantities, replace=True)
+
+    for product_id, quantity in quantities.items():
+        # Calcular el total
+        total_amount += products[product_id].price * quantity
+
+    items = [
+        {"product_id": product_id, "quantity": quantity, "unit_price": float(products[product_id].price)}
+        for product_id, quantity in quantities.items()
+    ]
+    return items, total_amount
+
+def cart_etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    if if_match is None:
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+def apply_line_change(db: Session, cart_id: int, items: List[dict], product_id: str,
+                      quantity: Optional[int] = None, increment: int = 0):
+    """
+    Fija la cantidad de una línea (quantity) o la incrementa (increment); con cantidad 0
+    la línea se elimina. Sólo se bloquea el producto afectado cuando la retención crece.
+    Devuelve las líneas nuevas y la variación del total según el precio unitario de la línea.
+    """
+    items = [dict(item) for item in items]
+    line = next((item for item in items if item["product_id"] == product_id), None)
+    old_quantity = line["quantity"] if line else 0
+    new_quantity = quantity if quantity is not None else old_quantity + increment
+    if line is None and new_quantity == 0:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+
+    unit_price = line.get("unit_price") if line else None
+    if new_quantity > old_quantity:
+        product = hold_stock(db, cart_id, {product_id: new_quantity})[product_id]
+        if unit_price is None:
+            unit_price = float(product.price)
+    else:
+        reduce_hold(db, cart_id, product_id, new_quantity)
+        if unit_price is None:
+            product = db.query(ProductoModel.price).filter(ProductoModel.id == product_id).first()
+            if not product:
+                raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
+            unit_price = float(product.price)
+
+    if new_quantity == 0:
+        items.remove(line)
+    elif line is not None:
+        line["quantity"] = new_quantity
+        line["unit_price"] = unit_price
+    else:
+        items.append({"product_id": product_id, "quantity": new_quantity, "unit_price": unit_price})
+    return items, Decimal(str(unit_price)) * (new_quantity - old_quantity)
+
+def set_cart_line(db: Session, cart_id: int, product_id: str, expected_version: Optional[int],
+                  quantity: Optional[int] = None, increment: int = 0):
+    """Cambia una línea con una escritura condicional a la versión leída."""
+    if hot_store:
+        return set_hot_cart_line(db, cart_id, product_id, expected_version, quantity, increment)
+    for _ in range(CART_UPDATE_RETRIES):
+        cart = db.query(CarritoModel).filter(CarritoModel.id == cart_id).first()
+        if not cart:
+            raise HTTPException(status_code=404, detail="Cart not found")
+        if expected_version is not None and cart.version != expected_version:
+            raise HTTPException(status_code=412, detail="Cart has been modified")
+
+        items, delta = apply_line_change(db, cart_id, cart.items, product_id, quantity, increment)
+        updated = db.query(CarritoModel).filter(
+            CarritoModel.id == cart_id, CarritoModel.version == cart.version
+        ).update({
+            CarritoModel.items: items,
+            CarritoModel.totalamount: CarritoModel.totalamount + delta,
+            CarritoModel.version: CarritoModel.version + 1,
+            CarritoModel.updatedat: datetime.utcnow(),
+        }, synchronize_session=False)
+        if updated:
+            db.commit()
+            db.refresh(cart)
+            return cart_to_dict(cart)
+        db.rollback()
+        if expected_version is not None:
+            raise HTTPException(status_code=412, detail="Cart has been modified")
+    raise HTTPException(status_code=409, detail="Cart is being modified concurrently, retry the request")
+
+# Capa caliente de carritos (opcional): lecturas y cambios en memoria o Redis y
+# volcado asíncrono a la tabla carrito (write-behind)
+hot_store = hot_store_from_env()
+CART_FLUSH_INTERVAL_SECONDS = float(os.getenv("CART_FLUSH_INTERVAL_SECONDS", "5"))
+flush_lock = threading.Lock()
+
+# Sólo avanza la versión: con Redis otra réplica puede haber volcado ya una versión más nueva
+FLUSH_CART_SQL = text("""
+    UPDATE carrito
+    SET items = CAST(:items AS jsonb), totalamount = :totalamount, version = :version, updatedat = :updatedat
+    WHERE id = :id AND carrito.version < :version
+""")
+
+def cart_to_dict(cart: CarritoModel) -> dict:
+    return {
+        "id": cart.id,
+        "user_id": cart.user_id,
+        "items": cart.items,
+        "totalamount": str(cart.totalamount),
+        "createdat": cart.createdat.isoformat(),
+        "updatedat": cart.updatedat.isoformat(),
+        "version": cart.version,
+    }
+
+def load_hot_cart(db: Session, cart_id: int) -> dict:
+    cart = hot_store.get(cart_id)
+    if cart is None:
+        db_cart = db.query(CarritoModel).filter(CarritoModel.id == cart_id).first()
+        if not db_cart:
+            raise HTTPException(status_code=404, detail="Cart not found")
+        cart = cart_to_dict(db_cart)
+        if not hot_store.put_if_absent(cart):
+            # Otra petición lo ha cargado (y quizá modificado) entretanto: manda la copia caliente
+            cart = hot_store.get(cart_id) or cart
+    return cart
+
+def set_hot_cart_line(db: Session, cart_id: int, product_id: str, expected_version: Optional[int],
+                      quantity: Optional[int] = None, increment: int = 0) -> dict:
+    for _ in range(CART_UPDATE_RETRIES):
+        cart = load_hot_cart(db, cart_id)
+        if expected_version is not None and cart["version"] != expected_version:
+            raise HTTPException(status_code=412, detail="Cart has been modified")
+
+        items, delta = apply_line_change(db, cart_id, cart["items"], product_id, quantity, increment)
+        updated = {
+            **cart,
+            "items": items,
+            "totalamount": str(Decimal(cart["totalamount"]) + delta),
+            "version": cart["version"] + 1,
+            "updatedat": datetime.utcnow().isoformat(),
+        }
+        # Las retenciones van siempre a PostgreSQL: se confirman sólo si el cambio se aplica
+        if hot_store.compare_and_set(updated, cart["version"]):
+            db.commit()
+            return updated
+        db.rollback()
+        if expected_version is not None:
+            raise HTTPException(status_code=412, detail="Cart has been modified")
+    raise HTTPException(status_code=409, detail="Cart is being modified concurrently, retry the request")
+
+def flush_hot_carts(user_id: Optional[str] = None) -> int:
+    """
+    Vuelca a PostgreSQL los carritos pendientes (de un usuario o todos) en un solo lote.
+    Un volcado completo rota el diario y, si termina bien, borra los segmentos volcados.
+    """
+    journal = getattr(hot_store, "journal", None)
+    with flush_lock:
+        segment = journal.rotate() if journal and user_id is None else None
+        carts = hot_store.take_dirty(user_id)
+        if carts:
+            try:
+                with track_stage("flush_hot_carts"), engine.begin() as conn:
+                    conn.execute(FLUSH_CART_SQL, [
+                        {
+                            "id": cart["id"],
+                            "items": json.dumps(cart["items"]),
+                            "totalamount": cart["totalamount"],
+                            "version": cart["version"],
+                            "updatedat": cart["updatedat"],
+                        }
+                        for cart in carts
+                    ])
+            except Exception:
+                hot_store.mark_dirty(carts)
+                raise
+            hot_store.flushed(carts)
+        if segment is not None:
+            journal.discard_through(segment)
+        return len(carts)
+
+def flush_hot_carts_periodically():
+    while True:
+        time.sleep(CART_FLUSH_INTERVAL_SECONDS)
+        try:
+            flush_hot_carts()
+            hot_store.expire()
+        except Exception:
+            logger.exception("Error flushing carts")
+
+def reap_expired_holds():
+    """Borra por lotes las retenciones caducadas hasta que no quede ninguna."""
+    while True:
+        with engine.begin() as conn:
+            deleted = conn.execute(REAP_EXPIRED_HOLDS_SQL, {"batch_size": STOCK_HOLD_REAP_BATCH_SIZE}).rowcount
+        if deleted < STOCK_HOLD_REAP_BATCH_SIZE:
+            return
+
+def reap_expired_holds_periodically():
+    while True:
+        time.sleep(STOCK_HOLD_REAP_INTERVAL_SECONDS)
+        try:
+            reap_expired_holds()
+        except Exception:
+            logger.exception("Error reaping stock holds")
+
+@app.on_event("startup")
+def start_hold_reaper():
+    threading.Thread(target=reap_expired_holds_periodically, daemon=True).start()
+
+@app.on_event("startup")
+def start_hot_store():
+    if not hot_store:
+        return
+    # Carritos del diario que no llegaron a volcarse antes de la última parada
+    journal = getattr(hot_store, "journal", None)
+    if journal:
+        for cart in journal.replay().values():
+            if cart is not None:
+                hot_store.put(cart)
+        flush_hot_carts()
+    threading.Thread(target=flush_hot_carts_periodically, daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_hot_store():
+    if hot_store:
+        flush_hot_carts()
+
 @app.get("/api/cart", response_model=List[Carrito])
 def list_carts(db: Session = Depends(get_db)):
     try:
+        # Con la capa caliente, los cambios de los últimos CART_FLUSH_INTERVAL_SECONDS
+        # pueden no estar todavía en la tabla
         return db.query(CarritoModel).all()
     except HTTPException as e:
         raise e
@@ -117,47 +414,19 @@ def list_carts(db: Session = Depends(get_db)):
 @app.post("/api/cart", response_model=Carrito)
 def create_cart(cart: Carrito, db: Session = Depends(get_db)):
     try:
-        items = eval(cart.items)
-        total_amount = 0
-
-        for item in items:
-            product_id = item.get("product_id")
-            quantity = item.get("quantity")
-
-            # Validar los datos del item
-            if not product_id or not isinstance(quantity, int) or quantity <= 0:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Each item must have a valid product_id and a positive quantity"
-                )
-
-            # Obtener el producto de la base de datos
-            product = db.query(ProductoModel).filter(ProductoModel.id == product_id).first()
-            if not product:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Product with ID {product_id} not found"
-                )
-
-            # Validar el stock disponible
-            if product.stock < quantity:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not enough stock for product {product_id}. Available: {product.stock}"
-                )
-
-            # Calcular el total y reducir el stock
-            total_amount += product.price * quantity
-
-        # Crear el nuevo carrito
+        # Crear el nuevo carrito; las retenciones necesitan su id
         new_cart = CarritoModel(
             user_id=cart.user_id,
-            items=cart.items,
-            totalamount=total_amount,
+            items=[],
+            totalamount=0,
         )
         db.add(new_cart)
+        db.flush()
+        new_cart.items, new_cart.totalamount = price_cart_items(db, new_cart.id, cart.items)
         db.commit()
         db.refresh(new_cart)
+        if hot_store:
+            hot_store.put(cart_to_dict(new_cart), dirty=False)
         return new_cart
 
     except HTTPException as e:
@@ -167,11 +436,16 @@ def create_cart(cart: Carrito, db: Session = Depends(get_db)):
 
 
 @app.get("/api/cart/{cart_id}", response_model=Carrito)
-def get_cart(cart_id: int, db: Session = Depends(get_db)):
+def get_cart(cart_id: int, response: Response, db: Session = Depends(get_db)):
     try:
+        if hot_store:
+            cart = load_hot_cart(db, cart_id)
+            response.headers["ETag"] = cart_etag(cart["version"])
+            return cart
         cart = db.query(CarritoModel).filter(CarritoModel.id == cart_id).first()
         if not cart:
             raise HTTPException(status_code=404, detail="Cart not found")
+        response.headers["ETag"] = cart_etag(cart.version)
         return cart
     except HTTPException as e:
         raise e
@@ -179,21 +453,114 @@ def get_cart(cart_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/cart/{cart_id}", response_model=Carrito)
-def update_cart(cart_id: int, updated_cart: CarritoUpdate, db: Session = Depends(get_db)):
+def update_cart(cart_id: int, updated_cart: CarritoUpdate, response: Response,
+                if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     try:
+        expected_version = parse_if_match(if_match)
+
+        # El total siempre se calcula a partir de las líneas, nunca lo fija el cliente.
+        # Las líneas se valoran (y se retienen) sólo después de comprobar que el carrito
+        # existe y que If-Match coincide, para no escribir retenciones de una petición fallida.
+        changes = updated_cart.dict(exclude_unset=True, exclude={"items", "totalamount"})
+
+        if hot_store:
+            cart = load_hot_cart(db, cart_id)
+            if expected_version is not None and cart["version"] != expected_version:
+                raise HTTPException(status_code=412, detail="Cart has been modified")
+            # La capa caliente reparte los carritos por usuario: no se pueden cambiar de dueño
+            if changes.get("user_id", cart["user_id"]) != cart["user_id"]:
+                raise HTTPException(status_code=400, detail="Cart owner cannot be changed")
+            if updated_cart.items is not None:
+                changes["items"], changes["totalamount"] = price_cart_items(db, cart_id, updated_cart.items)
+            updated = {
+                **cart,
+                **jsonable_encoder(changes),
+                "version": cart["version"] + 1,
+                "updatedat": datetime.utcnow().isoformat(),
+            }
+            if "totalamount" in changes:
+                updated["totalamount"] = str(changes["totalamount"])
+            if not hot_store.compare_and_set(updated, cart["version"]):
+                db.rollback()
+                raise HTTPException(status_code=412, detail="Cart has been modified")
+            db.commit()
+            response.headers["ETag"] = cart_etag(updated["version"])
+            return updated
+
         cart = db.query(CarritoModel).filter(CarritoModel.id == cart_id).first()
         if not cart:
             raise HTTPException(status_code=404, detail="Cart not found")
-        for key, value in updated_cart.dict(exclude_unset=True).items():
+        if expected_version is not None and cart.version != expected_version:
+            raise HTTPException(status_code=412, detail="Cart has been modified")
+        if updated_cart.items is not None:
+            changes["items"], changes["totalamount"] = price_cart_items(db, cart_id, updated_cart.items)
+        for key, value in changes.items():
             setattr(cart, key, value)
+        cart.updatedat = datetime.utcnow()
         db.commit()
         db.refresh(cart)
+        response.headers["ETag"] = cart_etag(cart.version)
         return cart
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=412, detail="Cart has been modified")
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Operaciones sobre una línea del carrito. Aceptan If-Match con el ETag del carrito
+# (su versión) y responden 412 si otra petición lo ha modificado.
+@app.post("/api/cart/{cart_id}/items", response_model=Carrito)
+def add_cart_item(cart_id: int, item: CartItem, response: Response,
+                  if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    try:
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        cart = set_cart_line(db, cart_id, item.product_id, parse_if_match(if_match), increment=item.quantity)
+        response.headers["ETag"] = cart_etag(cart["version"])
+        return cart
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/api/cart/{cart_id}/items/{product_id}", response_model=Carrito)
+def set_cart_item_quantity(cart_id: int, product_id: str, item: CartItemQuantity, response: Response,
+                           if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    try:
+        cart = set_cart_line(db, cart_id, product_id, parse_if_match(if_match), quantity=item.quantity)
+        response.headers["ETag"] = cart_etag(cart["version"])
+        return cart
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/cart/{cart_id}/items/{product_id}", response_model=Carrito)
+def remove_cart_item(cart_id: int, product_id: str, response: Response,
+                     if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    try:
+        cart = set_cart_line(db, cart_id, product_id, parse_if_match(if_match), quantity=0)
+        response.headers["ETag"] = cart_etag(cart["version"])
+        return cart
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Volcado de la capa caliente (uso interno: order_service lo llama antes de crear el pedido)
+@app.post("/cart/flush")
+def flush_carts(user_id: Optional[str] = None):
+    try:
+        return {"flushed": flush_hot_carts(user_id) if hot_store else 0}
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Error flushing carts: {str(e)}")
+
+@app.get("/cart/stats")
+def cart_store_stats():
+    return hot_store.stats() if hot_store else {"backend": "postgres"}
+
 @app.delete("/api/cart/{cart_id}")
 def delete_cart(cart_id: str, db: Session = Depends(get_db)):
     try:
@@ -202,8 +569,15 @@ def delete_cart(cart_id: str, db: Session = Depends(get_db)):
             raise HTTPException(status_code=404, detail="Cart not found")
         db.delete(cart)
         db.commit()
+        if hot_store:
+            hot_store.delete(cart.id)
         return {"message": "Cart deleted successfully"}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+def db_stats():
+    return pool_stats(engine)
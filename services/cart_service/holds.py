@@ -0,0 +1,113 @@
+import os
+from typing import Dict
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+# Duración de una retención de stock desde el último cambio de la línea del carrito
+STOCK_HOLD_TTL_SECONDS = int(os.getenv("STOCK_HOLD_TTL_SECONDS", "900"))
+
+# Se bloquean primero los productos (en orden de id, como la reserva de pedidos) y en una
+# sentencia aparte se suman las retenciones: así la suma ve todas las retenciones
+# confirmadas por quien tenía el bloqueo antes.
+LOCK_PRODUCTS_SQL = text("""
+    SELECT id, price, stock
+    FROM productos
+    WHERE id = ANY(:ids)
+    ORDER BY id
+    FOR NO KEY UPDATE
+""")
+
+# Stock retenido por otros carritos (usa idx_stock_holds_product_expiresat sin leer la tabla)
+HELD_BY_OTHERS_SQL = text("""
+    SELECT product_id, SUM(quantity) AS held
+    FROM stock_holds
+    WHERE product_id = ANY(:ids)
+      AND expiresat > timezone('utc', now())
+      AND cart_id <> :cart_id
+    GROUP BY product_id
+""")
+
+UPSERT_HOLDS_SQL = text("""
+    INSERT INTO stock_holds (cart_id, product_id, quantity, expiresat)
+    SELECT :cart_id, h.product_id, h.quantity, timezone('utc', now()) + make_interval(secs => :ttl)
+    FROM unnest(CAST(:ids AS varchar[]), CAST(:qtys AS integer[])) AS h(product_id, quantity)
+    ON CONFLICT (cart_id, product_id) DO UPDATE
+    SET quantity = EXCLUDED.quantity, expiresat = EXCLUDED.expiresat
+""")
+
+RELEASE_OTHER_HOLDS_SQL = text("""
+    DELETE FROM stock_holds WHERE cart_id = :cart_id AND product_id <> ALL(:ids)
+""")
+
+# Reducir una retención vigente no deja a nadie sin stock y no hace falta bloquear el
+# producto. Una caducada (aún sin borrar) ya no cuenta y no se renueva: ver reduce_hold.
+REDUCE_HOLD_SQL = text("""
+    UPDATE stock_holds
+    SET quantity = :quantity, expiresat = timezone('utc', now()) + make_interval(secs => :ttl)
+    WHERE cart_id = :cart_id AND product_id = :product_id
+      AND expiresat > timezone('utc', now())
+""")
+
+RELEASE_HOLD_SQL = text("""
+    DELETE FROM stock_holds WHERE cart_id = :cart_id AND product_id = :product_id
+""")
+
+REAP_EXPIRED_HOLDS_SQL = text("""
+    DELETE FROM stock_holds
+    WHERE (cart_id, product_id) IN (
+        SELECT cart_id, product_id FROM stock_holds
+        WHERE expiresat < timezone('utc', now())
+        LIMIT :batch_size
+    )
+""")
+
+
+def hold_stock(db: Session, cart_id: int, quantities: Dict[str, int], replace: bool = False) -> dict:
+    """
+    Retiene para el carrito las cantidades indicadas, todas o ninguna, comprobando el
+    stock disponible para la venta (stock menos retenciones vigentes de otros carritos).
+    Con replace=True se liberan las retenciones de productos que ya no están en el carrito.
+    Devuelve los productos bloqueados (id -> fila con price y stock). No hace commit.
+    """
+    ids = list(quantities)
+    products = {row.id: row for row in db.execute(LOCK_PRODUCTS_SQL, {"ids": ids})}
+    for product_id in ids:
+        if product_id not in products:
+            raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
+
+    held = {row.product_id: row.held for row in db.execute(HELD_BY_OTHERS_SQL, {"ids": ids, "cart_id": cart_id})}
+    for product_id, quantity in quantities.items():
+        available = products[product_id].stock - held.get(product_id, 0)
+        if available < quantity:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Not enough stock for product {product_id}. Available: {max(available, 0)}"
+            )
+
+    db.execute(UPSERT_HOLDS_SQL, {
+        "cart_id": cart_id,
+        "ids": ids,
+        "qtys": list(quantities.values()),
+        "ttl": STOCK_HOLD_TTL_SECONDS,
+    })
+    if replace:
+        db.execute(RELEASE_OTHER_HOLDS_SQL, {"cart_id": cart_id, "ids": ids})
+    return products
+
+
+def reduce_hold(db: Session, cart_id: int, product_id: str, quantity: int):
+    if quantity > 0:
+        reduced = db.execute(REDUCE_HOLD_SQL, {
+            "cart_id": cart_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "ttl": STOCK_HOLD_TTL_SECONDS,
+        }).rowcount
+        # Sin retención vigente el stock puede estar ya comprometido: se vuelve a comprobar
+        if not reduced:
+            hold_stock(db, cart_id, {product_id: quantity})
+    else:
+        db.execute(RELEASE_HOLD_SQL, {"cart_id": cart_id, "product_id": product_id})
@@ -0,0 +1,386 @@
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+
+class CartJournal:
+    """
+    Diario de escritura anticipada de los carritos en memoria. Cada cambio se añade
+    como una línea JSON al segmento activo antes de responder al cliente. Al volcar a
+    PostgreSQL se rota el segmento y, si el volcado termina bien, se borran los
+    segmentos anteriores; al arrancar se reproducen los que queden.
+    """
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 1
+        self._file = open(self._path(self.segment), "a", encoding="utf-8")
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012d}.ndjson")
+
+    def segments(self) -> List[int]:
+        return sorted(int(name.split(".")[0]) for name in os.listdir(self.directory) if name.endswith(".ndjson"))
+
+    def append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def rotate(self) -> int:
+        """Cierra el segmento activo y devuelve su número."""
+        with self._lock:
+            closed = self.segment
+            self._file.close()
+            self.segment += 1
+            self._file = open(self._path(self.segment), "a", encoding="utf-8")
+            return closed
+
+    def discard_through(self, segment: int):
+        for number in self.segments():
+            if number <= segment:
+                os.remove(self._path(number))
+
+    def replay(self) -> Dict[int, Optional[dict]]:
+        """Último estado de cada carrito en el diario (None si se borró)."""
+        carts: Dict[int, Optional[dict]] = {}
+        for number in self.segments():
+            with open(self._path(number), encoding="utf-8") as segment:
+                for line in segment:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Línea incompleta por una caída a mitad de escritura
+                        continue
+                    if record["op"] == "put":
+                        carts[record["cart"]["id"]] = record["cart"]
+                    else:
+                        carts[record["id"]] = None
+        return carts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class HotCartStore:
+    """
+    Capa caliente de carritos delante de la tabla carrito. Los carritos se guardan
+    como diccionarios serializables a JSON con su versión; los cambios se marcan como
+    pendientes y se vuelcan a PostgreSQL de forma asíncrona (write-behind).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.expired = 0
+
+    def flushed(self, carts: List[dict]):
+        """Tras un volcado confirmado en PostgreSQL; por defecto take_dirty ya los marcó como limpios."""
+
+    def get(self, cart_id: int) -> Optional[dict]:
+        cart = self._get(cart_id)
+        if cart is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cart
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "conflicts": self.conflicts,
+            "expired": self.expired,
+            "dirty": self.dirty_count(),
+        }
+
+
+class MemoryHotCartStore(HotCartStore):
+    """
+    Carritos en la memoria del proceso, repartidos en shards por usuario para que los
+    cambios de usuarios distintos no compitan por el mismo cerrojo. Con journal, los
+    cambios sobreviven a una caída del proceso hasta que se vuelcan.
+    Sólo es válido con una réplica del servicio.
+    """
+
+    def __init__(self, shards: int = 16, ttl: float = 1800, journal: Optional[CartJournal] = None):
+        super().__init__(ttl)
+        self.journal = journal
+        self._shards = [
+            {"lock": threading.Lock(), "carts": {}, "dirty": set(), "touched": {}}
+            for _ in range(shards)
+        ]
+        # cart_id -> user_id, para encontrar el shard de un carrito por su id
+        self._owners: Dict[int, str] = {}
+
+    def _shard(self, user_id: str) -> dict:
+        return self._shards[zlib.crc32(user_id.encode("utf-8")) % len(self._shards)]
+
+    def _get(self, cart_id: int) -> Optional[dict]:
+        user_id = self._owners.get(cart_id)
+        if user_id is None:
+            return None
+        shard = self._shard(user_id)
+        with shard["lock"]:
+            cart = shard["carts"].get(cart_id)
+            if cart is not None:
+                shard["touched"][cart_id] = time.monotonic()
+            return cart
+
+    def put(self, cart: dict, dirty: bool = True):
+        shard = self._shard(cart["user_id"])
+        with shard["lock"]:
+            self._store(shard, cart, dirty)
+            if dirty and self.journal:
+                self.journal.append({"op": "put", "cart": cart})
+
+    def put_if_absent(self, cart: dict) -> bool:
+        """Guarda un carrito leído de PostgreSQL (limpio) sólo si no está ya en memoria."""
+        shard = self._shard(cart["user_id"])
+        with shard["lock"]:
+            if cart["id"] in shard["carts"]:
+                return False
+            self._store(shard, cart, False)
+            return True
+
+    def compare_and_set(self, cart: dict, expected_version: int) -> bool:
+        shard = self._shard(cart["user_id"])
+        with shard["lock"]:
+            current = shard["carts"].get(cart["id"])
+            if current is None or current["version"] != expected_version:
+                self.conflicts += 1
+                return False
+            self._store(shard, cart, True)
+            # El cambio se anota en el diario antes de soltar el cerrojo del shard, para que
+            # las versiones de un carrito queden en el diario en el mismo orden en que se aplican
+            if self.journal:
+                self.journal.append({"op": "put", "cart": cart})
+        return True
+
+    def _store(self, shard: dict, cart: dict, dirty: bool):
+        shard["carts"][cart["id"]] = cart
+        shard["touched"][cart["id"]] = time.monotonic()
+        if dirty:
+            shard["dirty"].add(cart["id"])
+        self._owners[cart["id"]] = cart["user_id"]
+
+    def delete(self, cart_id: int):
+        user_id = self._owners.pop(cart_id, None)
+        if user_id is None:
+            return
+        shard = self._shard(user_id)
+        with shard["lock"]:
+            shard["carts"].pop(cart_id, None)
+            shard["touched"].pop(cart_id, None)
+            shard["dirty"].discard(cart_id)
+            if self.journal:
+                self.journal.append({"op": "delete", "id": cart_id})
+
+    def user_cart_ids(self, user_id: str) -> List[int]:
+        shard = self._shard(user_id)
+        with shard["lock"]:
+            return [cart_id for cart_id, cart in shard["carts"].items() if cart["user_id"] == user_id]
+
+    def take_dirty(self, user_id: Optional[str] = None) -> List[dict]:
+        """Devuelve los carritos pendientes de volcar (de un usuario o todos) y los marca como limpios."""
+        shards = [self._shard(user_id)] if user_id is not None else self._shards
+        carts = []
+        for shard in shards:
+            with shard["lock"]:
+                for cart_id in list(shard["dirty"]):
+                    cart = shard["carts"][cart_id]
+                    if user_id is None or cart["user_id"] == user_id:
+                        carts.append(cart)
+                        shard["dirty"].discard(cart_id)
+        return carts
+
+    def mark_dirty(self, carts: List[dict]):
+        # Tras un volcado fallido; si el carrito ha cambiado entretanto ya está pendiente
+        for cart in carts:
+            shard = self._shard(cart["user_id"])
+            with shard["lock"]:
+                if cart["id"] in shard["carts"]:
+                    shard["dirty"].add(cart["id"])
+
+    def dirty_count(self) -> int:
+        return sum(len(shard["dirty"]) for shard in self._shards)
+
+    def expire(self) -> int:
+        """Saca de memoria los carritos sin actividad durante el TTL que ya están volcados."""
+        deadline = time.monotonic() - self.ttl
+        expired = 0
+        for shard in self._shards:
+            with shard["lock"]:
+                for cart_id, touched in list(shard["touched"].items()):
+                    if touched < deadline and cart_id not in shard["dirty"]:
+                        shard["carts"].pop(cart_id, None)
+                        del shard["touched"][cart_id]
+                        self._owners.pop(cart_id, None)
+                        expired += 1
+        self.expired += expired
+        return expired
+
+
+# Escritura condicional a la versión en Redis: (clave, conjunto de pendientes) / (versión, carrito, id).
+# Un carrito pendiente no caduca hasta que se vuelca (ver REDIS_FLUSHED_SCRIPT).
+REDIS_CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current or cjson.decode(current)['version'] ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[3])
+return 1
+"""
+
+# Tras volcar un carrito: (clave, conjunto de pendientes) / (versión volcada, ttl, id). Si no ha
+# cambiado desde que se leyó deja de estar pendiente y vuelve a caducar; si ha cambiado sigue pendiente.
+REDIS_FLUSHED_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['version'] ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SREM', KEYS[2], ARGV[3])
+if current then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class RedisHotCartStore(HotCartStore):
+    """
+    Carritos en Redis, compartidos entre réplicas. Los pendientes de volcar se guardan
+    en un conjunto y sólo salen de él cuando el volcado se ha confirmado en PostgreSQL,
+    de modo que una caída del servicio no los pierde (la durabilidad depende de la
+    persistencia de Redis). Un carrito pendiente no caduca; la caducidad (EX) se
+    aplica a los ya volcados. Varias réplicas pueden volcar el mismo carrito: el
+    UPDATE del volcado sólo avanza la versión.
+    """
+
+    def __init__(self, client, ttl: float = 1800, prefix: str = "cart-service"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+        self._cas = client.register_script(REDIS_CAS_SCRIPT)
+        self._flushed = client.register_script(REDIS_FLUSHED_SCRIPT)
+
+    def _key(self, cart_id) -> str:
+        return f"{self.prefix}:cart:{cart_id}"
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    @property
+    def _dirty_key(self) -> str:
+        return f"{self.prefix}:dirty"
+
+    def _get(self, cart_id: int) -> Optional[dict]:
+        raw = self.client.get(self._key(cart_id))
+        return json.loads(raw) if raw is not None else None
+
+    def put(self, cart: dict, dirty: bool = True):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(cart["id"]), json.dumps(cart), ex=None if dirty else int(self.ttl))
+        pipe.sadd(self._user_key(cart["user_id"]), cart["id"])
+        pipe.expire(self._user_key(cart["user_id"]), int(self.ttl))
+        if dirty:
+            pipe.sadd(self._dirty_key, cart["id"])
+        pipe.execute()
+
+    def put_if_absent(self, cart: dict) -> bool:
+        """Guarda un carrito leído de PostgreSQL (limpio) sólo si no está ya en Redis (SET NX)."""
+        if not self.client.set(self._key(cart["id"]), json.dumps(cart), ex=int(self.ttl), nx=True):
+            return False
+        pipe = self.client.pipeline()
+        pipe.sadd(self._user_key(cart["user_id"]), cart["id"])
+        pipe.expire(self._user_key(cart["user_id"]), int(self.ttl))
+        pipe.execute()
+        return True
+
+    def compare_and_set(self, cart: dict, expected_version: int) -> bool:
+        ok = self._cas(
+            keys=[self._key(cart["id"]), self._dirty_key],
+            args=[expected_version, json.dumps(cart), cart["id"]],
+        )
+        if not ok:
+            self.conflicts += 1
+        return bool(ok)
+
+    def delete(self, cart_id: int):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(cart_id))
+        pipe.srem(self._dirty_key, cart_id)
+        pipe.execute()
+
+    def user_cart_ids(self, user_id: str) -> List[int]:
+        return [int(cart_id) for cart_id in self.client.smembers(self._user_key(user_id))]
+
+    def take_dirty(self, user_id: Optional[str] = None) -> List[dict]:
+        """Carritos pendientes (de un usuario o todos); siguen pendientes hasta flushed()."""
+        if user_id is not None:
+            cart_ids = [cart_id for cart_id in self.user_cart_ids(user_id) if self.client.sismember(self._dirty_key, cart_id)]
+        else:
+            cart_ids = [int(cart_id) for cart_id in self.client.smembers(self._dirty_key)]
+        if not cart_ids:
+            return []
+        raws = self.client.mget([self._key(cart_id) for cart_id in cart_ids])
+        missing = [cart_id for cart_id, raw in zip(cart_ids, raws) if raw is None]
+        if missing:
+            # Sólo un carrito borrado (delete ya lo saca del conjunto) puede faltar
+            self.client.srem(self._dirty_key, *missing)
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    def flushed(self, carts: List[dict]):
+        for cart in carts:
+            self._flushed(keys=[self._key(cart["id"]), self._dirty_key],
+                          args=[cart["version"], int(self.ttl), cart["id"]])
+
+    def mark_dirty(self, carts: List[dict]):
+        # Tras un volcado fallido siguen en el conjunto de pendientes
+        if carts:
+            self.client.sadd(self._dirty_key, *[cart["id"] for cart in carts])
+
+    def dirty_count(self) -> int:
+        return self.client.scard(self._dirty_key)
+
+    def expire(self) -> int:
+        # Redis elimina los carritos caducados por sí mismo
+        return 0
+
+
+def hot_store_from_env() -> Optional[HotCartStore]:
+    """
+    Capa caliente según las variables de entorno:
+    CART_STORE=postgres|memory|redis, CART_TTL_SECONDS, CART_STORE_SHARDS,
+    CART_JOURNAL_DIR (vacío para desactivar el diario), CART_JOURNAL_FSYNC y CART_REDIS_URL.
+    Con postgres (por defecto) no hay capa caliente.
+    """
+    backend = os.getenv("CART_STORE", "postgres").lower()
+    ttl = float(os.getenv("CART_TTL_SECONDS", "1800"))
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(os.getenv("CART_REDIS_URL", "redis://redis:6379/0"))
+        return RedisHotCartStore(client, ttl=ttl)
+    if backend == "memory":
+        journal_dir = os.getenv("CART_JOURNAL_DIR", "/var/lib/cart-service/journal")
+        journal = None
+        if journal_dir:
+            journal = CartJournal(journal_dir, fsync=os.getenv("CART_JOURNAL_FSYNC", "true").lower() == "true")
+        return MemoryHotCartStore(shards=int(os.getenv("CART_STORE_SHARDS", "16")), ttl=ttl, journal=journal)
+    return None
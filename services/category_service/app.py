@@ -1,25 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Text, Boolean, ForeignKey
+from sqlalchemy import func, any_, bindparam, Column, String, Text, Boolean, ForeignKey, Integer, TIMESTAMP, Index
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime
 
+from tree import CategoryTree, SUBTREE_PRODUCTS_SQL, add_node, move_node
+from petstore_common.cache import cache_from_env
+from petstore_common.http_cache import is_not_modified, make_etag, not_modified, validator_headers
+from petstore_common.db import create_db_engine, pool_stats, session_dependency
+from petstore_common.metrics import instrument_app
+from petstore_common.tracing import setup_tracing
+
 # Configuración de FastAPI
 app = FastAPI()
 
-# Configuración de PostgreSQL
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
-
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-
-# Configuración de SQLAlchemy
-engine = create_engine(DATABASE_URL)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("category-service")
+instrument_app(app, engine)
+setup_tracing(app, "category-service", engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
@@ -33,6 +37,18 @@ class CategoriaModel(Base):
     parentCategory = Column(String, ForeignKey("categorias.id"), name="parentcategory", nullable=True)  # Ajuste aquí
     imageUrl = Column(Text, name="imageurl", nullable=True)  # Ajuste aquí
     active = Column(Boolean, nullable=False, default=True)
+    updatedat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, index=True)
+
+class CategoriaClosureModel(Base):
+    # Tabla de cierre del árbol de categorías (ancestro, descendiente, profundidad)
+    __tablename__ = "categoria_closure"
+    ancestor = Column(String, ForeignKey("categorias.id", ondelete="CASCADE"), primary_key=True)
+    descendant = Column(String, ForeignKey("categorias.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("idx_categoria_closure_descendant_depth", "descendant", "depth"),
+    )
 
 # Crear las tablas en la base de datos
 Base.metadata.create_all(bind=engine)
@@ -45,6 +61,7 @@ class Categoria(BaseModel):
     parentCategory: Optional[str]
     imageUrl: Optional[str]
     active: Optional[bool] = True
+    updatedat: Optional[datetime] = None
 
     class Config:
         orm_mode = True
@@ -59,20 +76,58 @@ class CategoryUpdate(BaseModel):
     class Config:
         from_attributes = True  # Para Pydantic V2
 
+# Consultas por lotes: máximo de ids por petición
+CATEGORIES_BATCH_MAX_IDS = 100
+
+class CategoryBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=CATEGORIES_BATCH_MAX_IDS)
 
 # Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = session_dependency(SessionLocal)
+
+# Caché de lectura de categorías (se invalida en cada modificación)
+category_cache = cache_from_env("category-service")
+
+# Árbol de categorías en memoria, versionado como el listado
+category_tree = CategoryTree()
+
+def categories_version(db: Session):
+    # Versión de la colección sin cargar las filas: última modificación y número de categorías
+    return db.query(func.max(CategoriaModel.updatedat), func.count(CategoriaModel.id)).one()
+
+def load_category_tree(db: Session):
+    last_modified, total = categories_version(db)
+    tree = category_tree.refresh(
+        (last_modified, total),
+        lambda: jsonable_encoder([category_to_dict(category) for category in db.query(CategoriaModel).all()]),
+    )
+    return tree, make_etag("category-tree", last_modified, total), last_modified
+
+def category_to_dict(category: CategoriaModel) -> dict:
+    return {
+        "id": category.id,
+        "name": category.name,
+        "description": category.description,
+        "parentCategory": category.parentCategory,
+        "imageUrl": category.imageUrl,
+        "active": category.active,
+        "updatedat": category.updatedat,
+    }
 
 # Endpoints
 @app.get("/api/categories", response_model=List[Categoria])
-def list_categories(db: Session = Depends(get_db)):
+def list_categories(request: Request, db: Session = Depends(get_db)):
     try:
-        return db.query(CategoriaModel).all()
+        last_modified, total = categories_version(db)
+        etag = make_etag("categories", last_modified, total)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
+        categories, generation = category_cache.lookup("categories", f"list:{etag}")
+        if categories is None:
+            categories = jsonable_encoder([category_to_dict(category) for category in db.query(CategoriaModel).all()])
+            category_cache.set("categories", f"list:{etag}", categories, generation)
+        return JSONResponse(content=categories, headers=validator_headers(etag, last_modified))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -87,10 +142,14 @@ def create_category(category: Categoria, db: Session = Depends(get_db)):
             description=category.description,
             parentCategory=category.parentCategory,
             imageUrl=category.imageUrl,
-            active=category.active
+            active=category.active,
+            updatedat=datetime.utcnow()
         )
         db.add(new_category)
+        db.flush()
+        add_node(db, new_category.id, new_category.parentCategory)
         db.commit()
+        category_cache.invalidate("categories")
         db.refresh(new_category)
         return new_category
     except HTTPException as e:
@@ -98,13 +157,103 @@ def create_category(category: Categoria, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/categories/{category_id}", response_model=Categoria)
-def get_category(category_id: str, db: Session = Depends(get_db)):
+@app.post("/api/categories:batchGet")
+def batch_get_categories(batch: CategoryBatchRequest, db: Session = Depends(get_db)):
+    """Varias categorías por id en una sola consulta, en el orden pedido."""
     try:
-        category = db.query(CategoriaModel).filter(CategoriaModel.id == category_id).first()
-        if not category:
+        ids = list(dict.fromkeys(batch.ids))
+        by_id = {
+            category.id: category
+            for category in db.query(CategoriaModel).filter(
+                CategoriaModel.id == any_(bindparam("ids", ids, type_=ARRAY(String)))
+            )
+        }
+        return {
+            "categories": jsonable_encoder([category_to_dict(by_id[category_id]) for category_id in ids if category_id in by_id]),
+            "not_found": [category_id for category_id in ids if category_id not in by_id],
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/categories/tree")
+def get_category_tree(request: Request, db: Session = Depends(get_db)):
+    try:
+        tree, etag, last_modified = load_category_tree(db)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        return JSONResponse(content=tree.roots, headers=validator_headers(etag, last_modified))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/categories/{category_id}/subtree")
+def get_category_subtree(category_id: str, request: Request, db: Session = Depends(get_db)):
+    try:
+        tree, etag, last_modified = load_category_tree(db)
+        subtree = tree.subtree(category_id)
+        if subtree is None:
             raise HTTPException(status_code=404, detail="Category not found")
-        return category
+        etag = make_etag(etag, category_id)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        return JSONResponse(content=subtree, headers=validator_headers(etag, last_modified))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/categories/{category_id}/breadcrumbs")
+def get_category_breadcrumbs(category_id: str, request: Request, db: Session = Depends(get_db)):
+    try:
+        tree, etag, last_modified = load_category_tree(db)
+        breadcrumbs = tree.breadcrumbs(category_id)
+        if breadcrumbs is None:
+            raise HTTPException(status_code=404, detail="Category not found")
+        etag = make_etag(etag, category_id)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        return JSONResponse(content=breadcrumbs, headers=validator_headers(etag, last_modified))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/categories/{category_id}/products")
+def list_subtree_products(
+    category_id: str,
+    after: str = Query("", description="Último id de producto de la página anterior"),
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+):
+    """Productos de la categoría y de todas sus subcategorías, ordenados por id."""
+    try:
+        rows = db.execute(SUBTREE_PRODUCTS_SQL, {"id": category_id, "after": after, "limit": limit}).mappings().all()
+        headers = {"X-Next-Cursor": rows[-1]["id"]} if len(rows) == limit else {}
+        return JSONResponse(content=jsonable_encoder([dict(row) for row in rows]), headers=headers)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/categories/{category_id}", response_model=Categoria)
+def get_category(category_id: str, request: Request, db: Session = Depends(get_db)):
+    try:
+        data, generation = category_cache.lookup("categories", f"item:{category_id}")
+        if data is None:
+            category = db.query(CategoriaModel).filter(CategoriaModel.id == category_id).first()
+            if not category:
+                raise HTTPException(status_code=404, detail="Category not found")
+            data = jsonable_encoder(category_to_dict(category))
+            category_cache.set("categories", f"item:{category_id}", data, generation)
+
+        etag = make_etag("category", category_id, data["updatedat"])
+        last_modified = datetime.fromisoformat(data["updatedat"])
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        return JSONResponse(content=data, headers=validator_headers(etag, last_modified))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -116,9 +265,14 @@ def update_category(category_id: str, updated_category: CategoryUpdate, db: Sess
         category = db.query(CategoriaModel).filter(CategoriaModel.id == category_id).first()
         if not category:
             raise HTTPException(status_code=404, detail="Category not found")
-        for key, value in updated_category.dict(exclude_unset=True).items():
+        changes = updated_category.dict(exclude_unset=True)
+        if "parentCategory" in changes and changes["parentCategory"] != category.parentCategory:
+            move_node(db, category_id, changes["parentCategory"])
+        for key, value in changes.items():
             setattr(category, key, value)
+        category.updatedat = datetime.utcnow()
         db.commit()
+        category_cache.invalidate("categories")
         db.refresh(category)
         return category
     except HTTPException as e:
@@ -132,10 +286,24 @@ def delete_category(category_id: str, db: Session = Depends(get_db)):
         category = db.query(CategoriaModel).filter(CategoriaModel.id == category_id).first()
         if not category:
             raise HTTPException(status_code=404, detail="Category not found")
+        if db.query(CategoriaModel.id).filter(CategoriaModel.parentCategory == category_id).first():
+            raise HTTPException(status_code=409, detail="Category has subcategories")
+        # Las filas de categoria_closure se borran en cascada
         db.delete(category)
         db.commit()
+        category_cache.invalidate("categories")
         return {"message": "Category deleted successfully"}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Métricas de la caché (uso interno, no se expone a través de Kong)
+@app.get("/cache/stats")
+def cache_stats():
+    return category_cache.stats()
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+def db_stats():
+    return pool_stats(engine)
@@ -0,0 +1,111 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+# Tabla de cierre: una fila (ancestro, descendiente, profundidad) por cada par de categorías
+# conectadas en el árbol, incluida la propia categoría con profundidad 0.
+# Los cambios de estructura se serializan con un bloqueo consultivo de la transacción.
+LOCK_TREE_SQL = text("SELECT pg_advisory_xact_lock(hashtext('categoria_closure'))")
+
+INSERT_NODE_SQL = text("""
+    INSERT INTO categoria_closure (ancestor, descendant, depth)
+    SELECT CAST(:id AS varchar), CAST(:id AS varchar), 0
+    UNION ALL
+    SELECT ancestor, :id, depth + 1
+    FROM categoria_closure
+    WHERE descendant = :parent
+""")
+
+IS_IN_SUBTREE_SQL = text("""
+    SELECT EXISTS (SELECT 1 FROM categoria_closure WHERE ancestor = :id AND descendant = :parent)
+""")
+
+# Mover un subárbol: se borran los caminos desde los ancestros antiguos hacia el subárbol
+# y se crean los caminos desde los ancestros del nuevo padre.
+DETACH_SUBTREE_SQL = text("""
+    DELETE FROM categoria_closure
+    WHERE descendant IN (SELECT descendant FROM categoria_closure WHERE ancestor = :id)
+      AND ancestor NOT IN (SELECT descendant FROM categoria_closure WHERE ancestor = :id)
+""")
+
+ATTACH_SUBTREE_SQL = text("""
+    INSERT INTO categoria_closure (ancestor, descendant, depth)
+    SELECT super.ancestor, sub.descendant, super.depth + sub.depth + 1
+    FROM categoria_closure super
+    CROSS JOIN categoria_closure sub
+    WHERE super.descendant = :parent AND sub.ancestor = :id
+""")
+
+# Productos de una categoría y de todas sus subcategorías, paginados por id
+SUBTREE_PRODUCTS_SQL = text("""
+    SELECT p.id, p.name, p.price, p.category, p.animaltype, p.brand, p.stock, p.images, p.averagerating
+    FROM categoria_closure c
+    JOIN productos p ON p.category = c.descendant
+    WHERE c.ancestor = :id AND p.id > :after
+    ORDER BY p.id
+    LIMIT :limit
+""")
+
+
+def add_node(db: Session, category_id: str, parent_id: Optional[str]):
+    db.execute(LOCK_TREE_SQL)
+    db.execute(INSERT_NODE_SQL, {"id": category_id, "parent": parent_id})
+
+
+def move_node(db: Session, category_id: str, parent_id: Optional[str]):
+    db.execute(LOCK_TREE_SQL)
+    if parent_id is not None and db.execute(IS_IN_SUBTREE_SQL, {"id": category_id, "parent": parent_id}).scalar():
+        raise HTTPException(status_code=400, detail="A category cannot be moved under itself or its subcategories")
+    db.execute(DETACH_SUBTREE_SQL, {"id": category_id})
+    if parent_id is not None:
+        db.execute(ATTACH_SUBTREE_SQL, {"id": category_id, "parent": parent_id})
+
+
+class CategoryTree:
+    """
+    Árbol de categorías en memoria. Se reconstruye sólo cuando cambia la versión
+    de la colección (última modificación y número de categorías), que es la misma
+    que usan los ETag del listado.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.nodes: Dict[str, dict] = {}
+        self.roots: List[dict] = []
+        self._lock = threading.Lock()
+
+    def refresh(self, version, load: Callable[[], List[dict]]) -> "CategoryTree":
+        with self._lock:
+            if version != self.version:
+                self._build(load())
+                self.version = version
+        return self
+
+    def _build(self, categories: List[dict]):
+        nodes = {category["id"]: {**category, "children": []} for category in categories}
+        roots = []
+        for node in sorted(nodes.values(), key=lambda node: node["name"] or ""):
+            parent = nodes.get(node["parentCategory"])
+            if parent is not None:
+                parent["children"].append(node)
+            else:
+                roots.append(node)
+        self.nodes = nodes
+        self.roots = roots
+
+    def subtree(self, category_id: str) -> Optional[dict]:
+        return self.nodes.get(category_id)
+
+    def breadcrumbs(self, category_id: str) -> Optional[List[dict]]:
+        if category_id not in self.nodes:
+            return None
+        path = []
+        node = self.nodes.get(category_id)
+        while node is not None and len(path) < len(self.nodes):
+            path.append({"id": node["id"], "name": node["name"]})
+            node = self.nodes.get(node["parentCategory"])
+        return list(reversed(path))
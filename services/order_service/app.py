@@ -1,28 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Integer, DECIMAL, TIMESTAMP, Text, ForeignKey
+from typing import List, Literal, Optional
+from sqlalchemy import text, tuple_, Column, String, Integer, DECIMAL, TIMESTAMP, Text, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
+from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
 import uuid
 import json
+import base64
 import os
+import hashlib
+import logging
+import threading
+import time
+import requests
 
-# Configuración de FastAPI
-app = FastAPI()
+from reservations import reserve_stock
+from petstore_common.db import create_db_engine, pool_stats, session_dependency
+from petstore_common.metrics import instrument_app, track_outbound, track_stage
+from petstore_common.tracing import setup_tracing
 
-# Configuración de la base de datos
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB= "kong"
+logger = logging.getLogger(__name__)
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Configuración de FastAPI
+app = FastAPI()
 
-engine = create_engine(DATABASE_URL)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("order-service")
+instrument_app(app, engine)
+setup_tracing(app, "order-service", engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
@@ -32,7 +43,7 @@ class PedidoModel(Base):
 
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String(255), ForeignKey("usuarios.id"), nullable=False)
-    items = Column(Text, nullable=False)  # Almacena los items en formato JSON
+    items = Column(JSONB, nullable=False)  # Lista de ítems [{"product_id", "quantity"}]
     totalamount = Column(DECIMAL(10, 2), nullable=False)
     shipping_address = Column(Text, nullable=False)
     paymentmethod = Column(String, nullable=False)
@@ -41,6 +52,15 @@ class PedidoModel(Base):
     createdat = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
     updatedat = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
 
+    # Índices para la paginación por cursor sobre (createdat, id)
+    __table_args__ = (
+        Index("idx_pedidos_createdat_id", "createdat", "id"),
+        Index("idx_pedidos_user_createdat_id", "user_id", "createdat", "id"),
+        Index("idx_pedidos_status_createdat_id", "orderstatus", "createdat", "id"),
+        # Búsqueda de pedidos que contienen un producto (items @> '[{"product_id": ...}]')
+        Index("idx_pedidos_items_gin", "items", postgresql_using="gin", postgresql_ops={"items": "jsonb_path_ops"}),
+    )
+
 
 class UsuarioModel(Base):
     __tablename__ = "usuarios"
@@ -57,13 +77,12 @@ class UsuarioModel(Base):
 
 class AddressModel(Base):
     __tablename__ = "direcciones"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("usuarios.id"), nullable=False)
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("usuarios.id"), nullable=False, index=True)
     street = Column(String, nullable=False)
     city = Column(String, nullable=False)
     state = Column(String)
     country = Column(String, nullable=False)
-    user_email = Column(String, nullable=False, index=True)
 
 class ProductoModel(Base):
     __tablename__ = "productos"
@@ -83,11 +102,20 @@ class CarritoModel(Base):
     __tablename__ = "carrito"
     id = Column(Integer, primary_key=True, autoincrement=True)  # Cambiado a Integer y configurado como autoincremental
     user_id = Column(String(255), ForeignKey("usuarios.id") ,nullable=False)
-    items = Column(Text, nullable=False)
+    items = Column(JSONB, nullable=False)
     totalamount = Column(DECIMAL(10, 2), nullable=False)
     createdat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
 
+class IdempotencyKeyModel(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)  # NULL mientras la petición original está en curso
+    response_body = Column(Text, nullable=True)
+    createdat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    expiresat = Column(TIMESTAMP, nullable=False, index=True)
+
 
 # Crear las tablas
 Base.metadata.create_all(bind=engine)
@@ -115,21 +143,131 @@ class OrderResponse(BaseModel):
     updatedat: datetime
 
 # Dependencia para la base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = session_dependency(SessionLocal)
 
 # Rutas de la API
 PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://product-service/api/products")
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user-service/api/users")
 CART_SERVICE_URL = os.getenv("CART_SERVICE_URL", "http://cart-service/api/carts")
 
+# Volcado de la capa caliente de carritos antes de leer el carrito (vacío si cart_service no la usa)
+CART_FLUSH_URL = os.getenv("CART_FLUSH_URL", "")
+CART_FLUSH_TIMEOUT = float(os.getenv("CART_FLUSH_TIMEOUT", "2.0"))
+
+def flush_user_carts(user_id: str):
+    if not CART_FLUSH_URL:
+        return
+    try:
+        with track_outbound("cart-service"):
+            requests.post(CART_FLUSH_URL, params={"user_id": user_id}, timeout=CART_FLUSH_TIMEOUT).raise_for_status()
+    except requests.RequestException as e:
+        # Sin volcado el carrito de la base de datos puede estar desactualizado
+        raise HTTPException(status_code=503, detail=f"Cart service unavailable: {str(e)}")
+
+# Claves de idempotencia
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_EVICT_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_EVICT_INTERVAL_SECONDS", "300"))
+IDEMPOTENCY_EVICT_BATCH_SIZE = 1000
+
+def request_fingerprint(order_request: OrderRequest) -> str:
+    payload = json.dumps(order_request.dict(), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def find_idempotent_response(db: Session, key: str):
+    return db.query(IdempotencyKeyModel).filter(
+        IdempotencyKeyModel.key == key,
+        IdempotencyKeyModel.expiresat > datetime.utcnow(),
+        IdempotencyKeyModel.status_code.isnot(None),
+    ).first()
+
+def claim_idempotency_key(db: Session, key: str, fingerprint: str) -> bool:
+    """
+    Reserva la clave dentro de la transacción del pedido. Si otra petición con la
+    misma clave está en curso, el INSERT espera a que termine; si la clave había
+    expirado se reutiliza. Devuelve False si la clave ya pertenece a otro pedido.
+    """
+    now = datetime.utcnow()
+    claimed = db.execute(
+        text("""
+            INSERT INTO idempotency_keys (key, request_hash, createdat, expiresat)
+            VALUES (:key, :request_hash, :now, :expiresat)
+            ON CONFLICT (key) DO UPDATE
+            SET request_hash = EXCLUDED.request_hash,
+                status_code = NULL,
+                response_body = NULL,
+                createdat = EXCLUDED.createdat,
+                expiresat = EXCLUDED.expiresat
+            WHERE idempotency_keys.expiresat <= EXCLUDED.createdat
+            RETURNING key
+        """),
+        {
+            "key": key,
+            "request_hash": fingerprint,
+            "now": now,
+            "expiresat": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        },
+    ).first()
+    return claimed is not None
+
+def replay_idempotent_response(stored: IdempotencyKeyModel, fingerprint: str) -> JSONResponse:
+    if stored.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return JSONResponse(
+        status_code=stored.status_code,
+        content=json.loads(stored.response_body),
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+EVICT_IDEMPOTENCY_KEYS_SQL = text("""
+    DELETE FROM idempotency_keys
+    WHERE key IN (
+        SELECT key FROM idempotency_keys
+        WHERE expiresat < :now
+        LIMIT :batch_size
+    )
+""")
+
+def evict_expired_idempotency_keys():
+    # Borrado por lotes, una transacción por lote, para no mantener bloqueos largos sobre la tabla
+    while True:
+        try:
+            now = datetime.utcnow()
+            while True:
+                with engine.begin() as conn:
+                    deleted = conn.execute(
+                        EVICT_IDEMPOTENCY_KEYS_SQL,
+                        {"now": now, "batch_size": IDEMPOTENCY_EVICT_BATCH_SIZE},
+                    ).rowcount
+                if deleted < IDEMPOTENCY_EVICT_BATCH_SIZE:
+                    break
+        except Exception:
+            logger.exception("Error evicting idempotency keys")
+        time.sleep(IDEMPOTENCY_EVICT_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+def start_idempotency_eviction():
+    threading.Thread(target=evict_expired_idempotency_keys, daemon=True).start()
+
 @app.post("/api/orders", response_model=OrderResponse)
-def create_order(order_request: OrderRequest, db: Session = Depends(get_db)):
+def create_order(
+    order_request: OrderRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db),
+):
     try:
+        # 0. Si el cliente reintenta con la misma clave, devolver la respuesta guardada
+        if idempotency_key:
+            fingerprint = request_fingerprint(order_request)
+            stored = find_idempotent_response(db, idempotency_key)
+            if stored:
+                return replay_idempotent_response(stored, fingerprint)
+            if not claim_idempotency_key(db, idempotency_key, fingerprint):
+                db.rollback()
+                stored = find_idempotent_response(db, idempotency_key)
+                if not stored:
+                    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is already in progress")
+                return replay_idempotent_response(stored, fingerprint)
+
         # 1. Obtener la dirección del usuario desde la tabla de Direcciones
         user_address = db.query(AddressModel).filter(AddressModel.user_id == order_request.user_id).first()
         if not user_address:
@@ -151,36 +289,22 @@ def create_order(order_request: OrderRequest, db: Session = Depends(get_db)):
             )
 
         # 2. Obtener los ítems del carrito directamente desde la base de datos
+        flush_user_carts(order_request.user_id)
         cart = db.query(CarritoModel).filter(CarritoModel.user_id == order_request.user_id).first()
         if not cart:
             raise HTTPException(status_code=404, detail="Cart not found")
         
-        cart_items = eval(cart.items)  # Convertir el string JSON a una lista de ítems
-
-        # 3. Reducir el stock de los productos directamente en la base de datos de Productos
-        total_amount = 0
-        for item in cart_items:
-            product_id = item["product_id"]
-            quantity = item["quantity"]
+        cart_items = order_items(cart.items)
 
-            product = db.query(ProductoModel).filter(ProductoModel.id == product_id).first()
-            if not product:
-                raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
-            if product.stock < quantity:
-                raise HTTPException(status_code=400, detail=f"Not enough stock for product {product_id}. Available: {product.stock}")
-
-            # Reducir el stock y calcular el total
-            product.stock -= quantity
-            total_amount += product.price * quantity
-
-        # Guardar los cambios en los productos
-        db.commit()
+        # 3. Reservar el stock de todos los productos y liberar las retenciones del carrito
+        with track_stage("reserve_stock"):
+            total_amount = reserve_stock(db, cart_items, cart.id)
 
         # 4. Crear el pedido en la base de datos de Pedidos
         new_order = PedidoModel(
             id=str(uuid.uuid4()),
             user_id=order_request.user_id,
-            items=json.dumps(cart_items),
+            items=cart_items,
             totalamount=total_amount,
             paymentmethod=order_request.paymentmethod,
             paymentstatus="pending",
@@ -190,10 +314,9 @@ def create_order(order_request: OrderRequest, db: Session = Depends(get_db)):
             updatedat=datetime.utcnow(),
         )
         db.add(new_order)
-        db.commit()
-        db.refresh(new_order)
+        db.flush()
 
-        return OrderResponse(
+        response = OrderResponse(
             id=new_order.id,
             user_id=new_order.user_id,
             items=cart_items,
@@ -205,49 +328,119 @@ def create_order(order_request: OrderRequest, db: Session = Depends(get_db)):
             updatedat=new_order.updatedat,
         )
 
+        # 5. Guardar la respuesta para los reintentos y confirmar todo en una única transacción
+        if idempotency_key:
+            db.query(IdempotencyKeyModel).filter(IdempotencyKeyModel.key == idempotency_key).update(
+                {"status_code": 200, "response_body": json.dumps(jsonable_encoder(response))},
+                synchronize_session=False,
+            )
+        db.commit()
+
+        return response
+
     except HTTPException as e:
+        db.rollback()
         raise e
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Paginación por cursor de pedidos
+ORDERS_PAGE_SIZE = 50
+ORDERS_MAX_PAGE_SIZE = 500
+ORDERS_STREAM_BATCH_SIZE = 1000
+
+def encode_order_cursor(order: PedidoModel) -> str:
+    raw = json.dumps([order.createdat.isoformat(), order.id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_order_cursor(cursor: str):
+    try:
+        createdat, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(createdat), order_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def order_items(items: List[dict]) -> List[dict]:
+    # Convertir a un formato estándar con 'product_id'
+    return [
+        {
+            "product_id": item.get("product_id") or item.get("productid"),
+            "quantity": item["quantity"]
+        }
+        for item in items
+    ]
+
+def order_to_response(order: PedidoModel) -> OrderResponse:
+    return OrderResponse(
+        id=order.id,
+        user_id=order.user_id,
+        items=order_items(order.items),
+        totalamount=float(order.totalamount),
+        paymentmethod=order.paymentmethod,
+        paymentstatus=order.paymentstatus,
+        orderstatus=order.orderstatus,
+        createdat=order.createdat,
+        updatedat=order.updatedat,
+    )
+
+def orders_query(db: Session, user_id: Optional[str], orderstatus: Optional[str], product_id: Optional[str], after):
+    query = db.query(PedidoModel)
+    if user_id:
+        query = query.filter(PedidoModel.user_id == user_id)
+    if orderstatus:
+        query = query.filter(PedidoModel.orderstatus == orderstatus)
+    if product_id:
+        # Usa el índice GIN sobre items
+        query = query.filter(PedidoModel.items.contains([{"product_id": product_id}]))
+    if after:
+        query = query.filter(tuple_(PedidoModel.createdat, PedidoModel.id) < after)
+    return query.order_by(PedidoModel.createdat.desc(), PedidoModel.id.desc())
+
+def stream_orders(user_id: Optional[str], orderstatus: Optional[str], product_id: Optional[str], after):
+    # Sesión propia: el generador sigue ejecutándose después de que el endpoint haya devuelto la respuesta
+    db = SessionLocal()
+    try:
+        query = orders_query(db, user_id, orderstatus, product_id, after).yield_per(ORDERS_STREAM_BATCH_SIZE)
+        for order in query:
+            yield json.dumps(jsonable_encoder(order_to_response(order))) + "\n"
+    finally:
+        db.close()
+
 @app.get("/api/orders", response_model=List[OrderResponse])
-def list_orders(db: Session = Depends(get_db)):
+def list_orders(
+    response: Response,
+    user_id: Optional[str] = None,
+    orderstatus: Optional[str] = None,
+    product_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(ORDERS_PAGE_SIZE, ge=1, le=ORDERS_MAX_PAGE_SIZE),
+    format: Literal["json", "ndjson"] = "json",
+    db: Session = Depends(get_db),
+):
+    """
+    Lista los pedidos del más reciente al más antiguo con paginación por cursor.
+    Si hay más resultados, la cabecera X-Next-Cursor trae el cursor de la siguiente página.
+    Con format=ndjson se devuelven todos los pedidos a partir del cursor, uno por línea,
+    leyendo de un cursor de servidor por lotes (limit no se aplica).
+    """
     try:
-        orders = db.query(PedidoModel).all()
-        response = []
-
-        for order in orders:
-            try:
-                # Cargar los ítems del pedido
-                items = json.loads(order.items)
-
-                # Convertir a un formato estándar con 'product_id'
-                items = [
-                    {
-                        "product_id": item.get("product_id") or item.get("productid"),
-                        "quantity": item["quantity"]
-                    }
-                    for item in items
-                ]
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail="Invalid JSON format for items")
-
-            response.append(
-                OrderResponse(
-                    id=order.id,
-                    user_id=order.user_id,
-                    items=items,
-                    totalamount=float(order.totalamount),
-                    paymentmethod=order.paymentmethod,
-                    paymentstatus=order.paymentstatus,
-                    orderstatus=order.orderstatus,
-                    createdat=order.createdat,
-                    updatedat=order.updatedat,
-                )
+        after = decode_order_cursor(cursor) if cursor else None
+
+        if format == "ndjson":
+            return StreamingResponse(
+                stream_orders(user_id, orderstatus, product_id, after), media_type="application/x-ndjson"
             )
 
-        return response
+        orders = orders_query(db, user_id, orderstatus, product_id, after).limit(limit + 1).all()
+        if len(orders) > limit:
+            orders = orders[:limit]
+            response.headers["X-Next-Cursor"] = encode_order_cursor(orders[-1])
+
+        return [order_to_response(order) for order in orders]
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -259,23 +452,9 @@ def get_order(orderId: str, db: Session = Depends(get_db)):
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
 
-        try:
-            items = json.loads(order.items)
-            items = [OrderItem(productid=item["productId"], quantity=item["quantity"]) for item in items]
-        except (KeyError, json.JSONDecodeError) as e:
-            raise HTTPException(status_code=500, detail=f"Error processing items: {str(e)}")
-
-        return OrderResponse(
-            id=order.id,
-            user_id=order.user_id,
-            items=items,
-            totalamount=float(order.totalamount),
-            paymentmethod=order.paymentmethod,
-            paymentstatus=order.paymentstatus,
-            orderstatus=order.orderstatus,
-            createdat=order.createdat,
-            updatedat=order.updatedat,
-        )
+        return order_to_response(order)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -295,3 +474,8 @@ def cancel_order(orderId: str, db: Session = Depends(get_db)):
         return {"message": "Order cancelled successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+def db_stats():
+    return pool_stats(engine)
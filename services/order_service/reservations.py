@@ -0,0 +1,105 @@
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+
+
+# Bloqueo de los productos del pedido en orden de id (el mismo que usan las retenciones
+# de cart_service) antes de reservar. Va en una sentencia aparte para que la suma de
+# retenciones de RESERVE_STOCK_SQL vea las confirmadas mientras se esperaba el bloqueo.
+# FOR NO KEY UPDATE no bloquea las comprobaciones de claves ajenas hacia productos.
+LOCK_PRODUCTS_SQL = text("""
+    SELECT id FROM productos WHERE id = ANY(:ids) ORDER BY id FOR NO KEY UPDATE
+""")
+
+# Reserva de stock en una sola sentencia:
+#  1. agrupa las líneas del carrito por producto (un producto puede repetirse),
+#  2. suma las retenciones vigentes de otros carritos y calcula el disponible para la venta,
+#  3. descuenta el stock de todas las líneas sólo si todas tienen disponible suficiente,
+#  4. libera las retenciones del carrito del pedido, que pasan a ser stock descontado,
+#  5. devuelve una fila por producto pedido con precio, disponible y si se reservó.
+RESERVE_STOCK_SQL = text("""
+    WITH req AS (
+        SELECT r.id, SUM(r.qty)::int AS qty
+        FROM unnest(CAST(:ids AS varchar[]), CAST(:qtys AS integer[])) AS r(id, qty)
+        GROUP BY r.id
+    ),
+    held AS (
+        SELECT h.product_id, SUM(h.quantity) AS qty
+        FROM stock_holds h
+        JOIN req ON req.id = h.product_id
+        WHERE h.expiresat > timezone('utc', now())
+          AND h.cart_id IS DISTINCT FROM CAST(:cart_id AS integer)
+        GROUP BY h.product_id
+    ),
+    locked AS (
+        SELECT p.id, p.stock, p.stock - COALESCE(held.qty, 0) AS available, p.price, req.qty
+        FROM productos p
+        JOIN req ON req.id = p.id
+        LEFT JOIN held ON held.product_id = p.id
+        ORDER BY p.id
+        FOR NO KEY UPDATE OF p
+    ),
+    ok AS (
+        SELECT COUNT(*) = (SELECT COUNT(*) FROM req) AND COALESCE(BOOL_AND(available >= qty), TRUE) AS all_ok
+        FROM locked
+    ),
+    released AS (
+        DELETE FROM stock_holds h
+        USING ok
+        WHERE h.cart_id = CAST(:cart_id AS integer) AND ok.all_ok
+    ),
+    upd AS (
+        UPDATE productos p
+        SET stock = p.stock - locked.qty,
+            updatedat = timezone('utc', now())
+        FROM locked, ok
+        WHERE p.id = locked.id AND ok.all_ok AND p.stock >= locked.qty
+        RETURNING p.id
+    )
+    SELECT req.id, req.qty, GREATEST(locked.available, 0) AS available, locked.price, upd.id IS NOT NULL AS reserved
+    FROM req
+    LEFT JOIN locked ON locked.id = req.id
+    LEFT JOIN upd ON upd.id = req.id
+    ORDER BY req.id
+""")
+
+
+def reserve_stock(db: Session, cart_items: List[dict], cart_id: Optional[int] = None) -> Decimal:
+    """
+    Valida y descuenta el stock de todas las líneas del carrito contando como no
+    disponible lo retenido por otros carritos. Devuelve el importe total calculado
+    a partir del mismo resultado. Si falta algún producto o no hay stock suficiente
+    no se descuenta nada y se informa de todas las líneas afectadas a la vez.
+    """
+    quantities: Dict[str, int] = {}
+    for item in cart_items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    if not quantities:
+        return Decimal("0")
+
+    db.execute(LOCK_PRODUCTS_SQL, {"ids": list(quantities.keys())})
+    rows = db.execute(
+        RESERVE_STOCK_SQL,
+        {"ids": list(quantities.keys()), "qtys": list(quantities.values()), "cart_id": cart_id},
+    ).mappings().all()
+
+    missing = [row["id"] for row in rows if row["available"] is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(missing)}")
+
+    # Todas las líneas sin reservar, también las que tenían disponible: si el UPDATE no
+    # devolvió la fila el stock cambió entre el cálculo y el descuento
+    short = [row for row in rows if not row["reserved"]]
+    if short:
+        raise HTTPException(
+            status_code=400,
+            detail="Not enough stock for products: " + ", ".join(
+                f"{row['id']} (requested: {row['qty']}, available: {row['available']})"
+                for row in short
+            ),
+        )
+
+    return sum((row["price"] * row["qty"] for row in rows), Decimal("0"))
@@ -0,0 +1,2 @@
+# Código compartido entre los servicios de la tienda.
+# Los Dockerfile que lo usan se construyen desde el directorio services/.
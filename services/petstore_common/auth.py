@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+
+
+JWT_ALGORITHM = "HS256"
+REQUIRED_CLAIMS = ["exp", "iat", "jti", "sub"]
+
+
+class KeyRing:
+    """
+    Claves HMAC de los tokens por kid. Se firma con la clave activa y se verifica con
+    cualquiera de las publicadas, así que para rotar se añade la clave nueva, se activa
+    y la anterior se retira cuando hayan caducado sus tokens.
+    """
+
+    def __init__(self, keys: Dict[str, str], active_kid: Optional[str] = None):
+        if not keys:
+            raise ValueError("At least one JWT key is required")
+        self.keys = keys
+        self.active_kid = active_kid or next(iter(keys))
+        if self.active_kid not in keys:
+            raise ValueError(f"Unknown active JWT key: {self.active_kid}")
+
+    def sign(self, claims: dict, ttl: int) -> str:
+        now = int(time.time())
+        payload = {**claims, "iat": now, "exp": now + ttl, "jti": uuid.uuid4().hex}
+        return jwt.encode(payload, self.keys[self.active_kid], algorithm=JWT_ALGORITHM,
+                          headers={"kid": self.active_kid})
+
+
+def keyring_from_env() -> KeyRing:
+    """
+    JWT_KEYS: objeto JSON {kid: secreto} y JWT_ACTIVE_KID: kid con el que se firma.
+    Con una sola clave basta JWT_SECRET (kid "default").
+    """
+    raw = os.getenv("JWT_KEYS")
+    keys = json.loads(raw) if raw else {"default": os.getenv("JWT_SECRET", "")}
+    return KeyRing({kid: secret for kid, secret in keys.items() if secret}, os.getenv("JWT_ACTIVE_KID"))
+
+
+class TokenVerifier:
+    """
+    Verificación local de los tokens de user_service, sin llamarlo. Los tokens válidos
+    se guardan en un LRU por hash del token hasta su exp, de modo que las peticiones
+    siguientes con el mismo token no vuelven a comprobar la firma.
+    """
+
+    def __init__(self, keyring: KeyRing, max_entries: int = 10000):
+        self.keyring = keyring
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token: str, token_type: str = "access") -> dict:
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                expires_at, kid, payload = entry
+                # Una clave retirada invalida también sus tokens ya verificados
+                if expires_at > time.time() and kid in self.keyring.keys:
+                    # Un token de refresco ya verificado no vale como token de acceso (ni al revés)
+                    if payload.get("typ") != token_type:
+                        raise jwt.InvalidTokenError("Wrong token type")
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return payload
+                del self._entries[digest]
+        self.misses += 1
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.keyring.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        payload = jwt.decode(token, key, algorithms=[JWT_ALGORITHM], options={"require": REQUIRED_CLAIMS})
+        if payload.get("typ") != token_type:
+            raise jwt.InvalidTokenError("Wrong token type")
+
+        with self._lock:
+            self._entries[digest] = (payload["exp"], kid, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def verifier_from_env() -> TokenVerifier:
+    return TokenVerifier(keyring_from_env(), max_entries=int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000")))
+
+
+def current_user_dependency(verifier: TokenVerifier, token_url: str = "/api/users/login"):
+    """Dependencia de FastAPI que devuelve las claims del token de acceso del Authorization."""
+    oauth2_scheme = OAuth2PasswordBearer(tokenUrl=token_url)
+
+    def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+        try:
+            return verifier.verify(token)
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+    return get_current_user
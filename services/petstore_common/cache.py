@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class BaseCache:
+    """
+    Caché de lectura con espacios de nombres. Invalidar un espacio de nombres
+    incrementa su generación, de modo que todas sus claves dejan de ser válidas
+    sin tener que recorrerlas.
+    Los valores deben ser serializables a JSON (usar jsonable_encoder).
+
+    Para cachear una lectura de la base de datos se usa lookup() antes de leer y se pasa
+    su generación a set(): si se invalida mientras tanto, el valor leído queda guardado
+    en la generación anterior y ya no se sirve.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def lookup(self, namespace: str, key: str) -> Tuple[Optional[Any], int]:
+        """Valor en caché (o None) y generación del espacio de nombres en el momento de leer."""
+        generation = self._generation(namespace)
+        value = self._get(f"{namespace}:{generation}:{key}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        return self.lookup(namespace, key)[0]
+
+    def set(self, namespace: str, key: str, value: Any, generation: Optional[int] = None):
+        if generation is None:
+            generation = self._generation(namespace)
+        self._set(f"{namespace}:{generation}:{key}", value)
+
+    def invalidate(self, namespace: str):
+        self.invalidations += 1
+        self._bump_generation(namespace)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+class MemoryCache(BaseCache):
+    """LRU con caducidad (TTL) en la memoria del proceso."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    def _bump_generation(self, namespace: str):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            # Las entradas de generaciones anteriores ya no se pueden leer
+            stale = [key for key in self._entries if key.startswith(f"{namespace}:")]
+            for key in stale:
+                del self._entries[key]
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        return stats
+
+
+class RedisCache(BaseCache):
+    """
+    Caché compartida entre réplicas sobre un cliente compatible con Redis
+    (redis-py o un sustituto local con get/set/incr). Los errores del servidor
+    se tratan como fallos de caché para no tumbar el servicio.
+    """
+
+    def __init__(self, client, ttl: float = 60, prefix: str = "petstore"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def _generation(self, namespace: str) -> int:
+        try:
+            return int(self.client.get(f"{self.prefix}:{namespace}:generation") or 0)
+        except Exception:
+            self.errors += 1
+            return 0
+
+    def _bump_generation(self, namespace: str):
+        try:
+            self.client.incr(f"{self.prefix}:{namespace}:generation")
+        except Exception:
+            self.errors += 1
+
+    def _get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.client.get(f"{self.prefix}:{key}")
+        except Exception:
+            self.errors += 1
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def _set(self, key: str, value: Any):
+        try:
+            self.client.set(f"{self.prefix}:{key}", json.dumps(value), ex=max(1, int(self.ttl)))
+        except Exception:
+            self.errors += 1
+
+
+class NullCache(BaseCache):
+    """Caché desactivada: todas las lecturas son fallos."""
+
+    def _generation(self, namespace: str) -> int:
+        return 0
+
+    def _bump_generation(self, namespace: str):
+        pass
+
+    def _get(self, key: str) -> Optional[Any]:
+        return None
+
+    def _set(self, key: str, value: Any):
+        pass
+
+
+def cache_from_env(prefix: str) -> BaseCache:
+    """
+    Crea la caché según el entorno:
+    CACHE_BACKEND=memory|redis|none, CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES y CACHE_REDIS_URL.
+    """
+    backend = os.getenv("CACHE_BACKEND", "memory")
+    ttl = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(
+            os.getenv("CACHE_REDIS_URL", "redis://redis:6379/0"),
+            socket_timeout=0.1,
+            socket_connect_timeout=0.1,
+        )
+        return RedisCache(client, ttl=ttl, prefix=prefix)
+    if backend == "none":
+        return NullCache(ttl)
+    return MemoryCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")), ttl=ttl)
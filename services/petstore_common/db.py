@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict
+from urllib.parse import quote_plus
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def database_url(driver: str = "postgresql") -> str:
+    """
+    URL de PostgreSQL a partir de DATABASE_URL o, si no está, de las variables
+    POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD y POSTGRES_DB
+    que pasan los manifiestos de Kubernetes. POSTGRES_PASSWORD es obligatoria: sin
+    ella el servicio no arranca, en lugar de fallar después en cada conexión.
+    """
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return driver + url[url.index("://"):]
+    password = os.getenv("POSTGRES_PASSWORD")
+    if not password:
+        raise ValueError("POSTGRES_PASSWORD (or DATABASE_URL) must be set")
+    password = quote_plus(password)
+    user = quote_plus(os.getenv("POSTGRES_USER", "kong"))
+    host = os.getenv("POSTGRES_HOST", "postgres")
+    port = os.getenv("POSTGRES_PORT", "5432")
+    name = os.getenv("POSTGRES_DB", "kong")
+    return f"{driver}://{user}:{password}@{host}:{port}/{name}"
+
+
+class PoolStats:
+    """Esperas y uso del pool de conexiones de un engine."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_avg": self.wait_seconds_total / self.waits if self.waits else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class TimedPoolMixin:
+    # Tiempo que una petición espera por una conexión (incluye abrirla si hace falta)
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def create_db_engine(service: str, is_async: bool = False):
+    """
+    Engine de SQLAlchemy configurado por entorno:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS (0 = sin límite), DB_PGBOUNCER y DB_ECHO.
+
+    Con DB_PGBOUNCER=true (pgbouncer en modo transacción) no se envían parámetros de
+    arranque salvo application_name, el statement_timeout se fija con SET LOCAL al
+    empezar cada transacción y asyncpg no reutiliza sentencias preparadas.
+    Las conexiones abiertas por réplica son como mucho DB_POOL_SIZE + DB_MAX_OVERFLOW.
+    """
+    pgbouncer = env_flag("DB_PGBOUNCER", "false")
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+    if is_async:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        server_settings = {"application_name": service}
+        connect_args: Dict[str, Any] = {"server_settings": server_settings}
+        if pgbouncer:
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        elif statement_timeout:
+            server_settings["statement_timeout"] = str(statement_timeout)
+        factory, url, poolclass = create_async_engine, database_url("postgresql+asyncpg"), TimedAsyncQueuePool
+    else:
+        connect_args = {"application_name": service}
+        if statement_timeout and not pgbouncer:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+        factory, url, poolclass = create_engine, database_url("postgresql"), TimedQueuePool
+
+    engine = factory(
+        url,
+        poolclass=poolclass,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=env_flag("DB_POOL_PRE_PING", "true"),
+        echo=env_flag("DB_ECHO", "false"),
+        connect_args=connect_args,
+    )
+    sync_engine = engine.sync_engine if is_async else engine
+    stats = PoolStats()
+    sync_engine.pool.stats = stats
+
+    @event.listens_for(sync_engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(sync_engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        stats.invalidations += 1
+
+    if pgbouncer and statement_timeout:
+        @event.listens_for(sync_engine, "begin")
+        def set_statement_timeout(connection):
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {statement_timeout}")
+
+    return engine
+
+
+def pool_stats(engine) -> Dict[str, Any]:
+    """Estado del pool para /db/stats: tamaño, conexiones en uso y esperas acumuladas."""
+    pool = getattr(engine, "sync_engine", engine).pool
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **pool.stats.snapshot(),
+    }
+
+
+def session_dependency(session_factory):
+    """Dependencia de FastAPI que abre una sesión por petición y la cierra al terminar."""
+    def get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+    return get_db
+
+
+def async_session_dependency(session_factory):
+    async def get_db():
+        async with session_factory() as session:
+            yield session
+    return get_db
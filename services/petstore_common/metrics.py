@@ -0,0 +1,173 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from petstore_common.db import pool_stats
+
+
+# Con METRICS_ENABLED=false no se instala el middleware ni los eventos de SQLAlchemy
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones por ruta",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Peticiones en curso", ["method"])
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Sentencias SQL ejecutadas por petición",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Tiempo total en PostgreSQL por petición",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duración de cada sentencia SQL por tipo",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5),
+)
+OUTBOUND_LATENCY = Histogram(
+    "http_client_request_duration_seconds",
+    "Latencia de las llamadas a otros servicios",
+    ["target", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+STAGE_LATENCY = Histogram(
+    "hot_path_stage_duration_seconds",
+    "Duración de las etapas de los caminos críticos (reserva de stock, volcados...)",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+# [sentencias, segundos] de la petición en curso; los endpoints síncronos se ejecutan
+# en el threadpool con una copia del contexto, que apunta a la misma lista
+_request_db = ContextVar("request_db", default=None)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI (sin BaseHTTPMiddleware, para no envolver las respuestas) que mide
+    la latencia por ruta, las peticiones en curso y el uso de PostgreSQL de cada petición.
+    La ruta es la plantilla (/api/products/{product_id}), no la URL, para acotar las series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        db = [0, 0.0]
+        token = _request_db.set(db)
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_progress.dec()
+            _request_db.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(db[0])
+            DB_TIME_PER_REQUEST.labels(route).observe(db[1])
+
+
+def instrument_engine(engine):
+    """Mide cada sentencia SQL del engine (síncrono o asíncrono) y la suma a la petición en curso."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        operation = (statement.split(None, 1) or ["OTHER"])[0].upper()
+        DB_QUERY_DURATION.labels(operation).observe(elapsed)
+        db = _request_db.get()
+        if db is not None:
+            db[0] += 1
+            db[1] += elapsed
+
+
+class PoolCollector:
+    """Publica las estadísticas del pool de petstore_common.db en cada scrape."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def collect(self):
+        stats = pool_stats(self.engine)
+        for name in ("pool_size", "checked_out", "idle", "overflow", "wait_seconds_avg", "wait_seconds_max"):
+            yield GaugeMetricFamily(f"db_pool_{name}", f"Pool de conexiones: {name}", value=stats[name])
+        for name in ("checkouts", "connects", "invalidations", "timeouts"):
+            yield CounterMetricFamily(f"db_pool_{name}", f"Pool de conexiones: {name}", value=stats[name])
+
+
+def instrument_app(app: FastAPI, engine=None):
+    """Instala el middleware, los eventos del engine y el endpoint /metrics."""
+    if not METRICS_ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+    if engine is not None:
+        instrument_engine(engine)
+        REGISTRY.register(PoolCollector(engine))
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@contextmanager
+def track_outbound(target: str):
+    """Mide una llamada a otro servicio; el resultado es ok si el bloque no lanza excepción."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OUTBOUND_LATENCY.labels(target, outcome).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Mide una etapa de un camino crítico (por ejemplo, reserve_stock en create_order)."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
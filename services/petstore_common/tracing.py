@@ -0,0 +1,77 @@
+import os
+
+
+# Exportador de trazas: none (por defecto, sin trazas), otlp, file o memory
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+
+# Con TRACING_EXPORTER=memory, spans terminados (para pruebas: memory_exporter.get_finished_spans())
+memory_exporter = None
+
+# Endpoints internos que no se trazan
+TRACING_EXCLUDED_URLS = "/metrics,/db/stats,/cache/stats"
+
+
+def setup_tracing(app, service: str, engine=None):
+    """
+    Trazas distribuidas con OpenTelemetry: propaga el contexto W3C (traceparent) de las
+    peticiones entrantes a las llamadas salientes con httpx o requests y crea un span por
+    sentencia SQL del engine.
+
+    El muestreo es por cabecera (head-based): TRACING_SAMPLE_RATIO (0.05 por defecto) de
+    las trazas que empiezan en el servicio; si la petición ya trae traceparent (Kong u otro
+    servicio) se respeta su decisión, así que una traza se guarda entera o no se guarda.
+    OTLP usa OTEL_EXPORTER_OTLP_ENDPOINT y file escribe un span JSON por línea en
+    TRACING_FILE_PATH.
+    """
+    global memory_exporter
+    if TRACING_EXPORTER == "none":
+        return
+
+    from opentelemetry import trace
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service}),
+        sampler=ParentBased(TraceIdRatioBased(float(os.getenv("TRACING_SAMPLE_RATIO", "0.05")))),
+    )
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif TRACING_EXPORTER == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        out = open(os.getenv("TRACING_FILE_PATH", f"/tmp/{service}-traces.ndjson"), "a", encoding="utf-8")
+        exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    elif TRACING_EXPORTER == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+    trace.set_tracer_provider(provider)
+
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=provider, excluded_urls=TRACING_EXCLUDED_URLS)
+    if engine is not None:
+        SQLAlchemyInstrumentor().instrument(engine=getattr(engine, "sync_engine", engine), tracer_provider=provider)
+
+    # Clientes HTTP salientes: sólo los que usa el servicio están instalados
+    try:
+        from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+
+        HTTPXClientInstrumentor().instrument(tracer_provider=provider)
+    except ImportError:
+        pass
+    try:
+        from opentelemetry.instrumentation.requests import RequestsInstrumentor
+
+        RequestsInstrumentor().instrument(tracer_provider=provider)
+    except ImportError:
+        pass
@@ -1,30 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Integer, DECIMAL, TIMESTAMP, Text, ForeignKey
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from sqlalchemy import select, func, text, tuple_, any_, bindparam, Column, String, Integer, DECIMAL, TIMESTAMP, Text, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker
 from datetime import datetime
-import requests
+from decimal import Decimal
+import asyncio
+import base64
+import json
+import httpx
 import os
+import time
+
+from bulk import export_products, import_products, iter_csv_rows, iter_ndjson_rows
+from petstore_common.cache import cache_from_env
+from petstore_common.http_cache import is_not_modified, make_etag, not_modified, validator_headers
+from petstore_common.db import create_db_engine, pool_stats, async_session_dependency
+from petstore_common.metrics import instrument_app, track_outbound, track_stage
+from petstore_common.tracing import setup_tracing
 
 # URL del servicio de reseñas
-REVIEW_SERVICE_URL = "http://review-service/api/reviews"
+REVIEW_SERVICE_URL = os.getenv("REVIEW_SERVICE_URL", "http://review-service/api/reviews")
 
-# Configuración de FastAPI
-app = FastAPI()
+# Cliente HTTP hacia el servicio de reseñas
+REVIEW_SERVICE_TIMEOUT = float(os.getenv("REVIEW_SERVICE_TIMEOUT", "2.0"))
+REVIEW_SERVICE_MAX_CONNECTIONS = int(os.getenv("REVIEW_SERVICE_MAX_CONNECTIONS", "100"))
+REVIEW_BREAKER_FAILURE_THRESHOLD = int(os.getenv("REVIEW_BREAKER_FAILURE_THRESHOLD", "5"))
+REVIEW_BREAKER_RESET_TIMEOUT = float(os.getenv("REVIEW_BREAKER_RESET_TIMEOUT", "30"))
 
-# Configuración de la base de datos
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
+# Reseñas que acompañan al detalle de producto (primera página; review_service admite hasta 100)
+PRODUCT_REVIEWS_LIMIT = int(os.getenv("PRODUCT_REVIEWS_LIMIT", "20"))
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# Configuración de FastAPI
+app = FastAPI()
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("product-service", is_async=True)
+instrument_app(app, engine)
+setup_tracing(app, "product-service", engine)
+async_session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
 # Modelo de la base de datos para productos
@@ -43,6 +63,19 @@ class ProductoModel(Base):
     createdat = Column(TIMESTAMP, name="createdat", nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, name="updatedat", nullable=False, default=datetime.utcnow)
 
+    # Índices del listado: cada combinación de filtro y ordenación termina en id para el cursor
+    __table_args__ = (
+        Index("idx_productos_createdat_id", "createdat", "id"),
+        Index("idx_productos_price_id", "price", "id"),
+        Index("idx_productos_category_createdat_id", "category", "createdat", "id"),
+        Index("idx_productos_category_price_id", "category", "price", "id"),
+        Index("idx_productos_animaltype_price_id", "animaltype", "price", "id"),
+        Index("idx_productos_brand_price_id", "brand", "price", "id"),
+    )
+
+
+Index("idx_productos_rating_id", func.coalesce(ProductoModel.averagerating, 0), ProductoModel.id)
+
 
 class CategoriaModel(Base):
     __tablename__ = "categorias"
@@ -53,8 +86,58 @@ class CategoriaModel(Base):
     imageUrl = Column(Text, nullable=True)
     active = Column(Integer, nullable=False, default=1)
 
-# Crear las tablas en la base de datos
-Base.metadata.create_all(bind=engine)
+# Circuit breaker para el servicio de reseñas
+class CircuitBreaker:
+    """
+    Abre el circuito tras `failure_threshold` fallos seguidos. Mientras está abierto
+    las llamadas fallan al instante; pasado `reset_timeout` se vuelve a probar.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+# Caché de lectura del catálogo (se invalida en cada modificación de productos)
+product_cache = cache_from_env("product-service")
+
+review_breaker = CircuitBreaker(REVIEW_BREAKER_FAILURE_THRESHOLD, REVIEW_BREAKER_RESET_TIMEOUT)
+review_client: Optional[httpx.AsyncClient] = None
+
+@app.on_event("startup")
+async def startup():
+    global review_client
+    # Crear las tablas en la base de datos
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # Cliente compartido con keep-alive para reutilizar conexiones
+    review_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(REVIEW_SERVICE_TIMEOUT, connect=1.0),
+        limits=httpx.Limits(
+            max_connections=REVIEW_SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=REVIEW_SERVICE_MAX_CONNECTIONS,
+        ),
+    )
+
+@app.on_event("shutdown")
+async def shutdown():
+    await review_client.aclose()
+    await engine.dispose()
 
 # Modelos de Pydantic para validación
 class Producto(BaseModel):
@@ -74,83 +157,354 @@ class Producto(BaseModel):
     class Config:
         orm_mode = True
 
+# Consultas por lotes: máximo de ids por petición
+PRODUCTS_BATCH_MAX_IDS = 100
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=PRODUCTS_BATCH_MAX_IDS)
+    fields: Optional[str] = None
+
+# Disponible para la venta: stock menos las retenciones vigentes de los carritos
+# (tabla stock_holds de cart_service, sumada con idx_stock_holds_product_expiresat)
+AVAILABILITY_SQL = text("""
+    SELECT p.stock, COALESCE(SUM(h.quantity), 0) AS held
+    FROM productos p
+    LEFT JOIN stock_holds h ON h.product_id = p.id AND h.expiresat > timezone('utc', now())
+    WHERE p.id = :id
+    GROUP BY p.stock
+""")
+
 # Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
+get_db = async_session_dependency(async_session)
+
+def product_to_dict(product: ProductoModel) -> dict:
+    return {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "category": product.category,
+        "animaltype": product.animaltype,
+        "brand": product.brand,
+        "stock": product.stock,
+        "images": product.images,
+        "averagerating": product.averagerating,
+        "createdat": product.createdat,
+        "updatedat": product.updatedat
+    }
+
+async def load_product(db: AsyncSession, product_id: str) -> Optional[dict]:
+    # order_service (stock) y review_service (averagerating) modifican productos sin invalidar
+    # esta caché, pero siempre actualizan updatedat: la entrada es la de esa versión del producto
+    updatedat = (
+        await db.execute(select(ProductoModel.updatedat).where(ProductoModel.id == product_id))
+    ).scalar_one_or_none()
+    if updatedat is None:
+        return None
+    key = f"item:{product_id}@{updatedat.isoformat()}"
+    # La generación se toma antes de leer: una invalidación durante la lectura descarta el valor
+    cached, generation = product_cache.lookup("products", key)
+    if cached is not None:
+        return cached
+    product = await db.get(ProductoModel, product_id)
+    if not product:
+        return None
+    data = jsonable_encoder(product_to_dict(product))
+    product_cache.set("products", f"item:{product_id}@{product.updatedat.isoformat()}", data, generation)
+    return data
+
+async def fetch_reviews(product_id: str):
+    if not review_breaker.allow_request():
+        raise HTTPException(status_code=503, detail="Review service unavailable")
+    try:
+        with track_outbound("review-service"):
+            response = await review_client.get(
+                f"{REVIEW_SERVICE_URL}/{product_id}", params={"limit": PRODUCT_REVIEWS_LIMIT}
+            )
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        review_breaker.record_failure()
+        raise HTTPException(status_code=500, detail=f"Error fetching reviews: {str(e)}")
+    review_breaker.record_success()
+    reviews = response.json()
+    # El ETag de review_service identifica la versión de las reseñas; el resto de
+    # páginas se piden directamente a review_service con X-Next-Cursor
+    etag = response.headers.get("etag") or make_etag(response.text)
+    return reviews, etag, response.headers.get("x-next-cursor")
+
+# Paginación, filtros y ordenación del catálogo
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_MAX_PAGE_SIZE = 200
+
+# Criterio de ordenación -> (expresión, sentido). El id desempata y forma parte del cursor.
+PRODUCT_SORTS = {
+    "newest": (ProductoModel.createdat, "desc"),
+    "price_asc": (ProductoModel.price, "asc"),
+    "price_desc": (ProductoModel.price, "desc"),
+    "rating": (func.coalesce(ProductoModel.averagerating, 0), "desc"),
+}
+
+PRODUCT_FIELDS = {
+    "id", "name", "description", "price", "category", "animaltype", "brand",
+    "stock", "images", "averagerating", "createdat", "updatedat",
+}
+
+def encode_product_cursor(sort: str, value, product_id: str) -> str:
+    raw = json.dumps([sort, value.isoformat() if isinstance(value, datetime) else str(value), product_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_product_cursor(cursor: str, sort: str):
     try:
-        yield db
-    finally:
-        db.close()
+        cursor_sort, value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if cursor_sort != sort:
+            raise ValueError("cursor sort mismatch")
+        return (datetime.fromisoformat(value) if sort == "newest" else Decimal(value)), product_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # El id siempre se devuelve para poder paginar y enlazar el detalle
+    return ["id"] + [field for field in requested if field != "id"]
 
 # Endpoints para el servicio de productos
 @app.get("/api/products", response_model=List[Producto])
-def list_products(db: Session = Depends(get_db)):
+async def list_products(
+    request: Request,
+    category: Optional[str] = None,
+    animaltype: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: Optional[bool] = None,
+    sort: Literal["newest", "price_asc", "price_desc", "rating"] = "newest",
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por comas, p. ej. id,name,price"),
+    cursor: Optional[str] = None,
+    limit: int = Query(PRODUCTS_PAGE_SIZE, ge=1, le=PRODUCTS_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Lista el catálogo paginado por cursor. Si hay más resultados, la cabecera
+    X-Next-Cursor trae el cursor de la siguiente página (con el mismo sort y filtros).
+    """
     try:
-        products = db.query(ProductoModel).all()
-        return products
+        selected_fields = parse_fields(fields)
+        sort_expr, direction = PRODUCT_SORTS[sort]
+
+        conditions = []
+        if category:
+            conditions.append(ProductoModel.category == category)
+        if animaltype:
+            conditions.append(ProductoModel.animaltype == animaltype)
+        if brand:
+            conditions.append(ProductoModel.brand == brand)
+        if min_price is not None:
+            conditions.append(ProductoModel.price >= min_price)
+        if max_price is not None:
+            conditions.append(ProductoModel.price <= max_price)
+        if in_stock is not None:
+            conditions.append(ProductoModel.stock > 0 if in_stock else ProductoModel.stock <= 0)
+        if cursor:
+            keyset = tuple_(sort_expr, ProductoModel.id)
+            after = decode_product_cursor(cursor, sort)
+            conditions.append(keyset < after if direction == "desc" else keyset > after)
+
+        if direction == "desc":
+            order_by = [sort_expr.desc(), ProductoModel.id.desc()]
+        else:
+            order_by = [sort_expr.asc(), ProductoModel.id.asc()]
+
+        # 1. Claves de la página: id, versión y valor de ordenación, sin descripciones ni imágenes
+        page = (
+            await db.execute(
+                select(ProductoModel.id, ProductoModel.updatedat, sort_expr.label("sort_value"))
+                .where(*conditions)
+                .order_by(*order_by)
+                .limit(limit + 1)
+            )
+        ).all()
+        headers = {}
+        if len(page) > limit:
+            page = page[:limit]
+            headers["X-Next-Cursor"] = encode_product_cursor(sort, page[-1].sort_value, page[-1].id)
+
+        # 2. Validadores de la página: si el cliente ya la tiene, 304 sin cargar las filas
+        last_modified = max((row.updatedat for row in page), default=None)
+        etag = make_etag("products", request.url.query, *[f"{row.id}@{row.updatedat}" for row in page])
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+        headers.update(validator_headers(etag, last_modified))
+
+        # 3. Filas completas de la página (desde la caché si es posible), en el orden de las claves
+        products, generation = product_cache.lookup("products", f"page:{etag}")
+        if products is None:
+            ids = [row.id for row in page]
+            result = await db.execute(select(ProductoModel).where(ProductoModel.id.in_(ids)))
+            by_id = {product.id: product for product in result.scalars().all()}
+            products = jsonable_encoder([product_to_dict(by_id[product_id]) for product_id in ids if product_id in by_id])
+            product_cache.set("products", f"page:{etag}", products, generation)
+
+        if selected_fields:
+            products = [{field: product[field] for field in selected_fields} for product in products]
+        return JSONResponse(content=products, headers=headers)
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/products", response_model=Producto)
-def create_product(product: Producto, db: Session = Depends(get_db)):
+async def create_product(product: Producto, db: AsyncSession = Depends(get_db)):
     try:
         new_product = ProductoModel(**product.dict())
         db.add(new_product)
-        db.commit()
-        db.refresh(new_product)
+        await db.commit()
+        product_cache.invalidate("products")
+        await db.refresh(new_product)
         return new_product
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/products:batchGet")
+async def batch_get_products(batch: ProductBatchRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Varios productos por id en una sola consulta, en el orden pedido. Los ids que
+    no existen se devuelven en not_found en lugar de fallar toda la petición.
+    """
+    try:
+        selected_fields = parse_fields(batch.fields)
+        ids = list(dict.fromkeys(batch.ids))
+        result = await db.execute(
+            select(ProductoModel).where(ProductoModel.id == any_(bindparam("ids", ids, type_=ARRAY(String))))
+        )
+        by_id = {product.id: product for product in result.scalars().all()}
+
+        products = jsonable_encoder([product_to_dict(by_id[product_id]) for product_id in ids if product_id in by_id])
+        if selected_fields:
+            products = [{field: product[field] for field in selected_fields} for product in products]
+        return {"products": products, "not_found": [product_id for product_id in ids if product_id not in by_id]}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Formatos de la importación y exportación masiva -> (lector de filas, tipo de contenido)
+BULK_FORMATS = {
+    "csv": (iter_csv_rows, "text/csv"),
+    "ndjson": (iter_ndjson_rows, "application/x-ndjson"),
+}
+
+@app.post("/api/products:import")
+async def bulk_import_products(
+    request: Request,
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    dry_run: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Alta y actualización masiva de productos desde un CSV o NDJSON que se lee mientras
+    llega (ver bulk.py). Sin format se deduce del Content-Type. Devuelve los contadores
+    y los errores por línea; las filas con errores no se cargan.
+    """
+    try:
+        if format is None:
+            content_type = request.headers.get("content-type", "")
+            format = next((name for name, (_, media_type) in BULK_FORMATS.items() if media_type in content_type), None)
+            if format is None:
+                raise HTTPException(status_code=400, detail="Unknown import format, use format=csv or format=ndjson")
+        read_rows, _ = BULK_FORMATS[format]
+        with track_stage("product_import"):
+            summary = await import_products(db, read_rows(request.stream()), dry_run=dry_run)
+        if summary["inserted"] or summary["updated"]:
+            product_cache.invalidate("products")
+        return summary
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/products:export")
+async def bulk_export_products(format: Literal["csv", "ndjson"] = "ndjson"):
+    """Catálogo completo en streaming, ordenado por id, con las columnas que acepta la importación."""
+    _, media_type = BULK_FORMATS[format]
+    return StreamingResponse(
+        export_products(async_session, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="productos.{format}"'},
+    )
+
 @app.get("/api/products/{product_id}")
-def get_product_with_reviews(product_id: str, db: Session = Depends(get_db)):
+async def get_product_with_reviews(product_id: str, request: Request, db: AsyncSession = Depends(get_db)):
     try:
-        product = db.query(ProductoModel).filter(ProductoModel.id == product_id).first()
+        # El producto y sus reseñas se piden a la vez
+        product, reviews = await asyncio.gather(
+            load_product(db, product_id),
+            fetch_reviews(product_id),
+            return_exceptions=True,
+        )
+        if isinstance(product, Exception):
+            raise product
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
+        if isinstance(reviews, Exception):
+            raise reviews
+        reviews, reviews_etag, reviews_next_cursor = reviews
 
-        response = requests.get(f"{REVIEW_SERVICE_URL}/{product_id}")
-        response.raise_for_status()
-        reviews = response.json()
+        # Sin Last-Modified: la respuesta también cambia cuando cambian las reseñas
+        etag = make_etag("product", product_id, product["updatedat"], reviews_etag)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
 
-        return {
-            "product": {
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "category": product.category,
-                "animaltype": product.animaltype,
-                "brand": product.brand,
-                "stock": product.stock,
-                "images": product.images,
-                "averagerating": product.averagerating,
-                "createdat": product.createdat,
-                "updatedat": product.updatedat
+        return JSONResponse(
+            content={
+                "product": product,
+                "reviews": reviews,
+                "reviews_next_cursor": reviews_next_cursor,
             },
-            "reviews": reviews
+            headers=validator_headers(etag),
+        )
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/products/{product_id}/availability")
+async def get_product_availability(product_id: str, db: AsyncSession = Depends(get_db)):
+    """Stock, cantidad retenida en carritos y disponible para la venta (no se cachea)."""
+    try:
+        row = (await db.execute(AVAILABILITY_SQL, {"id": product_id})).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return {
+            "product_id": product_id,
+            "stock": row.stock,
+            "held": row.held,
+            "available": max(row.stock - row.held, 0),
         }
     except HTTPException as e:
         raise e
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching reviews: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/products/{product_id}", response_model=Producto)
-def update_product(product_id: str, product: Producto, db: Session = Depends(get_db)):
+async def update_product(product_id: str, product: Producto, db: AsyncSession = Depends(get_db)):
     try:
-        existing_product = db.query(ProductoModel).filter(ProductoModel.id == product_id).first()
+        existing_product = await db.get(ProductoModel, product_id)
         if not existing_product:
             raise HTTPException(status_code=404, detail="Product not found")
-        for key, value in product.dict(exclude_unset=True).items():
+        # averagerating lo mantiene review_service a partir de las reseñas
+        for key, value in product.dict(exclude_unset=True, exclude={"averagerating"}).items():
             setattr(existing_product, key, value)
-        db.commit()
-        db.refresh(existing_product)
+        existing_product.updatedat = datetime.utcnow()
+        await db.commit()
+        product_cache.invalidate("products")
+        await db.refresh(existing_product)
         return existing_product
     except HTTPException as e:
         raise e
@@ -158,15 +512,26 @@ def update_product(product_id: str, product: Producto, db: Session = Depends(get
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/products/{product_id}")
-def delete_product(product_id: str, db: Session = Depends(get_db)):
+async def delete_product(product_id: str, db: AsyncSession = Depends(get_db)):
     try:
-        product = db.query(ProductoModel).filter(ProductoModel.id == product_id).first()
+        product = await db.get(ProductoModel, product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
-        db.delete(product)
-        db.commit()
+        await db.delete(product)
+        await db.commit()
+        product_cache.invalidate("products")
         return {"message": "Product deleted successfully"}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Métricas de la caché (uso interno, no se expone a través de Kong)
+@app.get("/cache/stats")
+async def cache_stats():
+    return product_cache.stats()
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+async def db_stats():
+    return pool_stats(engine)
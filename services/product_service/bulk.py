@@ -0,0 +1,325 @@
+import codecs
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator, Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Filas validadas que se envían a PostgreSQL en cada COPY
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "5000"))
+# Errores por fila que se devuelven en el resumen (se cuentan todos)
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+# Filas que se leen del cursor de servidor en cada bloque de la exportación
+BULK_EXPORT_BATCH_ROWS = int(os.getenv("BULK_EXPORT_BATCH_ROWS", "2000"))
+
+# Columnas que se importan; averagerating lo mantiene review_service y las fechas PostgreSQL
+IMPORT_COLUMNS = ("id", "name", "description", "price", "category", "animaltype", "brand", "stock", "images")
+# La exportación añade estas columnas; al importar se ignoran para poder reimportar un fichero exportado
+EXPORT_COLUMNS = IMPORT_COLUMNS + ("averagerating", "createdat", "updatedat")
+VARCHAR_COLUMNS = ("id", "name", "category", "animaltype", "brand")
+VARCHAR_MAX_LENGTH = 255
+MAX_PRICE = Decimal("99999999.99")
+
+STAGING_TABLE = "productos_import"
+STAGING_COLUMNS = ("line",) + IMPORT_COLUMNS
+
+# Tabla temporal de la transacción: con pgbouncer en modo transacción sigue en la misma conexión
+CREATE_STAGING_SQL = text(f"""
+    CREATE TEMP TABLE {STAGING_TABLE} (
+        line integer NOT NULL,
+        id varchar(255) NOT NULL,
+        name varchar(255) NOT NULL,
+        description text,
+        price numeric(10, 2) NOT NULL,
+        category varchar(255),
+        animaltype varchar(255),
+        brand varchar(255),
+        stock integer NOT NULL,
+        images text
+    ) ON COMMIT DROP
+""")
+
+UNKNOWN_CATEGORY_SQL = text(f"""
+    SELECT s.line, s.id, s.category
+    FROM {STAGING_TABLE} s
+    WHERE s.category IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM categorias c WHERE c.id = s.category)
+    ORDER BY s.line
+""")
+
+DUPLICATES_SQL = text(f"""
+    SELECT count(*) - count(DISTINCT s.id)
+    FROM {STAGING_TABLE} s
+    WHERE s.category IS NULL
+       OR EXISTS (SELECT 1 FROM categorias c WHERE c.id = s.category)
+""")
+
+# Si un id se repite gana la última línea. Las filas que no cambian no se reescriben, así
+# no cambia su updatedat ni se invalidan sus ETags.
+UPSERT_SQL = text(f"""
+    WITH latest AS (
+        SELECT DISTINCT ON (s.id) s.*
+        FROM {STAGING_TABLE} s
+        WHERE s.category IS NULL
+           OR EXISTS (SELECT 1 FROM categorias c WHERE c.id = s.category)
+        ORDER BY s.id, s.line DESC
+    ), upserted AS (
+        INSERT INTO productos (id, name, description, price, category, animaltype, brand, stock, images, createdat, updatedat)
+        SELECT id, name, description, price, category, animaltype, brand, stock, images,
+               timezone('utc', now()), timezone('utc', now())
+        FROM latest
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name,
+            description = EXCLUDED.description,
+            price = EXCLUDED.price,
+            category = EXCLUDED.category,
+            animaltype = EXCLUDED.animaltype,
+            brand = EXCLUDED.brand,
+            stock = EXCLUDED.stock,
+            images = EXCLUDED.images,
+            updatedat = EXCLUDED.updatedat
+        WHERE (productos.name, productos.description, productos.price, productos.category,
+               productos.animaltype, productos.brand, productos.stock, productos.images)
+              IS DISTINCT FROM
+              (EXCLUDED.name, EXCLUDED.description, EXCLUDED.price, EXCLUDED.category,
+               EXCLUDED.animaltype, EXCLUDED.brand, EXCLUDED.stock, EXCLUDED.images)
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted) AS inserted,
+           count(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+""")
+
+EXPORT_SQL = text("""
+    SELECT id, name, description, price, category, animaltype, brand, stock, images,
+           averagerating, createdat, updatedat
+    FROM productos
+    ORDER BY id
+""")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Líneas (número, texto) de un cuerpo UTF-8 que llega por trozos, sin cargarlo entero."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    line_no = 0
+    try:
+        async for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                line_no += 1
+                yield line_no, line.rstrip("\r")
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail=f"Invalid UTF-8 after line {line_no}")
+    if pending:
+        yield line_no + 1, pending.rstrip("\r")
+
+
+async def iter_csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Filas de un CSV con cabecera como (línea, dict). Un registro con un campo entre
+    comillas que contiene saltos de línea ocupa varias líneas y se numera por la primera.
+    Si el registro no se puede leer se devuelve (línea, mensaje de error).
+    """
+    header = None
+    record, start = "", 0
+    async for line_no, line in iter_lines(chunks):
+        if record:
+            record += "\n" + line
+        else:
+            record, start = line, line_no
+        # Con un número impar de comillas el registro sigue en la línea siguiente
+        if record.count('"') % 2:
+            continue
+        current, record = record, ""
+        if not current.strip():
+            continue
+        try:
+            values = next(csv.reader([current]))
+        except csv.Error as e:
+            yield start, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [column.strip().lower() for column in values]
+            unknown = [column for column in header if column not in EXPORT_COLUMNS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+            continue
+        if len(values) != len(header):
+            yield start, f"Expected {len(header)} fields, got {len(values)}"
+            continue
+        yield start, dict(zip(header, values))
+    if record:
+        yield start, "Unterminated quoted field"
+    if header is None:
+        raise HTTPException(status_code=400, detail="Missing CSV header")
+
+
+async def iter_ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Un objeto JSON por línea como (línea, dict), o (línea, mensaje de error)."""
+    async for line_no, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, "Expected a JSON object"
+            continue
+        yield line_no, {str(key).lower(): value for key, value in row.items()}
+
+
+def _text(row: dict, field: str, required: bool = False):
+    value = row.get(field)
+    if isinstance(value, str):
+        value = value.strip() if field in VARCHAR_COLUMNS else value
+    if value is None or value == "":
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    if field in VARCHAR_COLUMNS and len(value) > VARCHAR_MAX_LENGTH:
+        raise ValueError(f"{field} is longer than {VARCHAR_MAX_LENGTH} characters")
+    return value
+
+
+def validate_product_row(row: dict) -> tuple:
+    """Valores de IMPORT_COLUMNS listos para COPY; ValueError con el motivo si la fila no es válida."""
+    unknown = [field for field in row if field not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    price = row.get("price")
+    if price is None or price == "" or isinstance(price, bool):
+        raise ValueError("price is required")
+    try:
+        price = Decimal(str(price).strip())
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0 or price > MAX_PRICE or price != price.quantize(Decimal("0.01")):
+        raise ValueError("price must be between 0 and 99999999.99 with at most 2 decimals")
+
+    stock = row.get("stock")
+    if isinstance(stock, str):
+        try:
+            stock = int(stock.strip())
+        except ValueError:
+            raise ValueError("stock must be an integer")
+    if not isinstance(stock, int) or isinstance(stock, bool):
+        raise ValueError("stock must be an integer")
+    if not 0 <= stock <= 2147483647:
+        raise ValueError("stock must be between 0 and 2147483647")
+
+    return (
+        _text(row, "id", required=True),
+        _text(row, "name", required=True),
+        _text(row, "description"),
+        price,
+        _text(row, "category"),
+        _text(row, "animaltype"),
+        _text(row, "brand"),
+        stock,
+        _text(row, "images"),
+    )
+
+
+async def import_products(db: AsyncSession, rows: AsyncIterator[Tuple[int, object]], dry_run: bool = False) -> dict:
+    """
+    Carga productos en una transacción: las filas se validan por bloques de
+    BULK_CHUNK_ROWS y cada bloque válido se copia con COPY (asyncpg) a una tabla temporal;
+    al final un solo INSERT ... ON CONFLICT actualiza productos. Las filas con errores se
+    saltan y se devuelven con su número de línea. Con dry_run no se modifica nada.
+    """
+    await db.execute(CREATE_STAGING_SQL)
+    raw = await (await db.connection()).get_raw_connection()
+    copy_conn = raw.driver_connection
+
+    summary = {"rows": 0, "valid": 0, "invalid": 0, "duplicates": 0, "inserted": 0, "updated": 0,
+               "unchanged": 0, "dry_run": dry_run}
+    errors: List[Dict[str, object]] = []
+
+    def add_error(line: int, product_id, message: str):
+        summary["invalid"] += 1
+        if len(errors) < BULK_MAX_REPORTED_ERRORS:
+            errors.append({"line": line, "id": product_id, "error": message})
+
+    chunk = []
+    async for line, row in rows:
+        summary["rows"] += 1
+        if isinstance(row, str):
+            add_error(line, None, row)
+            continue
+        try:
+            chunk.append((line,) + validate_product_row(row))
+        except ValueError as e:
+            add_error(line, row.get("id"), str(e))
+            continue
+        if len(chunk) >= BULK_CHUNK_ROWS:
+            await copy_conn.copy_records_to_table(STAGING_TABLE, records=chunk, columns=STAGING_COLUMNS)
+            chunk = []
+    if chunk:
+        await copy_conn.copy_records_to_table(STAGING_TABLE, records=chunk, columns=STAGING_COLUMNS)
+
+    for row in (await db.execute(UNKNOWN_CATEGORY_SQL)).all():
+        add_error(row.line, row.id, f"Unknown category: {row.category}")
+    summary["valid"] = summary["rows"] - summary["invalid"]
+    summary["duplicates"] = (await db.execute(DUPLICATES_SQL)).scalar()
+
+    if dry_run:
+        await db.rollback()
+    else:
+        result = (await db.execute(UPSERT_SQL)).one()
+        await db.commit()
+        summary["inserted"] = result.inserted
+        summary["updated"] = result.updated
+        summary["unchanged"] = summary["valid"] - summary["duplicates"] - result.inserted - result.updated
+    summary["errors"] = errors
+    summary["errors_truncated"] = summary["invalid"] > len(errors)
+    return summary
+
+
+def _export_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def export_products(session_factory, fmt: str) -> AsyncIterator[str]:
+    """
+    Catálogo completo en CSV o NDJSON leído con un cursor de servidor, por bloques de
+    BULK_EXPORT_BATCH_ROWS filas, sin cargar la tabla en memoria. Usa su propia sesión
+    porque la respuesta se sigue enviando después de salir del endpoint.
+    """
+    async with session_factory() as session:
+        result = await session.stream(EXPORT_SQL)
+        if fmt == "csv":
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(EXPORT_COLUMNS)
+            yield out.getvalue()
+        async for partition in result.partitions(BULK_EXPORT_BATCH_ROWS):
+            if fmt == "csv":
+                out = io.StringIO()
+                writer = csv.writer(out, lineterminator="\n")
+                writer.writerows([_export_value(value) for value in row] for row in partition)
+                yield out.getvalue()
+            else:
+                yield "".join(
+                    json.dumps({column: _export_value(value) for column, value in zip(EXPORT_COLUMNS, row)},
+                               ensure_ascii=False) + "\n"
+                    for row in partition
+                )
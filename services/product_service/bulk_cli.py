@@ -0,0 +1,98 @@
+"""
+Importación y exportación masiva del catálogo contra product_service.
+
+El fichero se envía por trozos a POST /api/products:import, sin cargarlo en memoria, y
+la exportación se escribe a disco según llega de GET /api/products:export. El formato
+se deduce de la extensión (.csv, .ndjson o .jsonl) si no se indica con --format.
+
+Uso:
+    python product_service/bulk_cli.py --url http://localhost:5000 import proveedor.csv
+    python product_service/bulk_cli.py import proveedor.ndjson --dry-run
+    python product_service/bulk_cli.py export catalogo.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+
+import httpx
+
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:5000")
+CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+def guess_format(path, fmt):
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    raise SystemExit(f"No se puede deducir el formato de {path}, usa --format")
+
+
+def read_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def run_import(args):
+    fmt = guess_format(args.path, args.format)
+    response = httpx.post(
+        f"{args.url}/api/products:import",
+        params={"format": fmt, "dry_run": str(args.dry_run).lower()},
+        headers={"Content-Type": CONTENT_TYPES[fmt]},
+        content=read_chunks(args.path),
+        timeout=None,
+    )
+    if response.status_code != 200:
+        raise SystemExit(f"Error {response.status_code}: {response.text}")
+    summary = response.json()
+    errors = summary.pop("errors")
+    print(json.dumps(summary, indent=2))
+    for error in errors:
+        print(f"línea {error['line']} ({error['id']}): {error['error']}", file=sys.stderr)
+    return 1 if summary["invalid"] else 0
+
+
+def run_export(args):
+    fmt = guess_format(args.path, args.format)
+    with httpx.stream("GET", f"{args.url}/api/products:export", params={"format": fmt}, timeout=None) as response:
+        if response.status_code != 200:
+            response.read()
+            raise SystemExit(f"Error {response.status_code}: {response.text}")
+        with open(args.path, "wb") as f:
+            for chunk in response.iter_bytes():
+                f.write(chunk)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=PRODUCT_SERVICE_URL, help="URL de product_service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="cargar productos desde un fichero")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=sorted(CONTENT_TYPES))
+    import_parser.add_argument("--dry-run", action="store_true", help="sólo validar, sin modificar el catálogo")
+    import_parser.set_defaults(run=run_import)
+
+    export_parser = subparsers.add_parser("export", help="guardar el catálogo en un fichero")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=sorted(CONTENT_TYPES))
+    export_parser.set_defaults(run=run_export)
+
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
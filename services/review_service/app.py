@@ -1,24 +1,24 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Integer, Text, ForeignKey, TIMESTAMP, DECIMAL
+from typing import Dict, List, Literal, Optional
+from sqlalchemy import func, text, tuple_, Column, String, Integer, Text, ForeignKey, TIMESTAMP, DECIMAL, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, Session
 from datetime import datetime
+import base64
+import json
 import uuid
 
+from ratings import apply_rating_change
+from petstore_common.http_cache import is_not_modified, make_etag, not_modified, validator_headers
+from petstore_common.db import create_db_engine, pool_stats, session_dependency
+from petstore_common.metrics import instrument_app
+from petstore_common.tracing import setup_tracing
 
-# Configuración de PostgreSQL
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-
-# Configuración de SQLAlchemy
-engine = create_engine(DATABASE_URL)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("review-service")
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
@@ -30,6 +30,23 @@ class ReviewModel(Base):
     rating = Column(Integer, nullable=False)
     comment = Column(Text, nullable=True)
     productid = Column(String, ForeignKey("productos.id"), nullable=False)
+    helpful = Column(Integer, nullable=True, default=0)
+    createdat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    updatedat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Versión de las reseñas de un producto: max(updatedat) y número de filas
+        Index("idx_resenas_productid_updatedat", "productid", "updatedat"),
+        # Paginación por cursor de las reseñas de un producto, una por criterio de ordenación
+        Index("idx_resenas_productid_createdat_id", "productid", "createdat", "id"),
+        Index("idx_resenas_productid_rating_createdat_id", "productid", "rating", "createdat", "id"),
+    )
+
+
+Index(
+    "idx_resenas_productid_helpful_createdat_id",
+    ReviewModel.productid, func.coalesce(ReviewModel.helpful, 0), ReviewModel.createdat, ReviewModel.id,
+)
 
 class UsuarioModel(Base):
     __tablename__ = "usuarios"
@@ -59,6 +76,19 @@ class ProductoModel(Base):
     createdat = Column(TIMESTAMP, name="createdat", nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, name="updatedat", nullable=False, default=datetime.utcnow)
 
+class ProductoRatingModel(Base):
+    # Agregado de valoraciones por producto, mantenido junto a cada cambio en resenas
+    __tablename__ = "producto_ratings"
+    productid = Column(String, ForeignKey("productos.id", ondelete="CASCADE"), primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+    rating_5 = Column(Integer, nullable=False, default=0)
+    updatedat = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+
 
 
 # Crear las tablas en la base de datos
@@ -68,29 +98,199 @@ Base.metadata.create_all(bind=engine)
 class Review(BaseModel):
     id: Optional[str] = None
     userId: str = Field(alias="user_id")
-    rating: int
+    rating: int = Field(..., ge=1, le=5)
     comment: Optional[str] = None
     productId: Optional[str] = Field(alias="productid")
+    helpful: Optional[int] = None
+    createdat: Optional[datetime] = None
 
     class Config:
         allow_population_by_field_name = True
 
+class RatingSummary(BaseModel):
+    productid: str
+    review_count: int
+    average_rating: Optional[float] = None
+    histogram: Dict[int, int]
+
+class ReviewBatchRequest(BaseModel):
+    product_ids: List[str] = Field(..., min_items=1, max_items=100)
+    limit: int = Field(5, ge=1, le=20)
+    sort: Literal["newest", "rating", "helpful"] = "newest"
+    summary_only: bool = False
+
+class ProductReviews(BaseModel):
+    productid: str
+    summary: RatingSummary
+    reviews: List[Review] = []
+    next_cursor: Optional[str] = None
+
 # Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = session_dependency(SessionLocal)
 
 app = FastAPI()
+instrument_app(app, engine)
+setup_tracing(app, "review-service", engine)
+
+# Paginación de reseñas: criterio de ordenación -> columnas del cursor (todas descendentes)
+REVIEW_SORTS = {
+    "newest": [ReviewModel.createdat, ReviewModel.id],
+    "rating": [ReviewModel.rating, ReviewModel.createdat, ReviewModel.id],
+    "helpful": [func.coalesce(ReviewModel.helpful, 0), ReviewModel.createdat, ReviewModel.id],
+}
+
+REVIEW_SORT_SQL = {
+    "newest": "createdat DESC, id DESC",
+    "rating": "rating DESC, createdat DESC, id DESC",
+    "helpful": "coalesce(helpful, 0) DESC, createdat DESC, id DESC",
+}
+
+# Primera página de reseñas de varios productos en una sola consulta
+def batch_reviews_sql(sort: str):
+    return text(f"""
+        SELECT r.*
+        FROM unnest(CAST(:ids AS varchar[])) AS p(id)
+        CROSS JOIN LATERAL (
+            SELECT id, user_id, rating, comment, productid, helpful, createdat, updatedat
+            FROM resenas
+            WHERE productid = p.id
+            ORDER BY {REVIEW_SORT_SQL[sort]}
+            LIMIT :limit
+        ) r
+    """)
+
+def review_sort_values(review, sort: str) -> list:
+    if sort == "newest":
+        return [review.createdat, review.id]
+    if sort == "rating":
+        return [review.rating, review.createdat, review.id]
+    return [review.helpful or 0, review.createdat, review.id]
+
+def encode_review_cursor(review, sort: str) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in review_sort_values(review, sort)]
+    raw = json.dumps([sort] + values)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_review_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        cursor_sort, *values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if cursor_sort != sort or len(values) != len(REVIEW_SORTS[sort]):
+            raise ValueError("cursor sort mismatch")
+        # El penúltimo valor es siempre createdat
+        values[-2] = datetime.fromisoformat(values[-2])
+        return tuple(values)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def review_to_dict(review) -> dict:
+    return {
+        "id": review.id,
+        "user_id": review.user_id,
+        "rating": review.rating,
+        "comment": review.comment,
+        "productid": review.productid,
+        "helpful": review.helpful,
+        "createdat": review.createdat,
+    }
+
+def rating_summary(product_id: str, ratings: Optional[ProductoRatingModel]) -> RatingSummary:
+    if not ratings:
+        # Producto sin reseñas (o aún no recalculado)
+        return RatingSummary(productid=product_id, review_count=0, histogram={star: 0 for star in range(1, 6)})
+    return RatingSummary(
+        productid=product_id,
+        review_count=ratings.review_count,
+        average_rating=round(ratings.rating_sum / ratings.review_count, 2) if ratings.review_count else None,
+        histogram={star: getattr(ratings, f"rating_{star}") for star in range(1, 6)},
+    )
 
 # Endpoints
 @app.get("/api/reviews/{productId}", response_model=List[Review])
-def list_product_reviews(productId: str, db: Session = Depends(get_db)):
+def list_product_reviews(
+    productId: str,
+    request: Request,
+    response: Response,
+    sort: Literal["newest", "rating", "helpful"] = "newest",
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Reseñas de un producto paginadas por cursor. Si hay más, la cabecera
+    X-Next-Cursor trae el cursor de la siguiente página (con el mismo sort).
+    """
+    try:
+        last_modified, total = db.query(func.max(ReviewModel.updatedat), func.count(ReviewModel.id)).filter(
+            ReviewModel.productid == productId
+        ).one()
+        etag = make_etag("reviews", productId, last_modified, total, sort, cursor, limit)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
+        columns = REVIEW_SORTS[sort]
+        query = db.query(ReviewModel).filter(ReviewModel.productid == productId)
+        if cursor:
+            query = query.filter(tuple_(*columns) < decode_review_cursor(cursor, sort))
+        reviews = query.order_by(*[column.desc() for column in columns]).limit(limit + 1).all()
+
+        response.headers.update(validator_headers(etag, last_modified))
+        if len(reviews) > limit:
+            reviews = reviews[:limit]
+            response.headers["X-Next-Cursor"] = encode_review_cursor(reviews[-1], sort)
+        return [review_to_dict(review) for review in reviews]
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching reviews: {str(e)}")
+
+@app.get("/api/reviews/{productId}/summary", response_model=RatingSummary)
+def get_rating_summary(productId: str, request: Request, response: Response, db: Session = Depends(get_db)):
+    try:
+        ratings = db.query(ProductoRatingModel).filter(ProductoRatingModel.productid == productId).first()
+        if not ratings:
+            return rating_summary(productId, None)
+
+        etag = make_etag("rating-summary", productId, ratings.updatedat, ratings.review_count, ratings.rating_sum)
+        if is_not_modified(request, etag, ratings.updatedat):
+            return not_modified(etag, ratings.updatedat)
+        response.headers.update(validator_headers(etag, ratings.updatedat))
+        return rating_summary(productId, ratings)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching rating summary: {str(e)}")
+
+@app.post("/api/reviews:batchGet", response_model=List[ProductReviews])
+def batch_get_reviews(batch: ReviewBatchRequest, db: Session = Depends(get_db)):
+    """
+    Resumen y primera página de reseñas de varios productos en una sola llamada,
+    en el orden pedido. Con summary_only sólo se devuelven los resúmenes.
+    """
     try:
-        reviews = db.query(ReviewModel).filter(ReviewModel.productid == productId).all()
-        return reviews
+        product_ids = list(dict.fromkeys(batch.product_ids))
+        summaries = {
+            ratings.productid: ratings
+            for ratings in db.query(ProductoRatingModel).filter(ProductoRatingModel.productid.in_(product_ids))
+        }
+
+        reviews_by_product: Dict[str, list] = {product_id: [] for product_id in product_ids}
+        if not batch.summary_only:
+            rows = db.execute(batch_reviews_sql(batch.sort), {"ids": product_ids, "limit": batch.limit + 1})
+            for row in rows:
+                reviews_by_product[row.productid].append(row)
+
+        results = []
+        for product_id in product_ids:
+            reviews = reviews_by_product[product_id]
+            next_cursor = None
+            if len(reviews) > batch.limit:
+                reviews = reviews[:batch.limit]
+                next_cursor = encode_review_cursor(reviews[-1], batch.sort)
+            results.append({
+                "productid": product_id,
+                "summary": rating_summary(product_id, summaries.get(product_id)),
+                "reviews": [review_to_dict(review) for review in reviews],
+                "next_cursor": next_cursor,
+            })
+        return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching reviews: {str(e)}")
 
@@ -105,6 +305,8 @@ def add_product_review(productId: str, review: Review, db: Session = Depends(get
             productid=productId
         )
         db.add(new_review)
+        db.flush()
+        apply_rating_change(db, productId, added=review.rating)
         db.commit()
         db.refresh(new_review)
         return new_review
@@ -114,25 +316,55 @@ def add_product_review(productId: str, review: Review, db: Session = Depends(get
 @app.put("/api/reviews/{productId}/{reviewId}", response_model=Review)
 def update_product_review(productId: str, reviewId: str, review: Review, db: Session = Depends(get_db)):
     try:
-        db_review = db.query(ReviewModel).filter(ReviewModel.id == reviewId, ReviewModel.productid == productId).first()
+        # Bloquear la reseña: la nota anterior de la que se calcula el cambio de la media
+        # no puede cambiar ni borrarse por otra petición hasta el commit
+        db_review = (
+            db.query(ReviewModel)
+            .filter(ReviewModel.id == reviewId, ReviewModel.productid == productId)
+            .with_for_update()
+            .first()
+        )
         if not db_review:
             raise HTTPException(status_code=404, detail="Review not found")
+        previous_rating = db_review.rating
         db_review.rating = review.rating
         db_review.comment = review.comment
+        db_review.updatedat = datetime.utcnow()
+        db.flush()
+        apply_rating_change(db, productId, added=review.rating, removed=previous_rating)
         db.commit()
         db.refresh(db_review)
         return db_review
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating review: {str(e)}")
 
 @app.delete("/api/reviews/{productId}/{reviewId}")
 def delete_product_review(productId: str, reviewId: str, db: Session = Depends(get_db)):
     try:
-        db_review = db.query(ReviewModel).filter(ReviewModel.id == reviewId, ReviewModel.productid == productId).first()
+        # Bloquear la reseña: la nota anterior de la que se calcula el cambio de la media
+        # no puede cambiar ni borrarse por otra petición hasta el commit
+        db_review = (
+            db.query(ReviewModel)
+            .filter(ReviewModel.id == reviewId, ReviewModel.productid == productId)
+            .with_for_update()
+            .first()
+        )
         if not db_review:
             raise HTTPException(status_code=404, detail="Review not found")
+        rating = db_review.rating
         db.delete(db_review)
+        db.flush()
+        apply_rating_change(db, productId, removed=rating)
         db.commit()
         return {"message": "Review deleted successfully"}
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting review: {str(e)}")
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+def db_stats():
+    return pool_stats(engine)
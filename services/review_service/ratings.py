@@ -0,0 +1,139 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+# Aplica a producto_ratings la variación que provoca una reseña (alta, cambio de nota o borrado)
+# y copia la media resultante en productos.averagerating. Sólo suma sobre una fila de agregados
+# existente: si el producto aún no la tiene no devuelve nada y hay que recalcularlo entero.
+# La fila del producto se bloquea primero (FOR NO KEY UPDATE, compatible con las claves
+# foráneas de resenas) para serializar las actualizaciones con el recálculo masivo.
+APPLY_RATING_DELTA_SQL = text("""
+    WITH target AS (
+        SELECT id FROM productos WHERE id = :productid FOR NO KEY UPDATE
+    ),
+    agg AS (
+        UPDATE producto_ratings pr SET
+            review_count = pr.review_count + :count,
+            rating_sum = pr.rating_sum + :sum,
+            rating_1 = pr.rating_1 + :r1,
+            rating_2 = pr.rating_2 + :r2,
+            rating_3 = pr.rating_3 + :r3,
+            rating_4 = pr.rating_4 + :r4,
+            rating_5 = pr.rating_5 + :r5,
+            updatedat = timezone('utc', now())
+        FROM target
+        WHERE pr.productid = target.id
+        RETURNING pr.productid, pr.review_count, pr.rating_sum
+    )
+    UPDATE productos p
+    SET averagerating = CASE WHEN agg.review_count > 0 THEN round(agg.rating_sum::numeric / agg.review_count, 2) END,
+        updatedat = timezone('utc', now())
+    FROM agg
+    WHERE p.id = agg.productid
+    RETURNING p.id
+""")
+
+LOCK_PRODUCTS_SQL = text("""
+    SELECT id FROM productos WHERE id = ANY(:ids) ORDER BY id FOR NO KEY UPDATE
+""")
+
+# Recalcula desde resenas los agregados de un lote de productos (también los que no tienen
+# reseñas, que quedan a cero) y sólo toca productos cuya media haya cambiado.
+RECOMPUTE_RATINGS_SQL = text("""
+    WITH counted AS (
+        SELECT p.id AS productid,
+               COUNT(r.id) AS review_count,
+               COALESCE(SUM(r.rating), 0) AS rating_sum,
+               COUNT(*) FILTER (WHERE r.rating = 1) AS rating_1,
+               COUNT(*) FILTER (WHERE r.rating = 2) AS rating_2,
+               COUNT(*) FILTER (WHERE r.rating = 3) AS rating_3,
+               COUNT(*) FILTER (WHERE r.rating = 4) AS rating_4,
+               COUNT(*) FILTER (WHERE r.rating = 5) AS rating_5
+        FROM productos p
+        LEFT JOIN resenas r ON r.productid = p.id
+        WHERE p.id = ANY(:ids)
+        GROUP BY p.id
+    ),
+    agg AS (
+        INSERT INTO producto_ratings AS pr
+            (productid, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5, updatedat)
+        SELECT productid, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5,
+               timezone('utc', now())
+        FROM counted
+        ON CONFLICT (productid) DO UPDATE SET
+            review_count = EXCLUDED.review_count,
+            rating_sum = EXCLUDED.rating_sum,
+            rating_1 = EXCLUDED.rating_1,
+            rating_2 = EXCLUDED.rating_2,
+            rating_3 = EXCLUDED.rating_3,
+            rating_4 = EXCLUDED.rating_4,
+            rating_5 = EXCLUDED.rating_5,
+            updatedat = EXCLUDED.updatedat
+        RETURNING productid, review_count, rating_sum
+    ),
+    updated AS (
+        UPDATE productos p
+        SET averagerating = CASE WHEN agg.review_count > 0 THEN round(agg.rating_sum::numeric / agg.review_count, 2) END,
+            updatedat = timezone('utc', now())
+        FROM agg
+        WHERE p.id = agg.productid
+          AND p.averagerating IS DISTINCT FROM
+              CASE WHEN agg.review_count > 0 THEN round(agg.rating_sum::numeric / agg.review_count, 2) END
+        RETURNING p.id
+    )
+    SELECT COUNT(*) FROM updated
+""")
+
+PRODUCT_IDS_BATCH_SQL = text("""
+    SELECT id FROM productos WHERE id > :after ORDER BY id LIMIT :batch_size
+""")
+
+
+def apply_rating_change(db: Session, product_id: str, added: Optional[int] = None, removed: Optional[int] = None):
+    """
+    Actualiza el agregado de valoraciones de un producto dentro de la transacción
+    de la reseña: added es la nota nueva (alta o modificación) y removed la anterior
+    (modificación o borrado). El cambio de la reseña tiene que estar ya enviado (flush):
+    si el producto no tiene fila de agregados se recalcula desde resenas, porque aplicar
+    sólo la variación (p. ej. la de un borrado) dejaría contadores negativos. No hace commit.
+    """
+    if added == removed:
+        return
+    params = {
+        "productid": product_id,
+        "count": (added is not None) - (removed is not None),
+        "sum": (added or 0) - (removed or 0),
+    }
+    for star in range(1, 6):
+        params[f"r{star}"] = (added == star) - (removed == star)
+    if db.execute(APPLY_RATING_DELTA_SQL, params).first() is None:
+        recompute_ratings(db, [product_id])
+
+
+def recompute_ratings(db: Session, product_ids: Iterable[str]) -> int:
+    """
+    Recalcula los agregados de los productos indicados a partir de resenas.
+    Devuelve cuántos productos han cambiado de media. No hace commit.
+    """
+    ids: List[str] = list(product_ids)
+    if not ids:
+        return 0
+    # Sentencias separadas: con READ COMMITTED el recálculo ve todas las reseñas
+    # confirmadas por las transacciones que tenían bloqueado el producto.
+    db.execute(LOCK_PRODUCTS_SQL, {"ids": ids})
+    return db.execute(RECOMPUTE_RATINGS_SQL, {"ids": ids}).scalar()
+
+
+def recompute_all_ratings(db: Session, batch_size: int = 1000) -> int:
+    """Recalcula todo el catálogo por lotes de productos, con un commit por lote."""
+    changed = 0
+    after = ""
+    while True:
+        ids = db.execute(PRODUCT_IDS_BATCH_SQL, {"after": after, "batch_size": batch_size}).scalars().all()
+        if not ids:
+            return changed
+        changed += recompute_ratings(db, ids)
+        db.commit()
+        after = ids[-1]
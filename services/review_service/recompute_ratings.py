@@ -0,0 +1,34 @@
+"""
+Recalcula desde resenas los agregados de valoraciones (producto_ratings y
+productos.averagerating). Sirve para el relleno inicial y para corregir derivas.
+
+Uso (dentro del pod de review_service):
+    python recompute_ratings.py                  # todo el catálogo
+    python recompute_ratings.py prod1 prod2      # sólo esos productos
+"""
+import argparse
+
+from app import SessionLocal
+from ratings import recompute_all_ratings, recompute_ratings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("product_ids", nargs="*", help="productos a recalcular (por defecto, todos)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.product_ids:
+            changed = recompute_ratings(db, args.product_ids)
+            db.commit()
+        else:
+            changed = recompute_all_ratings(db, batch_size=args.batch_size)
+        print(f"productos con la media actualizada: {changed}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,31 @@
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Literal, Optional
 from pydantic import BaseModel
 from sqlalchemy import text, Column, String, Text, DECIMAL, ForeignKey, Integer, TIMESTAMP
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
 
+from inverted_index import InvertedIndex
+from petstore_common.db import create_db_engine, pool_stats
+from petstore_common.metrics import instrument_app
+from petstore_common.tracing import setup_tracing
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# Configuración de PostgreSQL
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
 
-DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+app = FastAPI()
 
-# Configuración de SQLAlchemy
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("search-service", is_async=True)
+instrument_app(app, engine)
+setup_tracing(app, "search-service", engine)
 async_session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
@@ -30,6 +35,7 @@ class SearchResult(BaseModel):
     name: str
     description: Optional[str]
     type: str  # Puede ser "product" o "category"
+    rank: Optional[float] = None
 
 class ProductoModel(Base):
     __tablename__ = "productos"
@@ -46,43 +52,154 @@ class ProductoModel(Base):
     createdat = Column(TIMESTAMP, name="createdat", nullable=False, default=datetime.utcnow)
     updatedat = Column(TIMESTAMP, name="updatedat", nullable=False, default=datetime.utcnow)
 
+# Búsqueda a texto completo (tsvector + GIN) con tolerancia a erratas (pg_trgm).
+# Las erratas se comparan por palabra (word_similarity, operador <%) y no con el nombre
+# entero: "dogg" encuentra "Premium Dog Food Adult". El índice GIN gin_trgm_ops sirve igual.
+# Las columnas search_vector y los índices se crean en postgres/migrations/005_search_indexes.sql
+SEARCH_FULLTEXT_SQL = {
+    "productos": """
+        SELECT id, name, description, 'product' AS type,
+               ts_rank_cd(search_vector, query) + word_similarity(:query, lower(name)) AS rank
+        FROM "productos", websearch_to_tsquery('spanish', :query) AS query
+        WHERE search_vector @@ query OR :query <% lower(name)
+    """,
+    "categorias": """
+        SELECT id, name, description, 'category' AS type,
+               ts_rank_cd(search_vector, query) + word_similarity(:query, lower(name)) AS rank
+        FROM "categorias", websearch_to_tsquery('spanish', :query) AS query
+        WHERE search_vector @@ query OR :query <% lower(name)
+    """,
+}
+
+# Autocompletado por prefijo del nombre (índice btree text_pattern_ops sobre lower(name))
+SEARCH_PREFIX_SQL = {
+    "productos": """
+        SELECT id, name, description, 'product' AS type, 1.0 AS rank
+        FROM "productos"
+        WHERE lower(name) LIKE :prefix
+        ORDER BY lower(name), id
+        LIMIT :limit
+    """,
+    "categorias": """
+        SELECT id, name, description, 'category' AS type, 1.0 AS rank
+        FROM "categorias"
+        WHERE lower(name) LIKE :prefix
+        ORDER BY lower(name), id
+        LIMIT :limit
+    """,
+}
+
+def search_sql(type: str, mode: str):
+    tables = ["productos", "categorias"] if type == "all" else [type]
+    if mode == "prefix":
+        union = " UNION ALL ".join(f"({SEARCH_PREFIX_SQL[table]})" for table in tables)
+        return text(f"SELECT * FROM ({union}) AS results ORDER BY lower(name), type, id LIMIT :limit")
+    union = " UNION ALL ".join(f"({SEARCH_FULLTEXT_SQL[table]})" for table in tables)
+    return text(f"SELECT * FROM ({union}) AS results ORDER BY rank DESC, type, id LIMIT :limit OFFSET :offset")
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Índice invertido en memoria (opcional): SEARCH_BACKEND=memory
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "postgres")
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "30"))
+# Margen con el que se vuelve a leer antes de la marca de agua: una transacción larga o una
+# importación masiva (updatedat = inicio de la sentencia) confirman después filas con un
+# updatedat anterior a la última marca leída
+SEARCH_INDEX_WATERMARK_OVERLAP_SECONDS = float(os.getenv("SEARCH_INDEX_WATERMARK_OVERLAP_SECONDS", "300"))
+
+search_index = InvertedIndex()
+search_index_ready = False
+search_index_watermark: Optional[datetime] = None
+
+async def load_search_index(full: bool):
+    """
+    Carga en el índice los productos modificados desde la última carga (o todos si full)
+    y todas las categorías, que son pocas y no tienen columna updatedat.
+    Los productos borrados se detectan comparando los ids del índice con los de la tabla.
+    Los cambios en el índice toman su lock, así que se aplican en el threadpool.
+    """
+    global search_index_watermark
+    async with async_session() as session:
+        if full or search_index_watermark is None:
+            products = await session.execute(text('SELECT id, name, description, updatedat FROM "productos"'))
+        else:
+            products = await session.execute(
+                text('SELECT id, name, description, updatedat FROM "productos" WHERE updatedat >= :watermark'),
+                {"watermark": search_index_watermark - timedelta(seconds=SEARCH_INDEX_WATERMARK_OVERLAP_SECONDS)},
+            )
+        products = products.mappings().all()
+        product_ids = (await session.execute(text('SELECT id FROM "productos"'))).scalars().all()
+        categories = (await session.execute(text('SELECT id, name, description FROM "categorias"'))).mappings().all()
+
+    await run_in_threadpool(apply_search_index_changes, products, product_ids, categories)
+    for row in products:
+        if search_index_watermark is None or row["updatedat"] > search_index_watermark:
+            search_index_watermark = row["updatedat"]
+
+def apply_search_index_changes(products, product_ids, categories):
+    for row in products:
+        search_index.upsert("product", row["id"], row["name"], row["description"])
+    search_index.retain("product", product_ids)
+    search_index.retain("category", [row["id"] for row in categories])
+    for row in categories:
+        search_index.upsert("category", row["id"], row["name"], row["description"])
+
+async def refresh_search_index():
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_SECONDS)
+        try:
+            await load_search_index(full=False)
+        except Exception:
+            logger.exception("Error refreshing search index")
+
+@app.on_event("startup")
+async def build_search_index():
+    global search_index_ready
+    if SEARCH_BACKEND != "memory":
+        return
+    await load_search_index(full=True)
+    search_index_ready = True
+    asyncio.create_task(refresh_search_index())
+
 @app.get("/api/search", response_model=List[SearchResult])
 async def search(
     q: str = Query(..., alias="q", description="Consulta de búsqueda"),
-    type: Literal["productos", "categorias", "all"] = "all"
+    type: Literal["productos", "categorias", "all"] = "all",
+    mode: Literal["fulltext", "prefix"] = "fulltext",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
 ):
     """
     Realiza una búsqueda general en productos y categorías.
+    En modo fulltext los resultados vienen ordenados por relevancia y paginados con limit/offset.
+    En modo prefix (autocompletado) se devuelven los nombres que empiezan por la consulta.
     """
     try:
-        results = []
+        # Con el índice en memoria la consulta no toca PostgreSQL
+        if search_index_ready:
+            # BM25 usa CPU: fuera del bucle de eventos para no bloquear las demás peticiones
+            results = await run_in_threadpool(
+                search_index.search,
+                q,
+                type={"productos": "product", "categorias": "category"}.get(type),
+                limit=limit,
+                offset=offset,
+                prefix=mode == "prefix",
+            )
+            if not results:
+                raise HTTPException(status_code=404, detail="No results found")
+            return results
+
+        query = q.strip().lower()
+        params = {"query": query, "prefix": f"{escape_like(query)}%", "limit": limit, "offset": offset}
 
         async with async_session() as session:
-            # Consulta productos si type es "productos" o "all"
-            if type in ["productos", "all"]:
-                product_query = text("""
-                    SELECT id, name, description, 'product' AS type
-                    FROM "productos"
-                    WHERE LOWER(name) LIKE :query OR LOWER(description) LIKE :query
-                """)
-                try:
-                    products = await session.execute(product_query, {"query": f"%{q.lower()}%"})
-                    results.extend(products.mappings().all())  # Extraer como diccionarios
-                except Exception as e:
-                    raise HTTPException(status_code=500, detail=f"Error querying products: {str(e)}")
-
-            # Consulta categorías si type es "categorias" o "all"
-            if type in ["categorias", "all"]:
-                category_query = text("""
-                    SELECT id, name, description, 'category' AS type
-                    FROM "categorias"
-                    WHERE LOWER(name) LIKE :query OR LOWER(description) LIKE :query
-                """)
-                try:
-                    categories = await session.execute(category_query, {"query": f"%{q.lower()}%"})
-                    results.extend(categories.mappings().all())  # Extraer como diccionarios
-                except Exception as e:
-                    raise HTTPException(status_code=500, detail=f"Error querying categories: {str(e)}")
+            try:
+                rows = await session.execute(search_sql(type, mode), params)
+                results = rows.mappings().all()  # Extraer como diccionarios
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error querying search index: {str(e)}")
 
         if not results:
             raise HTTPException(status_code=404, detail="No results found")
@@ -92,3 +209,8 @@ async def search(
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+async def db_stats():
+    return pool_stats(engine)
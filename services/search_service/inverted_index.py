@@ -0,0 +1,226 @@
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Parámetros de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# El nombre pesa más que la descripción: sus términos se indexan varias veces
+NAME_BOOST = 3
+
+# Se compacta el índice cuando los documentos borrados superan esta fracción
+COMPACT_RATIO = 0.25
+
+STOPWORDS = {
+    # Español
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los", "o", "para", "por", "sin",
+    "su", "sus", "un", "una", "unos", "unas", "y",
+    # Inglés
+    "an", "and", "as", "at", "by", "for", "from", "in", "of", "on", "or", "the", "to", "with",
+}
+
+# Sufijos para un stemming ligero de español e inglés, del más largo al más corto
+SUFFIXES = sorted([
+    # Español
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "adoras", "adores", "ancias",
+    "mente", "acion", "ucion", "adora", "ador", "ante", "anza", "ible", "able", "ista", "osos", "osas",
+    "oso", "osa", "es",
+    # Inglés
+    "ations", "ation", "ness", "ings", "ing", "edly", "ed", "ies", "ly", "s",
+], key=len, reverse=True)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    # Minúsculas y sin tildes ("Arnés" -> "arnes")
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(token: str) -> str:
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [stem(token) for token in TOKEN_RE.findall(normalize(text)) if token not in STOPWORDS]
+
+
+class InvertedIndex:
+    """
+    Índice invertido en memoria de productos y categorías con puntuación BM25.
+
+    Cada documento recibe un número interno creciente; las listas de postings son
+    pares de arrays compactos (números de documento y frecuencias) que se mantienen
+    ordenados porque sólo se añade al final. Actualizar un documento lo marca como
+    borrado y lo vuelve a añadir; cuando hay demasiados borrados se compacta.
+
+    Las búsquedas y el refresco se ejecutan en hilos distintos del threadpool, así que
+    todas las operaciones toman el mismo lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.sorted_terms: List[str] = []
+        self.doc_keys: List[Tuple[str, str]] = []
+        self.doc_names: List[str] = []
+        self.doc_descriptions: List[Optional[str]] = []
+        self.doc_lengths = array("I")
+        self.alive = bytearray()
+        self.docnums: Dict[Tuple[str, str], int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docnums)
+
+    def ids(self, type: str) -> List[str]:
+        with self._lock:
+            return [doc_id for doc_type, doc_id in self.docnums if doc_type == type]
+
+    def upsert(self, type: str, id: str, name: str, description: Optional[str]):
+        with self._lock:
+            self._upsert(type, id, name, description)
+
+    def _upsert(self, type: str, id: str, name: str, description: Optional[str]):
+        key = (type, id)
+        if key in self.docnums:
+            docnum = self.docnums[key]
+            # Sin cambios en el texto indexado (p. ej. sólo ha cambiado el stock)
+            if self.doc_names[docnum] == name and self.doc_descriptions[docnum] == description:
+                return
+            self._remove(docnum)
+
+        terms = tokenize(name) * NAME_BOOST + tokenize(description)
+        docnum = len(self.doc_keys)
+        self.doc_keys.append(key)
+        self.doc_names.append(name)
+        self.doc_descriptions.append(description)
+        self.doc_lengths.append(len(terms))
+        self.alive.append(1)
+        self.docnums[key] = docnum
+        self.total_length += len(terms)
+
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = (array("I"), array("H"))
+                self.sorted_terms.insert(bisect_left(self.sorted_terms, term), term)
+            docs, tfs = self.postings[term]
+            docs.append(docnum)
+            tfs.append(min(frequency, 65535))
+
+    def delete(self, type: str, id: str):
+        with self._lock:
+            docnum = self.docnums.pop((type, id), None)
+            if docnum is not None:
+                self._remove(docnum, forget_key=False)
+
+    def retain(self, type: str, ids: Iterable[str]) -> int:
+        """Borra los documentos del tipo cuyo id no está en ids; devuelve cuántos se borran."""
+        keep = set(ids)
+        with self._lock:
+            gone = [doc_id for doc_type, doc_id in self.docnums if doc_type == type and doc_id not in keep]
+            for doc_id in gone:
+                self.delete(type, doc_id)
+        return len(gone)
+
+    def _remove(self, docnum: int, forget_key: bool = True):
+        self.alive[docnum] = 0
+        self.total_length -= self.doc_lengths[docnum]
+        self.doc_names[docnum] = ""
+        self.doc_descriptions[docnum] = None
+        if forget_key:
+            self.docnums.pop(self.doc_keys[docnum], None)
+        if len(self.doc_keys) - len(self.docnums) > COMPACT_RATIO * max(len(self.doc_keys), 1):
+            self.compact()
+
+    def compact(self):
+        # Reconstruye el índice sólo con los documentos vivos
+        documents = [
+            (key[0], key[1], self.doc_names[docnum], self.doc_descriptions[docnum])
+            for docnum, key in enumerate(self.doc_keys)
+            if self.alive[docnum]
+        ]
+        self._clear()
+        for document in documents:
+            self._upsert(*document)
+
+    def bulk_load(self, documents: Iterable[Tuple[str, str, str, Optional[str]]]):
+        with self._lock:
+            for type, id, name, description in documents:
+                self._upsert(type, id, name, description)
+
+    def _expand(self, token: str, prefix: bool) -> List[str]:
+        if not prefix:
+            return [token] if token in self.postings else []
+        start = bisect_left(self.sorted_terms, token)
+        terms = []
+        for term in self.sorted_terms[start:]:
+            if not term.startswith(token):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query: str, type: Optional[str] = None, limit: int = 20, offset: int = 0, prefix: bool = False):
+        """
+        Devuelve los documentos ordenados por BM25. Con prefix=True el último término
+        de la consulta se trata como prefijo (autocompletado).
+        """
+        with self._lock:
+            return self._search(query, type, limit, offset, prefix)
+
+    def _search(self, query: str, type: Optional[str], limit: int, offset: int, prefix: bool):
+        tokens = TOKEN_RE.findall(normalize(query))
+        if not tokens or not self.docnums:
+            return []
+
+        live_docs = len(self.docnums)
+        average_length = self.total_length / live_docs
+        scores: Dict[int, float] = {}
+        for position, token in enumerate(tokens):
+            is_prefix = prefix and position == len(tokens) - 1
+            if not is_prefix and token in STOPWORDS:
+                continue
+            for term in self._expand(stem(token), is_prefix):
+                docs, tfs = self.postings[term]
+                idf = math.log(1 + (live_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for docnum, tf in zip(docs, tfs):
+                    if not self.alive[docnum]:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docnum] / average_length)
+                    scores[docnum] = scores.get(docnum, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        if type:
+            scores = {docnum: score for docnum, score in scores.items() if self.doc_keys[docnum][0] == type}
+        best = heapq.nlargest(offset + limit, scores.items(), key=lambda entry: (entry[1], -entry[0]))
+        return [
+            {
+                "id": self.doc_keys[docnum][1],
+                "name": self.doc_names[docnum],
+                "description": self.doc_descriptions[docnum],
+                "type": self.doc_keys[docnum][0],
+                "rank": score,
+            }
+            for docnum, score in best[offset:]
+        ]
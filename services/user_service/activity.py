@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se vuelcan las marcas de actividad y cuántos usuarios por sentencia
+ACTIVITY_FLUSH_INTERVAL_SECONDS = float(os.getenv("ACTIVITY_FLUSH_INTERVAL_SECONDS", "5"))
+ACTIVITY_FLUSH_BATCH_SIZE = int(os.getenv("ACTIVITY_FLUSH_BATCH_SIZE", "1000"))
+
+# Columnas de usuarios que se pueden actualizar desde el buffer
+ACTIVITY_COLUMNS = ("lastlogin",)
+
+# Un UPDATE por lote; la marca sólo avanza, así que un volcado tardío no pisa uno más reciente
+FLUSH_ACTIVITY_SQL = """
+    UPDATE usuarios
+    SET {column} = v.ts
+    FROM unnest(CAST(:ids AS varchar[]), CAST(:ts AS timestamp[])) AS v(id, ts)
+    WHERE usuarios.id = v.id
+      AND (usuarios.{column} IS NULL OR usuarios.{column} < v.ts)
+"""
+
+
+class ActivityBuffer:
+    """
+    Marcas de actividad (lastlogin) en memoria que un hilo vuelca a PostgreSQL cada
+    ACTIVITY_FLUSH_INTERVAL_SECONDS, para no hacer una escritura y un commit en cada
+    login. Por usuario se guarda sólo la marca más reciente. Al parar el servicio se
+    vuelca lo pendiente; si el proceso muere se pierden como mucho las marcas de un
+    intervalo.
+    """
+
+    def __init__(self, engine, column: str = "lastlogin",
+                 interval: float = ACTIVITY_FLUSH_INTERVAL_SECONDS, batch_size: int = ACTIVITY_FLUSH_BATCH_SIZE):
+        if column not in ACTIVITY_COLUMNS:
+            raise ValueError(f"Unknown activity column: {column}")
+        self.engine = engine
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flushed = 0
+        self._sql = text(FLUSH_ACTIVITY_SQL.format(column=column))
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, user_id: str, ts: Optional[datetime] = None):
+        ts = ts or datetime.utcnow()
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None or previous < ts:
+                self._pending[user_id] = ts
+
+    def _merge(self, entries: Dict[str, datetime]):
+        # Devuelve al buffer un lote que no se pudo volcar sin pisar marcas más nuevas
+        with self._lock:
+            for user_id, ts in entries.items():
+                previous = self._pending.get(user_id)
+                if previous is None or previous < ts:
+                    self._pending[user_id] = ts
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, {}
+            if not entries:
+                return 0
+            items = list(entries.items())
+            try:
+                with self.engine.begin() as conn:
+                    for start in range(0, len(items), self.batch_size):
+                        batch = items[start:start + self.batch_size]
+                        conn.execute(self._sql, {
+                            "ids": [user_id for user_id, _ in batch],
+                            "ts": [ts for _, ts in batch],
+                        })
+            except Exception:
+                self._merge(entries)
+                raise
+            self.flushed += len(items)
+            return len(items)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing user activity")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "flushed": self.flushed}
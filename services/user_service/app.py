@@ -1,43 +1,54 @@
+from anyio import to_thread
 from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import create_engine, Column, String, Integer, TIMESTAMP, Text, ForeignKey
+from sqlalchemy import any_, bindparam, Column, String, TIMESTAMP, Text, ForeignKey
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, relationship, joinedload, Session
 import jwt
 from datetime import datetime
-from bcrypt import hashpw, gensalt, checkpw  
 import uuid
+import os
+
+from activity import ActivityBuffer
+from passwords import PasswordHasher, THREADPOOL_SIZE
+from petstore_common.auth import current_user_dependency, keyring_from_env, TokenVerifier
+from petstore_common.db import create_db_engine, pool_stats, session_dependency
+from petstore_common.metrics import instrument_app
+from petstore_common.tracing import setup_tracing
 
 
 # FastAPI app
 app = FastAPI()
 
-# Autenticación con JWT
-SECRET_KEY = "21b5b0060b7f63d5922ae9de7d070f2f8e7d8e6de685f6ee3d54ba7bb8cabba0"
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Autenticación con JWT: claves por kid (JWT_KEYS / JWT_ACTIVE_KID, ver petstore_common/auth.py)
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))
+REFRESH_TOKEN_TTL_SECONDS = int(os.getenv("REFRESH_TOKEN_TTL_SECONDS", str(30 * 24 * 3600)))
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload["email"]
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-# Configuración de PostgreSQL
-POSTGRES_HOST = "postgres"
-POSTGRES_PORT = "5432"
-POSTGRES_USER = "kong"
-POSTGRES_PASSWORD = "kongpassword"
-POSTGRES_DB = "kong"
-
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-
-# Configuración de SQLAlchemy
-engine = create_engine(DATABASE_URL)
+keyring = keyring_from_env()
+token_verifier = TokenVerifier(keyring, max_entries=int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000")))
+verify_access_token = current_user_dependency(token_verifier)
+
+def get_current_user(claims: dict = Depends(verify_access_token)) -> str:
+    # Id del usuario (claim sub): las búsquedas van por clave primaria o por direcciones.user_id
+    return claims["sub"]
+
+def issue_tokens(user) -> dict:
+    claims = {"sub": user.id, "email": user.email}
+    return {
+        "access_token": keyring.sign({**claims, "typ": "access"}, ACCESS_TOKEN_TTL_SECONDS),
+        "refresh_token": keyring.sign({**claims, "typ": "refresh"}, REFRESH_TOKEN_TTL_SECONDS),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS,
+    }
+
+# Configuración de la base de datos: credenciales (POSTGRES_*) y pool (DB_*) por
+# variables de entorno, ver petstore_common/db.py
+engine = create_db_engine("user-service")
+instrument_app(app, engine)
+setup_tracing(app, "user-service", engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
@@ -55,15 +66,16 @@ class UsuarioModel(Base):
     createdat = Column(TIMESTAMP, nullable=True, default=datetime.utcnow)
     lastlogin = Column(TIMESTAMP, nullable=True)
 
+    addresses = relationship("AddressModel", lazy="raise")
+
 class AddressModel(Base):
     __tablename__ = "direcciones"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("usuarios.id"), nullable=False)
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("usuarios.id"), nullable=False, index=True)
     street = Column(String, nullable=False)
     city = Column(String, nullable=False)
     state = Column(String)
     country = Column(String, nullable=False)
-    user_email = Column(String, nullable=False, index=True)
 
 # Crear las tablas en la base de datos
 Base.metadata.create_all(bind=engine)
@@ -87,20 +99,68 @@ class Address(BaseModel):
     state: Optional[str]
     country: str
 
+# Perfil del usuario autenticado con sus direcciones (sin contraseña)
+class UserMe(BaseModel):
+    id: str
+    username: str
+    email: str
+    firstname: Optional[str]
+    lastname: Optional[str]
+    phonenumber: Optional[str]
+    role: str
+    createdat: Optional[datetime] = None
+    lastlogin: Optional[datetime] = None
+    addresses: List[Address] = []
+
 class LoginRequest(BaseModel):
     email: str
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+# Datos públicos de un usuario (sin email, teléfono ni contraseña)
+class UserSummary(BaseModel):
+    id: str
+    username: str
+    firstname: Optional[str]
+    lastname: Optional[str]
+
+# Consultas por lotes: máximo de ids por petición
+USERS_BATCH_MAX_IDS = 100
+
+class UserBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=USERS_BATCH_MAX_IDS)
+
 # Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+get_db = session_dependency(SessionLocal)
+
+# bcrypt fuera de los hilos de las peticiones (ver passwords.py)
+password_hasher = PasswordHasher()
+
+@app.on_event("startup")
+async def configure_threadpool():
+    # Tamaño con el que se acota PASSWORD_MAX_PENDING (ver passwords.py)
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
-def hash_password(password: str) -> str:
-    return hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+@app.on_event("startup")
+def start_password_hasher():
+    password_hasher.start()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+# lastlogin se escribe por lotes en segundo plano (ver activity.py)
+activity_buffer = ActivityBuffer(engine)
+
+@app.on_event("startup")
+def start_activity_buffer():
+    activity_buffer.start()
+
+@app.on_event("shutdown")
+def stop_activity_buffer():
+    activity_buffer.shutdown()
 
 # Endpoints
 @app.post("/api/users/register", response_model=Usuario)
@@ -114,7 +174,7 @@ def register_user(user: Usuario, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="Email or username already exists")
         
         
-        hashed_password = hash_password(user.password)
+        hashed_password = password_hasher.hash(user.password)
 
 
         # Crear nuevo usuario
@@ -149,15 +209,19 @@ def login_user(request: LoginRequest, db: Session = Depends(get_db)):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # Verificar si la contraseña coincide con el hash almacenado
-        if not checkpw(request.password.encode('utf-8'), user.password.encode('utf-8')):
+        if not password_hasher.verify(request.password, user.password):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        # Generar el token JWT
-        token = jwt.encode({"email": user.email}, SECRET_KEY, algorithm="HS256")
-        user.lastlogin = datetime.utcnow()
-        db.commit()
-        
-        return {"access_token": token, "token_type": "bearer"}
+        # Rehash transparente si el hash se hizo con otro coste (BCRYPT_ROUNDS)
+        if password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.hash(request.password)
+            db.commit()
+
+        # lastlogin no se escribe aquí: se vuelca por lotes fuera de la petición
+        activity_buffer.record(user.id)
+
+        # Generar los tokens JWT (acceso y refresco)
+        return issue_tokens(user)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -165,10 +229,50 @@ def login_user(request: LoginRequest, db: Session = Depends(get_db)):
 
 
 
+@app.post("/api/users/token/refresh")
+def refresh_token(request: RefreshRequest, db: Session = Depends(get_db)):
+    """Nuevo par de tokens a partir de un token de refresco válido (el anterior sigue valiendo hasta su exp)."""
+    try:
+        try:
+            claims = token_verifier.verify(request.refresh_token, token_type="refresh")
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token has expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        user = db.query(UsuarioModel).filter(UsuarioModel.id == claims["sub"]).first()
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return issue_tokens(user)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/users/profile", response_model=Usuario)
 def get_user_profile(current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        user = db.query(UsuarioModel).filter(UsuarioModel.email == current_user).first()
+        user = db.query(UsuarioModel).filter(UsuarioModel.id == current_user).first()
+        if user:
+            return user
+        raise HTTPException(status_code=404, detail="User not found")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/users/me", response_model=UserMe)
+def get_me(current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Perfil y direcciones del usuario autenticado en una sola consulta (LEFT JOIN)."""
+    try:
+        user = (
+            db.query(UsuarioModel)
+            .options(joinedload(UsuarioModel.addresses))
+            .filter(UsuarioModel.id == current_user)
+            .first()
+        )
         if user:
             return user
         raise HTTPException(status_code=404, detail="User not found")
@@ -181,7 +285,7 @@ def get_user_profile(current_user: str = Depends(get_current_user), db: Session
 @app.get("/api/users/addresses", response_model=List[Address])
 def list_addresses(current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        addresses = db.query(AddressModel).filter(AddressModel.user_email == current_user).all()
+        addresses = db.query(AddressModel).filter(AddressModel.user_id == current_user).all()
         return addresses
     except HTTPException as e:
         raise e
@@ -192,26 +296,50 @@ def list_addresses(current_user: str = Depends(get_current_user), db: Session =
 @app.post("/api/users/addresses", response_model=Address)
 def add_address(address: Address, current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
-        # Buscar el usuario por email
-        user = db.query(UsuarioModel).filter(UsuarioModel.email == current_user).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Crear la nueva dirección usando el ID del usuario
+        # El id del usuario viene en el token; la clave ajena comprueba que sigue existiendo
         new_address = AddressModel(
             id=str(uuid.uuid4()),
-            user_id=user.id,  # Usar el ID del usuario en lugar del email
+            user_id=current_user,
             street=address.street,
             city=address.city,
             state=address.state,
             country=address.country,
-            user_email=current_user  # Esto es opcional si necesitas mantener el email
         )
         db.add(new_address)
-        db.commit()
-        db.refresh(new_address)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="User not found")
         return address
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/users:batchGet")
+def batch_get_users(batch: UserBatchRequest, current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Resumen de varios usuarios por id en una sola consulta, en el orden pedido."""
+    try:
+        ids = list(dict.fromkeys(batch.ids))
+        by_id = {
+            user.id: user
+            for user in db.query(UsuarioModel).filter(UsuarioModel.id == any_(bindparam("ids", ids, type_=ARRAY(String))))
+        }
+        return {
+            "users": [
+                UserSummary(id=user.id, username=user.username, firstname=user.firstname, lastname=user.lastname)
+                for user in (by_id[user_id] for user_id in ids if user_id in by_id)
+            ],
+            "not_found": [user_id for user_id in ids if user_id not in by_id],
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Estado del pool de conexiones (uso interno, no se expone a través de Kong)
+@app.get("/db/stats")
+def db_stats():
+    return {**pool_stats(engine), "activity": activity_buffer.stats()}
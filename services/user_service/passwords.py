@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from bcrypt import checkpw, gensalt, hashpw
+from fastapi import HTTPException
+
+
+def available_cpus() -> int:
+    # CPUs en las que puede ejecutarse el proceso; os.cpu_count() cuenta todas las del nodo.
+    # Un límite de CPU de Kubernetes (cuota CFS) no se refleja aquí: fijar PASSWORD_WORKERS.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Coste de bcrypt de los hashes nuevos (2^BCRYPT_ROUNDS iteraciones)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Hilos del threadpool de AnyIO en el que FastAPI ejecuta los endpoints síncronos (40 por defecto)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+# Procesos para bcrypt y operaciones admitidas a la vez (en curso + en cola) antes de responder 429.
+# Cada operación pendiente ocupa un hilo del threadpool esperando el resultado, así que como
+# mucho la mitad del threadpool: el resto queda para los demás endpoints.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(available_cpus())))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", str(min(PASSWORD_WORKERS * 4, THREADPOOL_SIZE // 2))))
+if PASSWORD_MAX_PENDING >= THREADPOOL_SIZE:
+    raise ValueError("PASSWORD_MAX_PENDING must be lower than THREADPOOL_SIZE")
+
+
+def _hash(password: str, rounds: int) -> str:
+    return hashpw(password.encode("utf-8"), gensalt(rounds)).decode("utf-8")
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    # Formato $2b$<coste>$<sal y hash>
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """
+    bcrypt en un pool de procesos acotado para que una ráfaga de logins no ocupe los
+    hilos ni la CPU del proceso que atiende el resto de endpoints. Si ya hay max_pending
+    operaciones en curso o en cola la petición se rechaza con 429 en lugar de esperar
+    hasta el timeout del cliente.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.rounds = rounds
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: no se heredan los hilos ni las conexiones del proceso del servidor
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many password operations in progress, retry later",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            self.start()
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(_verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
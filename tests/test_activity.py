@@ -0,0 +1,71 @@
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "user_service"))
+from activity import ActivityBuffer  # noqa: E402
+
+NOW = datetime(2024, 5, 1, 12, 0, 0)
+
+
+class FakeEngine:
+    """Guarda los lotes volcados; con fail=True la transacción falla."""
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    @contextmanager
+    def begin(self):
+        yield self
+        if self.fail:
+            raise RuntimeError("database unavailable")
+
+    def execute(self, statement, params):
+        self.batches.append(dict(zip(params["ids"], params["ts"])))
+
+
+def test_record_keeps_the_latest_mark_per_user():
+    engine = FakeEngine()
+    buffer = ActivityBuffer(engine, interval=60)
+    buffer.record("u1", NOW)
+    buffer.record("u1", NOW - timedelta(minutes=1))
+    buffer.record("u2", NOW)
+    assert buffer.flush() == 2
+    assert engine.batches == [{"u1": NOW, "u2": NOW}]
+    assert buffer.flush() == 0
+
+
+def test_flush_splits_batches():
+    engine = FakeEngine()
+    buffer = ActivityBuffer(engine, interval=60, batch_size=2)
+    for number in range(5):
+        buffer.record(f"u{number}", NOW)
+    assert buffer.flush() == 5
+    assert [len(batch) for batch in engine.batches] == [2, 2, 1]
+    assert buffer.stats() == {"pending": 0, "flushed": 5}
+
+
+def test_failed_flush_keeps_newer_marks():
+    engine = FakeEngine()
+    buffer = ActivityBuffer(engine, interval=60)
+    buffer.record("u1", NOW)
+    engine.fail = True
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    # Una marca anterior no sustituye a la que se devuelve al buffer, y una posterior sí
+    buffer.record("u1", NOW - timedelta(minutes=1))
+    buffer.record("u2", NOW)
+    buffer.record("u2", NOW + timedelta(minutes=1))
+    engine.fail = False
+    engine.batches.clear()
+    assert buffer.flush() == 2
+    assert engine.batches[-1] == {"u1": NOW, "u2": NOW + timedelta(minutes=1)}
+
+
+def test_only_known_columns():
+    with pytest.raises(ValueError):
+        ActivityBuffer(FakeEngine(), column="password")
@@ -0,0 +1,58 @@
+import os
+import sys
+
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from petstore_common.auth import KeyRing, TokenVerifier, current_user_dependency  # noqa: E402
+
+
+def make_app():
+    keyring = KeyRing({"k1": "secret-1"}, "k1")
+    verifier = TokenVerifier(keyring)
+    get_current_user = current_user_dependency(verifier)
+    app = FastAPI()
+
+    @app.post("/token/refresh")
+    def refresh(refresh_token: str):
+        try:
+            claims = verifier.verify(refresh_token, token_type="refresh")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return {"access_token": keyring.sign({"sub": claims["sub"], "typ": "access"}, 900)}
+
+    @app.get("/me")
+    def me(claims: dict = Depends(get_current_user)):
+        return {"sub": claims["sub"]}
+
+    return app, keyring, verifier
+
+
+def test_refresh_token_is_rejected_as_access_token_after_refresh():
+    app, keyring, verifier = make_app()
+    client = TestClient(app)
+    refresh_token = keyring.sign({"sub": "user1", "typ": "refresh"}, 3600)
+
+    response = client.post("/token/refresh", params={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    access_token = response.json()["access_token"]
+
+    # El token de refresco ya está en la caché del verificador
+    assert verifier.stats()["entries"] == 1
+    response = client.get("/me", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert response.status_code == 401
+
+    response = client.get("/me", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+    assert response.json() == {"sub": "user1"}
+
+
+def test_access_token_is_rejected_at_refresh_after_use():
+    app, keyring, _ = make_app()
+    client = TestClient(app)
+    access_token = keyring.sign({"sub": "user1", "typ": "access"}, 900)
+
+    assert client.get("/me", headers={"Authorization": f"Bearer {access_token}"}).status_code == 200
+    assert client.post("/token/refresh", params={"refresh_token": access_token}).status_code == 401
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "product_service"))
+from bulk import iter_csv_rows, iter_ndjson_rows, validate_product_row  # noqa: E402
+
+ROW = {"id": " p1 ", "name": "Collar", "price": "12.50", "stock": "3", "category": "c1"}
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def read_rows(parser, data: bytes, size: int = 7):
+    async def collect():
+        return [row async for row in parser(chunked(data, size))]
+    return asyncio.run(collect())
+
+
+def test_valid_row_is_ready_for_copy():
+    assert validate_product_row(ROW) == ("p1", "Collar", None, Decimal("12.50"), "c1", None, None, 3, None)
+    # Las columnas de una exportación se aceptan y se ignoran
+    assert validate_product_row({**ROW, "averagerating": "4.5", "price": 12.5, "stock": 3})[3] == Decimal("12.5")
+
+
+@pytest.mark.parametrize("changes, error", [
+    ({"id": ""}, "id is required"),
+    ({"price": "12.345"}, "price must be between"),
+    ({"price": "-1"}, "price must be between"),
+    ({"price": "NaN"}, "price must be between"),
+    ({"price": True}, "price is required"),
+    ({"stock": "2.5"}, "stock must be an integer"),
+    ({"stock": -1}, "stock must be between"),
+    ({"name": "x" * 256}, "name is longer than 255"),
+    ({"color": "red"}, "Unknown fields: color"),
+])
+def test_invalid_rows_report_the_reason(changes, error):
+    with pytest.raises(ValueError, match=error):
+        validate_product_row({**ROW, **changes})
+
+
+def test_csv_rows_span_chunks_and_quoted_newlines():
+    data = 'id,name,description,price,stock\r\np1,Collar,"Rojo\r\ny negro",12.50,3\np2,Arnés,,9,1\n'.encode()
+    rows = read_rows(iter_csv_rows, data)
+    assert [line for line, _ in rows] == [2, 4]
+    assert rows[0][1]["description"] == "Rojo\ny negro"
+    assert rows[1][1]["name"] == "Arnés"
+
+
+def test_csv_reports_bad_records_and_rejects_unknown_columns():
+    rows = read_rows(iter_csv_rows, b"id,name,price,stock\np1,Collar\n")
+    assert rows == [(2, "Expected 4 fields, got 2")]
+    with pytest.raises(HTTPException):
+        read_rows(iter_csv_rows, b"id,colour\np1,red\n")
+
+
+def test_ndjson_rows_lowercase_keys_and_report_errors():
+    data = b'{"ID": "p1", "Price": 1}\n\n[1, 2]\n{"id": \n{"id": "p2"}'
+    rows = read_rows(iter_ndjson_rows, data)
+    assert rows[0] == (1, {"id": "p1", "price": 1})
+    assert rows[1] == (3, "Expected a JSON object")
+    assert rows[2][0] == 4 and rows[2][1].startswith("Invalid JSON")
+    assert rows[3] == (5, {"id": "p2"})
+
+
+def test_invalid_utf8_is_a_bad_request():
+    with pytest.raises(HTTPException) as error:
+        read_rows(iter_ndjson_rows, b'{"id": "p1"}\n\xff\n')
+    assert error.value.status_code == 400
@@ -0,0 +1,73 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from petstore_common.cache import MemoryCache, RedisCache  # noqa: E402
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+class BrokenRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("redis down")
+        return fail
+
+
+def test_invalidate_drops_every_key_of_the_namespace():
+    for cache in (MemoryCache(), RedisCache(FakeRedis())):
+        cache.set("products", "item:p1", {"id": "p1"})
+        cache.set("categories", "tree", ["c1"])
+        cache.invalidate("products")
+        assert cache.get("products", "item:p1") is None
+        assert cache.get("categories", "tree") == ["c1"]
+
+
+def test_read_started_before_invalidation_is_not_served():
+    for cache in (MemoryCache(), RedisCache(FakeRedis())):
+        value, generation = cache.lookup("products", "item:p1")
+        assert value is None
+        # Una escritura invalida el espacio de nombres mientras se leía la base de datos
+        cache.invalidate("products")
+        cache.set("products", "item:p1", {"id": "p1", "stock": 5}, generation)
+        assert cache.get("products", "item:p1") is None
+
+        value, generation = cache.lookup("products", "item:p1")
+        cache.set("products", "item:p1", {"id": "p1", "stock": 4}, generation)
+        assert cache.get("products", "item:p1") == {"id": "p1", "stock": 4}
+
+
+def test_memory_cache_evicts_least_recently_used_and_expired():
+    cache = MemoryCache(max_entries=2, ttl=60)
+    cache.set("products", "a", 1)
+    cache.set("products", "b", 2)
+    cache.get("products", "a")
+    cache.set("products", "c", 3)
+    assert cache.get("products", "b") is None
+    assert cache.get("products", "a") == 1
+
+    expired = MemoryCache(ttl=-1)
+    expired.set("products", "a", 1)
+    assert expired.get("products", "a") is None
+    assert expired.stats()["evictions"] == 1
+
+
+def test_redis_errors_are_cache_misses():
+    cache = RedisCache(BrokenRedis())
+    cache.set("products", "item:p1", {"id": "p1"})
+    cache.invalidate("products")
+    assert cache.get("products", "item:p1") is None
+    assert cache.stats()["errors"] > 0
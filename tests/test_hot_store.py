@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "cart_service"))
+from hot_store import CartJournal, MemoryHotCartStore  # noqa: E402
+
+
+def make_cart(cart_id=1, version=1, user_id="user1", items=None):
+    return {"id": cart_id, "user_id": user_id, "items": items or [], "totalamount": "0", "version": version}
+
+
+def test_compare_and_set_checks_the_version():
+    store = MemoryHotCartStore(shards=4)
+    store.put(make_cart(version=1), dirty=False)
+    assert store.compare_and_set(make_cart(version=2), expected_version=1)
+    assert not store.compare_and_set(make_cart(version=3), expected_version=1)
+    assert store.get(1)["version"] == 2
+    assert store.stats()["conflicts"] == 1
+    assert [cart["version"] for cart in store.take_dirty()] == [2]
+    assert store.take_dirty() == []
+
+
+def test_compare_and_set_needs_the_cart_in_memory():
+    store = MemoryHotCartStore()
+    assert not store.compare_and_set(make_cart(version=2), expected_version=1)
+
+
+def test_put_if_absent_does_not_overwrite_a_newer_version():
+    store = MemoryHotCartStore()
+    assert store.put_if_absent(make_cart(version=1))
+    store.compare_and_set(make_cart(version=2), expected_version=1)
+    # Copia de PostgreSQL leída antes del cambio
+    assert not store.put_if_absent(make_cart(version=1))
+    assert store.get(1)["version"] == 2
+    assert store.dirty_count() == 1
+
+
+def test_expire_keeps_dirty_carts():
+    store = MemoryHotCartStore(ttl=-1)
+    store.put(make_cart(cart_id=1), dirty=False)
+    store.put(make_cart(cart_id=2))
+    assert store.expire() == 1
+    assert store.get(1) is None
+    assert store.get(2) is not None
+
+
+def test_journal_replays_the_last_state(tmp_path):
+    journal = CartJournal(str(tmp_path), fsync=False)
+    store = MemoryHotCartStore(journal=journal)
+    store.put(make_cart(cart_id=1, version=1))
+    store.compare_and_set(make_cart(cart_id=1, version=2, items=[{"product_id": "p1", "quantity": 1}]), 1)
+    store.put(make_cart(cart_id=2, version=1))
+    store.delete(2)
+    # Un carrito leído de PostgreSQL no se anota
+    store.put(make_cart(cart_id=3, version=5), dirty=False)
+    journal.close()
+
+    replayed = CartJournal(str(tmp_path), fsync=False).replay()
+    assert replayed == {1: make_cart(cart_id=1, version=2, items=[{"product_id": "p1", "quantity": 1}]), 2: None}
+
+
+def test_journal_skips_torn_lines_and_discards_flushed_segments(tmp_path):
+    journal = CartJournal(str(tmp_path), fsync=False)
+    journal.append({"op": "put", "cart": make_cart(cart_id=1, version=1)})
+    flushed = journal.rotate()
+    journal.append({"op": "put", "cart": make_cart(cart_id=2, version=1)})
+    journal.close()
+    with open(os.path.join(str(tmp_path), f"{flushed + 1:012d}.ndjson"), "a") as segment:
+        segment.write('{"op": "put", "cart": {"id"')
+
+    journal = CartJournal(str(tmp_path), fsync=False)
+    journal.discard_through(flushed)
+    assert list(journal.replay()) == [2]
+
+
+def test_concurrent_writes_are_journaled_in_version_order(tmp_path):
+    journal = CartJournal(str(tmp_path), fsync=False)
+    store = MemoryHotCartStore(journal=journal)
+    store.put(make_cart(version=0))
+
+    def bump():
+        for _ in range(200):
+            while True:
+                current = store.get(1)
+                if store.compare_and_set(make_cart(version=current["version"] + 1), current["version"]):
+                    break
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert CartJournal(str(tmp_path), fsync=False).replay()[1]["version"] == 800
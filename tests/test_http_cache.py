@@ -0,0 +1,59 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+from starlette.requests import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from petstore_common.http_cache import (  # noqa: E402
+    http_date, is_not_modified, make_etag, not_modified, validator_headers,
+)
+
+UPDATED = datetime(2024, 5, 1, 12, 30, 15, 250000)
+
+
+def request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_etag_depends_on_every_part():
+    assert make_etag("reviews", "p1", UPDATED, 3) == make_etag("reviews", "p1", UPDATED, 3)
+    # Borrar una fila cambia el número de filas aunque max(updatedat) no cambie
+    assert make_etag("reviews", "p1", UPDATED, 3) != make_etag("reviews", "p1", UPDATED, 2)
+
+
+def test_if_none_match_uses_weak_comparison():
+    etag = make_etag("categories", UPDATED)
+    assert is_not_modified(request(if_none_match=etag), etag)
+    assert is_not_modified(request(if_none_match=f'"other", W/{etag}'), etag)
+    assert is_not_modified(request(if_none_match="*"), etag)
+    assert not is_not_modified(request(if_none_match='"other"'), etag)
+    assert not is_not_modified(request(), etag)
+
+
+def test_if_modified_since_is_ignored_when_there_is_an_etag():
+    etag = make_etag("categories", UPDATED)
+    later = http_date(UPDATED + timedelta(hours=1))
+    assert not is_not_modified(request(if_modified_since=later), etag, UPDATED)
+    assert not is_not_modified(request(if_none_match='"other"', if_modified_since=later), etag, UPDATED)
+
+
+def test_if_modified_since_without_etag():
+    assert is_not_modified(request(if_modified_since=http_date(UPDATED)), "", UPDATED)
+    earlier = http_date(UPDATED - timedelta(seconds=1))
+    assert not is_not_modified(request(if_modified_since=earlier), "", UPDATED)
+    assert not is_not_modified(request(if_modified_since="not a date"), "", UPDATED)
+
+
+def test_not_modified_response_repeats_validators():
+    etag = make_etag("tree", UPDATED)
+    response = not_modified(etag, UPDATED)
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["last-modified"] == "Wed, 01 May 2024 12:30:15 GMT"
+    assert validator_headers(etag) == {"ETag": etag, "Cache-Control": "no-cache"}
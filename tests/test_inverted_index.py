@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "search_service"))
+from inverted_index import InvertedIndex, tokenize  # noqa: E402
+
+
+def make_index():
+    index = InvertedIndex()
+    index.bulk_load([
+        ("product", "p1", "Arnés para perro", "Arnés acolchado para paseos"),
+        ("product", "p2", "Comida para perro", "Pienso con pollo"),
+        ("product", "p3", "Rascador para gato", "Incluye juguete para perro"),
+        ("category", "c1", "Perros", None),
+    ])
+    return index
+
+
+def test_tokenize_normalizes_and_stems():
+    assert tokenize("Los Collares del Perro") == tokenize("collar perro")
+
+
+def test_name_matches_rank_above_description_matches():
+    ranked = [result["id"] for result in make_index().search("perro", type="product")]
+    assert ranked[-1] == "p3"
+    assert set(ranked) == {"p1", "p2", "p3"}
+
+
+def test_term_frequency_raises_rank():
+    results = make_index().search("arnes comida")
+    # "arnes" aparece en el nombre y la descripción de p1, "comida" sólo en el nombre de p2
+    assert [result["id"] for result in results] == ["p1", "p2"]
+    assert results[0]["rank"] > results[1]["rank"] > 0
+
+
+def test_prefix_expands_last_term():
+    index = make_index()
+    assert index.search("comi") == []
+    assert [result["id"] for result in index.search("comi", prefix=True)] == ["p2"]
+
+
+def test_delete_and_update_drop_old_terms():
+    index = make_index()
+    index.delete("product", "p2")
+    index.upsert("product", "p1", "Collar luminoso", None)
+    assert [result["id"] for result in index.search("comida arnes")] == []
+    assert [result["id"] for result in index.search("collar")] == ["p1"]
+    assert len(index) == 3
+
+
+def test_retain_removes_missing_ids_of_one_type():
+    index = make_index()
+    assert index.retain("product", ["p1"]) == 2
+    assert sorted(index.ids("product")) == ["p1"]
+    assert index.ids("category") == ["c1"]
+    assert index.search("gato") == []
+
+
+def test_compaction_keeps_live_documents():
+    index = make_index()
+    for _ in range(10):
+        index.upsert("product", "p2", "Comida para perro", "Otra descripción")
+        index.upsert("product", "p2", "Comida para perro", "Pienso con pollo")
+    assert len(index.doc_keys) < 10
+    assert [result["id"] for result in index.search("pollo")] == ["p2"]
@@ -0,0 +1,75 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "review_service"))
+from ratings import (  # noqa: E402
+    APPLY_RATING_DELTA_SQL, LOCK_PRODUCTS_SQL, RECOMPUTE_RATINGS_SQL, apply_rating_change,
+)
+
+
+class Result:
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+    def scalar(self):
+        return self.row
+
+
+class FakeSession:
+    """Anota las sentencias ejecutadas; has_aggregate indica si existe la fila de producto_ratings."""
+
+    def __init__(self, has_aggregate=True):
+        self.has_aggregate = has_aggregate
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+        if statement is APPLY_RATING_DELTA_SQL:
+            return Result(("p1",) if self.has_aggregate else None)
+        return Result(1)
+
+
+def test_new_review_adds_one_to_count_sum_and_star():
+    db = FakeSession()
+    apply_rating_change(db, "p1", added=4)
+    assert db.executed == [(APPLY_RATING_DELTA_SQL, {
+        "productid": "p1", "count": 1, "sum": 4, "r1": 0, "r2": 0, "r3": 0, "r4": 1, "r5": 0,
+    })]
+
+
+def test_changed_rating_moves_between_stars():
+    db = FakeSession()
+    apply_rating_change(db, "p1", added=2, removed=5)
+    params = db.executed[0][1]
+    assert (params["count"], params["sum"]) == (0, -3)
+    assert [params[f"r{star}"] for star in range(1, 6)] == [0, 1, 0, 0, -1]
+
+
+def test_deleted_review_subtracts():
+    db = FakeSession()
+    apply_rating_change(db, "p1", removed=3)
+    params = db.executed[0][1]
+    assert (params["count"], params["sum"], params["r3"]) == (-1, -3, -1)
+
+
+def test_unchanged_rating_does_nothing():
+    db = FakeSession()
+    apply_rating_change(db, "p1", added=4, removed=4)
+    assert db.executed == []
+
+
+def test_missing_aggregate_row_is_recomputed():
+    db = FakeSession(has_aggregate=False)
+    apply_rating_change(db, "p1", removed=3)
+    assert [statement for statement, _ in db.executed] == [
+        APPLY_RATING_DELTA_SQL, LOCK_PRODUCTS_SQL, RECOMPUTE_RATINGS_SQL,
+    ]
+    assert db.executed[-1][1] == {"ids": ["p1"]}
+
+
+def test_delta_never_inserts_aggregate_rows():
+    # Insertar la variación de un borrado dejaría contadores negativos
+    assert "INSERT" not in str(APPLY_RATING_DELTA_SQL)
@@ -0,0 +1,33 @@
+import importlib.util
+import os
+import sys
+
+SEARCH_SERVICE = os.path.join(os.path.dirname(__file__), "..", "services", "search_service")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+sys.path.insert(0, SEARCH_SERVICE)
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+
+# Cada servicio tiene su app.py: se carga con un nombre propio
+spec = importlib.util.spec_from_file_location("search_app", os.path.join(SEARCH_SERVICE, "app.py"))
+search_app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(search_app)
+
+
+def test_escape_like_escapes_wildcards_and_backslash():
+    assert search_app.escape_like("50%_off\\") == "50\\%\\_off\\\\"
+    assert search_app.escape_like("collar") == "collar"
+
+
+def test_fulltext_matches_typos_per_word():
+    sql = str(search_app.search_sql("productos", "fulltext"))
+    assert "word_similarity(:query, lower(name))" in sql
+    assert ":query <% lower(name)" in sql
+    assert '"categorias"' not in sql
+    assert sql.endswith("ORDER BY rank DESC, type, id LIMIT :limit OFFSET :offset")
+
+
+def test_all_types_union_both_tables():
+    sql = str(search_app.search_sql("all", "prefix"))
+    assert sql.count("UNION ALL") == 1
+    assert '"productos"' in sql and '"categorias"' in sql
+    assert "lower(name) LIKE :prefix" in sql